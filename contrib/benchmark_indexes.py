@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+
+# This file is part of Tautulli.
+#
+#  Tautulli is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Tautulli is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Tautulli.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Benchmark the hot Tautulli database queries before and after the managed indexes are created.
+
+Builds a synthetic database with the given number of history rows in a temporary directory,
+then times each query in database.HOT_QUERIES without and with database.MANAGED_INDEXES.
+
+Usage: python contrib/benchmark_indexes.py [rows]
+"""
+
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+PROG_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(PROG_DIR, 'lib'))
+sys.path.insert(0, PROG_DIR)
+
+from plexpy import database
+
+
+def build_database(path, rows):
+    conn = sqlite3.connect(path)
+    c = conn.cursor()
+
+    c.execute('CREATE TABLE session_history (id INTEGER PRIMARY KEY AUTOINCREMENT, reference_id INTEGER, '
+              'started INTEGER, stopped INTEGER, server_id INTEGER, rating_key INTEGER, user_id INTEGER, '
+              'media_type TEXT, paused_counter INTEGER DEFAULT 0)')
+    c.execute('CREATE TABLE session_history_metadata (id INTEGER PRIMARY KEY, rating_key INTEGER, '
+              'server_id INTEGER, section_id INTEGER, title TEXT)')
+    c.execute('CREATE TABLE sessions (id INTEGER PRIMARY KEY AUTOINCREMENT, session_key INTEGER, '
+              'rating_key INTEGER, server_id INTEGER, user_id INTEGER, started INTEGER)')
+
+    now = int(time.time())
+    history = []
+    metadata = []
+    for i in range(1, rows + 1):
+        started = now - random.randint(0, 5 * 365 * 86400)
+        server_id = random.randint(1, 3)
+        rating_key = random.randint(1, 50000)
+        history.append((i, started, started + random.randint(60, 7200), server_id, rating_key,
+                        random.randint(1, 200), 'episode'))
+        metadata.append((i, rating_key, server_id, random.randint(1, 10), 'Title %d' % rating_key))
+
+    c.executemany('INSERT INTO session_history (reference_id, started, stopped, server_id, rating_key, '
+                  'user_id, media_type) VALUES (?, ?, ?, ?, ?, ?, ?)', history)
+    c.executemany('INSERT INTO session_history_metadata (id, rating_key, server_id, section_id, title) '
+                  'VALUES (?, ?, ?, ?, ?)', metadata)
+    c.executemany('INSERT INTO sessions (session_key, rating_key, server_id, user_id, started) '
+                  'VALUES (?, ?, ?, ?, ?)',
+                  [(i, random.randint(1, 50000), random.randint(1, 3), random.randint(1, 200), now)
+                   for i in range(1, 200)])
+    conn.commit()
+    return conn
+
+
+def run_queries(conn, repeat=5):
+    timings = {}
+    for name, query, args in database.HOT_QUERIES:
+        plan = [row[-1] for row in conn.execute('EXPLAIN QUERY PLAN ' + query, args)]
+        start = time.time()
+        for _ in range(repeat):
+            conn.execute(query, args).fetchall()
+        timings[name] = ((time.time() - start) * 1000 / repeat, plan)
+    return timings
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 500000
+    tmp_dir = tempfile.mkdtemp()
+
+    try:
+        print('Building a synthetic database with %d history rows...' % rows)
+        conn = build_database(os.path.join(tmp_dir, 'benchmark.db'), rows)
+
+        before = run_queries(conn)
+        database.create_indexes(conn.cursor())
+        conn.execute('ANALYZE')
+        after = run_queries(conn)
+
+        print('%-24s %12s %12s  %s' % ('query', 'before (ms)', 'after (ms)', 'plan after'))
+        for name, query, args in database.HOT_QUERIES:
+            print('%-24s %12.3f %12.3f  %s' % (name, before[name][0], after[name][0], '; '.join(after[name][1])))
+
+        conn.close()
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    main()
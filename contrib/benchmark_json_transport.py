@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+
+# This file is part of Tautulli.
+#
+#  Tautulli is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Tautulli is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Tautulli.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Benchmark the time to parse and read a PMS response received as XML and as JSON.
+
+Both responses are walked with the same code, the way the PmsConnect parsers read them
+through helpers.get_xml_attr, and the results are checked to be identical.
+
+Record fixtures from a server with the same request, once with 'Accept: application/json':
+    curl -o metadata.xml 'http://<server>:32400/library/metadata/<rating_key>?X-Plex-Token=<token>'
+    curl -o metadata.json -H 'Accept: application/json' 'http://<server>:32400/library/metadata/<rating_key>?X-Plex-Token=<token>'
+
+Usage: python contrib/benchmark_json_transport.py [response.xml response.json] [repeat]
+Without fixtures a synthetic /status/sessions response with 50 sessions is used.
+"""
+
+import json
+import os
+import sys
+import time
+
+PROG_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(PROG_DIR, 'lib'))
+sys.path.insert(0, PROG_DIR)
+
+from plexpy import helpers
+
+ITEM_ATTRIBUTES = ('ratingKey', 'type', 'title', 'grandparentTitle', 'index', 'year', 'duration', 'viewOffset')
+MEDIA_ATTRIBUTES = ('id', 'container', 'bitrate', 'videoCodec', 'audioCodec', 'optimizedForStreaming')
+STREAM_ATTRIBUTES = ('id', 'streamType', 'codec', 'bitrate', 'selected')
+CHILD_ATTRIBUTES = (('User', 'title'), ('Player', 'local'), ('Session', 'bandwidth'))
+
+
+def build_responses(sessions):
+    items = []
+    for i in range(1, sessions + 1):
+        items.append({'type': 'episode', 'ratingKey': str(i), 'title': 'Episode %d' % i,
+                      'grandparentTitle': 'Show %d' % (i % 7), 'index': i % 20 + 1, 'year': 2000 + i % 20,
+                      'duration': 1800000, 'viewOffset': i * 1000,
+                      'Media': [{'id': i, 'container': 'mkv', 'bitrate': 8000, 'videoCodec': 'h264',
+                                 'audioCodec': 'ac3', 'optimizedForStreaming': False,
+                                 'Part': [{'id': i, 'file': '/media/Show %d/%d.mkv' % (i % 7, i),
+                                           'Stream': [{'id': i * 10 + s, 'streamType': s + 1,
+                                                       'codec': ('h264', 'ac3', 'srt')[s],
+                                                       'bitrate': (7000, 640, 0)[s], 'selected': True}
+                                                      for s in range(3)]}]}],
+                      'Genre': [{'tag': 'Drama'}, {'tag': 'Comedy'}],
+                      'User': {'id': i % 5, 'title': 'User %d' % (i % 5)},
+                      'Player': {'title': 'Player %d' % i, 'state': 'playing', 'local': True},
+                      'Session': {'id': 'session%d' % i, 'bandwidth': 8000, 'location': 'lan'}})
+
+    def to_xml(tag, data):
+        attrs = []
+        children = []
+        for key, value in data.items():
+            if isinstance(value, dict):
+                value = [value]
+            if isinstance(value, list):
+                children.extend(to_xml(key, child) for child in value)
+            elif isinstance(value, bool):
+                attrs.append('%s="%d"' % (key, value))
+            else:
+                attrs.append('%s="%s"' % (key, value))
+        return '<%s %s>%s</%s>' % (tag, ' '.join(attrs), ''.join(children), tag)
+
+    xml_response = '<?xml version="1.0" encoding="UTF-8"?><MediaContainer size="%d">%s</MediaContainer>' \
+                   % (sessions, ''.join(to_xml('Video', item) for item in items))
+    json_response = json.dumps({'MediaContainer': {'size': sessions, 'Metadata': items}})
+
+    return xml_response.encode('utf-8'), json_response.encode('utf-8')
+
+
+def read_response(xml_head):
+    output = []
+    for a in xml_head.getElementsByTagName('MediaContainer'):
+        for tag in ('Directory', 'Video', 'Track', 'Photo'):
+            for item in a.getElementsByTagName(tag):
+                item_info = {attr: helpers.get_xml_attr(item, attr) for attr in ITEM_ATTRIBUTES}
+                item_info['genres'] = [helpers.get_xml_attr(g, 'tag') for g in item.getElementsByTagName('Genre')]
+                item_info['media'] = [{attr: helpers.get_xml_attr(m, attr) for attr in MEDIA_ATTRIBUTES}
+                                      for m in item.getElementsByTagName('Media')]
+                item_info['streams'] = [{attr: helpers.get_xml_attr(s, attr) for attr in STREAM_ATTRIBUTES}
+                                        for s in item.getElementsByTagName('Stream')]
+                for child, attr in CHILD_ATTRIBUTES:
+                    nodes = item.getElementsByTagName(child)
+                    item_info[child] = helpers.get_xml_attr(nodes[0], attr) if nodes else ''
+                output.append(item_info)
+    return output
+
+
+def measure(parse, response, repeat):
+    start = time.time()
+    for _ in range(repeat):
+        result = read_response(parse(response))
+    return result, (time.time() - start) * 1000 / repeat
+
+
+def main():
+    args = sys.argv[1:]
+    if len(args) >= 2:
+        with open(args[0], 'rb') as f:
+            xml_response = f.read()
+        with open(args[1], 'rb') as f:
+            json_response = f.read()
+        args = args[2:]
+    else:
+        xml_response, json_response = build_responses(50)
+
+    repeat = int(args[0]) if args else 100
+
+    xml_result, xml_time = measure(helpers.parse_xml, xml_response, repeat)
+    json_result, json_time = measure(helpers.parse_json_xml, json_response, repeat)
+
+    if xml_result != json_result:
+        print('Warning: the XML and JSON responses were read differently.')
+
+    print('%-6s %12s %14s' % ('format', 'size (KB)', 'parse (ms)'))
+    print('%-6s %12.1f %14.3f' % ('xml', len(xml_response) / 1024.0, xml_time))
+    print('%-6s %12.1f %14.3f' % ('json', len(json_response) / 1024.0, json_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+
+# This file is part of Tautulli.
+#
+#  Tautulli is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Tautulli is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Tautulli.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Benchmark the peak memory and time of parsing a large library listing with the DOM parser and the streaming parser.
+
+Builds a synthetic PMS /library/sections/<id>/all response with the given number of items in memory,
+then reads the same attributes from every item with helpers.parse_xml and with helpers.iterparse_xml.
+
+Usage: python contrib/benchmark_xml_parsing.py [items]
+"""
+
+import os
+import sys
+import time
+import tracemalloc
+
+PROG_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(PROG_DIR, 'lib'))
+sys.path.insert(0, PROG_DIR)
+
+from plexpy import helpers
+
+ATTRIBUTES = ('ratingKey', 'title', 'titleSort', 'year', 'thumb', 'addedAt')
+
+
+def build_response(items):
+    video = ('<Video ratingKey="{0}" key="/library/metadata/{0}" type="movie" title="Movie {0}" '
+             'titleSort="Movie {0}" year="{1}" thumb="/library/metadata/{0}/thumb/1500000000" '
+             'addedAt="1500000000" summary="A synthetic movie used to benchmark the XML parser.">'
+             '<Media id="{0}" bitrate="8000" container="mkv" videoCodec="h264" videoResolution="1080" '
+             'videoFrameRate="24p" audioCodec="ac3" audioChannels="6">'
+             '<Part id="{0}" file="/media/movies/Movie {0}.mkv" size="4000000000" container="mkv"/>'
+             '</Media>'
+             '<Genre tag="Drama"/><Director tag="Director {1}"/><Role tag="Actor {0}"/>'
+             '</Video>')
+
+    parts = ['<?xml version="1.0" encoding="UTF-8"?>',
+             '<MediaContainer size="%d" totalSize="%d" librarySectionID="1" viewGroup="movie">' % (items, items)]
+    parts.extend(video.format(i, 1950 + i % 70) for i in range(1, items + 1))
+    parts.append('</MediaContainer>')
+    return ''.join(parts).encode('utf-8')
+
+
+def parse_dom(response):
+    children = []
+    xml_head = helpers.parse_xml(response).getElementsByTagName('MediaContainer')
+    for a in xml_head:
+        for item in a.getElementsByTagName('Video'):
+            children.append({attr: helpers.get_xml_attr(item, attr) for attr in ATTRIBUTES})
+    return children
+
+
+def parse_stream(response):
+    children = []
+    library_xml = helpers.iterparse_xml(response)
+    next(library_xml)
+    for item in library_xml:
+        if item.tag == 'Video':
+            children.append({attr: helpers.get_xml_attr(item, attr) for attr in ATTRIBUTES})
+    return children
+
+
+def measure(func, response):
+    tracemalloc.start()
+    start = time.time()
+    result = func(response)
+    elapsed = time.time() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def main():
+    items = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+    print('Building a synthetic library response with %d items...' % items)
+    response = build_response(items)
+    print('Response size: %.1f MB' % (len(response) / 1024.0 / 1024.0))
+
+    dom_result, dom_time, dom_peak = measure(parse_dom, response)
+    stream_result, stream_time, stream_peak = measure(parse_stream, response)
+
+    if dom_result != stream_result:
+        print('Warning: the parsers returned different results.')
+
+    print('%-10s %12s %16s' % ('parser', 'time (s)', 'peak memory (MB)'))
+    print('%-10s %12.3f %16.1f' % ('minidom', dom_time, dom_peak / 1024.0 / 1024.0))
+    print('%-10s %12.3f %16.1f' % ('iterparse', stream_time, stream_peak / 1024.0 / 1024.0))
+
+
+if __name__ == '__main__':
+    main()
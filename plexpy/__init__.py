@@ -35,9 +35,11 @@ from apscheduler.triggers.interval import IntervalTrigger
 #from UniversalAnalytics import Tracker
 
 from plexpy import activity_handler
+from plexpy import activity_processor
 from plexpy import common
 from plexpy import database
 from plexpy import datafactory
+from plexpy import http_handler
 from plexpy import libraries
 from plexpy import logger
 from plexpy import mobile_app
@@ -45,6 +47,7 @@ from plexpy import newsletters
 from plexpy import newsletter_handler
 from plexpy import notification_handler
 from plexpy import notifiers
+from plexpy import pmsconnect
 from plexpy import versioncheck
 from plexpy.config import Config
 from plexpy.servers import plexServer, plexServers
@@ -433,6 +436,18 @@ def initialize_scheduler():
                        'args': [True, True],
                        })
 
+    SCHED_LIST.append({'name': 'Checkpoint live session states',
+                       'time': {'hours': 0, 'minutes': 0, 'seconds': max(CONFIG.SESSION_CHECKPOINT_INTERVAL, 10)},
+                       'func': activity_processor.flush_live_states,
+                       'args': [None, None, True],
+                       })
+
+    SCHED_LIST.append({'name': 'Clean up session metadata cache',
+                       'time': {'hours': 1, 'minutes': 0, 'seconds': 0},
+                       'func': database.cleanup_session_metadata,
+                       'args': [],
+                       })
+
     schedule_joblist(lock=SCHED_LOCK, scheduler=SCHED, jobList=SCHED_LIST)
 
 
@@ -497,6 +512,11 @@ def start():
             PMS_SERVERS = plexServers()
             PMS_SERVERS.start()
 
+            # Continue getting any file sizes which were interrupted
+            resume_thread = threading.Thread(target=libraries.resume_media_info_file_sizes)
+            resume_thread.daemon = True
+            resume_thread.start()
+
         # TODO: JLN - Handle this
         # Initialize System Analytics
         # if CONFIG.SYSTEM_ANALYTICS:
@@ -786,6 +806,60 @@ def dbcheck():
         ')'
     )
 
+    # session_history_rollup table :: This table keeps hourly play totals for the graphs
+    rebuild_rollups = not c_db.execute(
+        'SELECT name FROM sqlite_master WHERE type = "table" AND name = "session_history_rollup"'
+    ).fetchone()
+    c_db.execute(
+        'CREATE TABLE IF NOT EXISTS session_history_rollup (id INTEGER PRIMARY KEY AUTOINCREMENT, '
+        'date TEXT, hour INTEGER, server_id INTEGER, user_id INTEGER, media_type TEXT, '
+        'plays INTEGER DEFAULT 0, grouped_plays INTEGER DEFAULT 0, duration INTEGER DEFAULT 0)'
+    )
+    c_db.execute(
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_session_history_rollup_key '
+        'ON session_history_rollup (date, hour, server_id, user_id, media_type)'
+    )
+
+    # session_metadata_cache table :: This table keeps the metadata of the active sessions
+    c_db.execute(
+        'CREATE TABLE IF NOT EXISTS session_metadata_cache (id INTEGER PRIMARY KEY AUTOINCREMENT, '
+        'server_id INTEGER, session_key INTEGER, cache_time INTEGER, metadata TEXT)'
+    )
+    c_db.execute(
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_session_metadata_cache_key '
+        'ON session_metadata_cache (server_id, session_key)'
+    )
+
+    # Move the metadata cache files from earlier versions into the session_metadata_cache table
+    database.import_session_metadata_files(c_db)
+
+    # library_media_info table :: This table keeps the media info of the library items shown in the media info tables
+    c_db.execute(
+        'CREATE TABLE IF NOT EXISTS library_media_info (id INTEGER PRIMARY KEY AUTOINCREMENT, '
+        'server_id INTEGER, section_id INTEGER, parent_key INTEGER DEFAULT 0, refreshed_at REAL, '
+        'library_id INTEGER, section_type TEXT, added_at TEXT, updated_at TEXT, media_type TEXT, rating_key INTEGER, '
+        'parent_rating_key TEXT, grandparent_rating_key TEXT, title TEXT, sort_title TEXT, year TEXT, '
+        'media_index TEXT, parent_media_index TEXT, thumb TEXT, container TEXT, bitrate TEXT, video_codec TEXT, '
+        'video_resolution TEXT, video_framerate TEXT, audio_codec TEXT, audio_channels TEXT, file_size TEXT)'
+    )
+    c_db.execute(
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_library_media_info_key '
+        'ON library_media_info (server_id, section_id, parent_key, rating_key)'
+    )
+    c_db.execute(
+        'CREATE INDEX IF NOT EXISTS idx_library_media_info_sort_title '
+        'ON library_media_info (server_id, section_id, parent_key, sort_title COLLATE NOCASE)'
+    )
+
+    # Upgrade library_media_info table from earlier versions
+    try:
+        c_db.execute('SELECT updated_at FROM library_media_info')
+    except sqlite3.OperationalError:
+        logger.debug(u"Altering database. Updating database table library_media_info.")
+        c_db.execute(
+            'ALTER TABLE library_media_info ADD COLUMN updated_at TEXT'
+        )
+
     # Upgrade sessions table from earlier versions
     try:
         c_db.execute('SELECT started FROM sessions')
@@ -1852,6 +1926,18 @@ def dbcheck():
         'CREATE UNIQUE INDEX IF NOT EXISTS idx_themoviedb_lookup ON themoviedb_lookup (rating_key)'
     )
 
+    # Upgrade sessions table from earlier versions (unique stream keys for native upserts)
+    result = c_db.execute('SELECT name FROM sqlite_master WHERE type = "index" AND name = "idx_sessions_key"').fetchone()
+    if not result:
+        logger.debug(u"Altering database. Removing duplicate rows from sessions table.")
+        c_db.execute(
+            'DELETE FROM sessions WHERE id NOT IN '
+            '(SELECT MAX(id) FROM sessions GROUP BY server_id, session_key, rating_key)'
+        )
+        c_db.execute(
+            'CREATE UNIQUE INDEX IF NOT EXISTS idx_sessions_key ON sessions (server_id, session_key, rating_key)'
+        )
+
     # Create servers table and migrate library_sections and session_history_metadata
     try:
         result = c_db.execute('PRAGMA TABLE_INFO(library_sections)').fetchall()
@@ -2117,6 +2203,12 @@ def dbcheck():
             logger.debug(u"Multi-Server Migration - Clearing Cache.")
             [os.remove(os.path.join(CONFIG.CACHE_DIR, f)) for f in os.listdir(CONFIG.CACHE_DIR)
              if f.endswith('.json')]
+            c_db.execute(
+                'DELETE FROM session_metadata_cache'
+            )
+            c_db.execute(
+                'DELETE FROM library_media_info'
+            )
             for d in ['/images/', '/session_metadata/']:
                 if os.path.exists(CONFIG.CACHE_DIR + d):
                     [os.remove(os.path.join(CONFIG.CACHE_DIR + d, f))
@@ -2165,9 +2257,23 @@ def dbcheck():
     except sqlite3.OperationalError as e:
         logger.warn(u"Multi-Server Migration -  Database Modifications failed.")
 
+    # Move the media info cache files from earlier versions into the library_media_info table
+    libraries.import_media_info_files(c_db)
+
+    # Create the indexes for the hot query filters after any tables have been rebuilt
+    database.create_indexes(c_db)
+
+    # Build the graph rollups from the existing history the first time
+    if rebuild_rollups:
+        logger.debug(u"Altering database. Building session_history_rollup table.")
+        database.rebuild_history_rollups(cursor=c_db)
+
     conn_db.commit()
     c_db.close()
 
+    # Indexes may have changed, so the upsert targets need to be looked up again
+    database.clear_schema_cache()
+
     # Migrate poster_urls to imgur_lookup table
     try:
         db = database.MonitorDatabase()
@@ -2216,6 +2322,18 @@ def shutdown(restart=False, update=False, checkout=False):
 
     CONFIG.write()
 
+    # Write the in-memory session progress before closing the database
+    activity_processor.flush_live_states()
+
+    # Close the pooled database connections
+    database.close_connections()
+
+    # Stop the bulk PMS request workers
+    pmsconnect.clear_request_executors()
+
+    # Close the pooled HTTP connections
+    http_handler.clear_pools()
+
     if not restart and not update and not checkout:
         logger.info(u"Tautulli is shutting down...")
 
@@ -14,7 +14,6 @@
 #  along with Tautulli.  If not, see <http://www.gnu.org/licenses/>.
 
 import datetime
-import os
 import time
 
 from apscheduler.schedulers.background import BackgroundScheduler
@@ -22,10 +21,12 @@ from apscheduler.triggers.date import DateTrigger
 
 import plexpy
 from plexpy import activity_processor
+from plexpy import database
 from plexpy import datafactory
 from plexpy import helpers
 from plexpy import logger
 from plexpy import notification_handler
+from plexpy import pmsconnect
 
 ACTIVITY_SCHED = BackgroundScheduler()
 
@@ -73,6 +74,9 @@ class ActivityHandler(object):
         if session is None:
             session = self.get_live_session()
 
+        # Write any pending progress before the row is replaced
+        self.flush_live_state()
+
         if session:
             # Update our session temp table values
             ap = activity_processor.ActivityProcessor(server=self.server)
@@ -80,6 +84,11 @@ class ActivityHandler(object):
 
         self.set_session_state()
 
+        activity_processor.refresh_live_state(self.server, self.get_session_key())
+
+    def flush_live_state(self):
+        activity_processor.flush_live_states(server_id=self.server.CONFIG.ID, session_key=self.get_session_key())
+
     def set_session_state(self):
         ap = activity_processor.ActivityProcessor(server=self.server)
         ap.set_session_state(session_key=self.get_session_key(),
@@ -122,6 +131,8 @@ class ActivityHandler(object):
             logger.debug(u"Tautulli ActivityHandler :: %s: Session %s %sstopped."
                          % (self.server.CONFIG.PMS_NAME, str(self.get_session_key()), 'force ' if force_stop else ''))
 
+            self.flush_live_state()
+
             # Set the session last_paused timestamp
             ap = activity_processor.ActivityProcessor(server=self.server)
             ap.set_session_last_paused(session_key=self.get_session_key(), timestamp=None)
@@ -156,9 +167,19 @@ class ActivityHandler(object):
 
     def on_pause(self, still_paused=False):
         if self.is_valid_session():
-            if not still_paused:
-                logger.debug(u"Tautulli ActivityHandler :: %s: Session %s paused."
-                             % (self.server.CONFIG.PMS_NAME, str(self.get_session_key())))
+            if still_paused:
+                # Only keep the paused time in memory, it is written on the next checkpoint or state change
+                live_state = activity_processor.get_live_state(self.server, self.get_session_key())
+                if live_state:
+                    timestamp = int(time.time())
+                    live_state.still_paused(timestamp)
+                    live_state.progress(self.timeline['state'], self.timeline['viewOffset'], timestamp)
+                return
+
+            logger.debug(u"Tautulli ActivityHandler :: %s: Session %s paused."
+                         % (self.server.CONFIG.PMS_NAME, str(self.get_session_key())))
+
+            self.flush_live_state()
 
             # Set the session last_paused timestamp
             ap = activity_processor.ActivityProcessor(server=self.server)
@@ -170,14 +191,15 @@ class ActivityHandler(object):
             # Retrieve the session data from our temp table
             db_session = ap.get_session_by_key(session_key=self.get_session_key())
 
-            if not still_paused:
-                plexpy.NOTIFY_QUEUE.put({'stream_data': db_session.copy(), 'notify_action': 'on_pause'})
+            plexpy.NOTIFY_QUEUE.put({'stream_data': db_session.copy(), 'notify_action': 'on_pause'})
 
     def on_resume(self):
         if self.is_valid_session():
             logger.debug(u"Tautulli ActivityHandler :: %s: Session %s resumed."
                          % (self.server.CONFIG.PMS_NAME, str(self.get_session_key())))
 
+            self.flush_live_state()
+
             # Set the session last_paused timestamp
             ap = activity_processor.ActivityProcessor(server=self.server)
             ap.set_session_last_paused(session_key=self.get_session_key(), timestamp=None)
@@ -206,32 +228,31 @@ class ActivityHandler(object):
 
     def on_buffer(self):
         if self.is_valid_session():
+            self.flush_live_state()
+
             ap = activity_processor.ActivityProcessor(server=self.server)
 
-            # Increment our buffer count
-            ap.increment_session_buffer_count(session_key=self.get_session_key())
+            live_state = activity_processor.get_live_state(self.server, self.get_session_key())
+            if not live_state:
+                return
+
+            # Increment our buffer count and check the buffer warning in one transaction
+            buffer_values = ap.update_session_counters(buffering_ids=[live_state.row_id]).get(live_state.row_id)
+            if not buffer_values:
+                return
 
-            # Get our current buffer count
-            current_buffer_count = ap.get_session_buffer_count(self.get_session_key())
             logger.debug(u"Tautulli ActivityHandler :: %s: Session %s buffer count is %s." %
-                         (self.server.CONFIG.PMS_NAME, self.get_session_key(), current_buffer_count))
+                         (self.server.CONFIG.PMS_NAME, self.get_session_key(), buffer_values['buffer_count']))
 
-            # Get our last triggered time
-            buffer_last_triggered = ap.get_session_buffer_trigger_time(self.get_session_key())
+            if buffer_values['buffer_last_triggered']:
+                logger.debug(u"Tautulli ActivityHandler :: %s: Session %s buffer last triggered at %s." %
+                             (self.server.CONFIG.PMS_NAME, self.get_session_key(),
+                              buffer_values['buffer_last_triggered']))
 
             # Update the session state and viewOffset
             self.update_db_session()
 
-            time_since_last_trigger = None
-            if buffer_last_triggered:
-                logger.debug(u"Tautulli ActivityHandler :: %s: Session %s buffer last triggered at %s." %
-                             (self.server.CONFIG.PMS_NAME, self.get_session_key(), buffer_last_triggered))
-                time_since_last_trigger = int(time.time()) - int(buffer_last_triggered)
-
-            if (current_buffer_count >= plexpy.CONFIG.BUFFER_THRESHOLD and time_since_last_trigger is None) or \
-                    (time_since_last_trigger is not None and time_since_last_trigger >= plexpy.CONFIG.BUFFER_WAIT):
-                ap.set_session_buffer_trigger_time(session_key=self.get_session_key())
-
+            if buffer_values['buffer_triggered']:
                 # Retrieve the session data from our temp table
                 db_session = ap.get_session_by_key(session_key=self.get_session_key())
 
@@ -241,7 +262,10 @@ class ActivityHandler(object):
     def process(self):
         if self.is_valid_session():
             ap = activity_processor.ActivityProcessor(server=self.server)
-            db_session = ap.get_session_by_key(session_key=self.get_session_key())
+
+            # Read the session from the live state instead of querying the temp table on every event
+            live_state = activity_processor.get_live_state(self.server, self.get_session_key())
+            db_session = live_state.to_dict() if live_state else None
 
             this_state = self.timeline['state']
             this_rating_key = str(self.timeline['ratingKey'])
@@ -270,9 +294,10 @@ class ActivityHandler(object):
                 if this_rating_key == last_rating_key or this_live_uuid == last_live_uuid:
                     # Update the session state and viewOffset
                     if this_state == 'playing':
-                        # Update the session in our temp session table
-                        # if the last set temporary stopped time exceeds 60 seconds
-                        if int(time.time()) - db_session['stopped'] > 60:
+                        # Keep the progress in memory and only update the session in our temp session table
+                        # if it was last written more than the checkpoint interval ago
+                        live_state.progress(this_state, self.timeline['viewOffset'], int(time.time()))
+                        if int(time.time()) - live_state.checkpoint > plexpy.CONFIG.SESSION_CHECKPOINT_INTERVAL:
                             self.update_db_session()
 
                     # Start our state checks
@@ -384,6 +409,9 @@ class TimelineHandler(object):
             if identifier != 'com.plexapp.plugins.library':
                 return
 
+            # The library item changed, so its cached metadata is out of date
+            pmsconnect.clear_metadata_cache(server_id=self.server.CONFIG.ID, rating_key=rating_key)
+
             # Add a new media item to the recently added queue
             if media_type and section_id > 0 and \
                 ((state_type == 0 and metadata_state == 'created')):  # or \
@@ -492,6 +520,8 @@ def schedule_callback(id, func=None, remove_job=False, args=None, **kwargs):
 
 
 def force_stop_stream(session_key, title, user, server_name, server):
+    activity_processor.flush_live_states(server_id=server.CONFIG.ID, session_key=session_key)
+
     ap = activity_processor.ActivityProcessor(server=server)
     session = ap.get_session_by_key(session_key=session_key)
 
@@ -529,34 +559,50 @@ def force_stop_stream(session_key, title, user, server_name, server):
 
 def clear_recently_added_queue(rating_key, title, server_name, server, queue):
     child_keys = queue[rating_key]
+    created_items = []
 
     if plexpy.CONFIG.NOTIFY_GROUP_RECENTLY_ADDED_GRANDPARENT and len(child_keys) > 1:
-        on_created(server, rating_key, child_keys=child_keys)
+        created_items.append((rating_key, {'child_keys': child_keys}))
 
     elif child_keys:
         for child_key in child_keys:
             grandchild_keys = queue.get(child_key, [])
 
             if plexpy.CONFIG.NOTIFY_GROUP_RECENTLY_ADDED_PARENT and len(grandchild_keys) > 1:
-                on_created(server, child_key, child_keys=grandchild_keys)
+                created_items.append((child_key, {'child_keys': grandchild_keys}))
 
             elif grandchild_keys:
                 for grandchild_key in grandchild_keys:
-                    on_created(server, grandchild_key)
+                    created_items.append((grandchild_key, {}))
 
             else:
-                on_created(server, child_key)
+                created_items.append((child_key, {}))
 
     else:
-        on_created(server, rating_key)
+        created_items.append((rating_key, {}))
+
+    # Get the metadata of all the new items and their children on the server's request workers
+    # instead of one request at a time for a whole season or album
+    metadata_keys = []
+    for key, kwargs in created_items:
+        for metadata_key in [key] + list(kwargs.get('child_keys', [])):
+            if metadata_key not in metadata_keys:
+                metadata_keys.append(metadata_key)
+
+    metadata_list = server.PMSCONNECTION.map_requests(server.PMSCONNECTION.get_metadata_details, metadata_keys)
+    metadata_by_key = dict(zip(metadata_keys, metadata_list))
+
+    for key, kwargs in created_items:
+        on_created(server, key, metadata_by_key=metadata_by_key, **kwargs)
 
     # Remove all keys
     del_keys(rating_key, queue)
 
 
-def on_created(server, rating_key, **kwargs):
+def on_created(server, rating_key, metadata_by_key=None, **kwargs):
     logger.debug(u"Tautulli TimelineHandler :: %s: Library item %s added to Plex." % (server.CONFIG.PMS_NAME, str(rating_key)))
-    metadata = server.PMSCONNECTION.get_metadata_details(rating_key)
+    metadata_by_key = metadata_by_key or {}
+    metadata = metadata_by_key.get(rating_key) or server.PMSCONNECTION.get_metadata_details(rating_key)
 
     if metadata:
         notify = True
@@ -584,7 +630,7 @@ def on_created(server, rating_key, **kwargs):
             all_keys.extend(kwargs['child_keys'])
 
         for key in all_keys:
-            data_factory.set_recently_added_item(server.CONFIG.ID, key)
+            data_factory.set_recently_added_item(server.CONFIG.ID, key, metadata=metadata_by_key.get(key))
 
         logger.debug(u"Tautulli TimelineHandler :: %s: Added %s items to the recently_added database table."
                      % (server.CONFIG.PMS_NAME, str(len(all_keys))))
@@ -596,7 +642,7 @@ def on_created(server, rating_key, **kwargs):
 
 def delete_metadata_cache(session_key, server):
     try:
-        os.remove(os.path.join(plexpy.CONFIG.CACHE_DIR, 'session_metadata/metadata-sessionKey-%s-%s.json' % (server.CONFIG.ID, session_key)))
-    except IOError as e:
-        logger.error(u"Tautulli ActivityHandler :: %s: Failed to remove metadata cache file (sessionKey %s): %s"
+        database.delete_session_metadata(server.CONFIG.ID, session_key)
+    except Exception as e:
+        logger.error(u"Tautulli ActivityHandler :: %s: Failed to remove metadata cache (sessionKey %s): %s"
                      % (server.CONFIG.PMS_NAME, session_key, e))
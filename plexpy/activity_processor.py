@@ -15,16 +15,152 @@
 
 from collections import defaultdict
 import json
+import threading
 import time
 
 import plexpy
 from plexpy import database
+from plexpy import datafactory
 from plexpy import helpers
 from plexpy import libraries
 from plexpy import logger
 from plexpy import users
 
 
+_live_states = {}
+_live_states_lock = threading.Lock()
+
+
+class LiveSessionState(object):
+    """
+    The state of an active session which changes on every websocket event.
+
+    Progress events only update this record. It is written back to the sessions table
+    before any state transition, on the checkpoint interval, and on shutdown.
+    The fields are only read and changed while holding _live_states_lock.
+    """
+    __slots__ = ('server_id', 'session_key', 'row_id', 'session', 'state', 'view_offset', 'stopped',
+                 'last_paused', 'paused_delta', 'checkpoint', 'dirty')
+
+    def __init__(self, server_id, session):
+        self.server_id = server_id
+        self.session_key = int(session['session_key'])
+        self.row_id = session['id']
+        self.session = session
+        self.state = session['state']
+        self.view_offset = session['view_offset']
+        self.stopped = session['stopped']
+        self.last_paused = session['last_paused']
+        self.paused_delta = 0
+        self.checkpoint = int(time.time())
+        self.dirty = False
+
+    def progress(self, state, view_offset, timestamp):
+        with _live_states_lock:
+            self.state = state
+            self.view_offset = view_offset
+            self.stopped = timestamp
+            self.dirty = True
+
+    def still_paused(self, timestamp):
+        with _live_states_lock:
+            if self.last_paused:
+                self.paused_delta += timestamp - int(self.last_paused)
+            self.last_paused = timestamp
+            self.dirty = True
+
+    def to_dict(self):
+        with _live_states_lock:
+            session = dict(self.session)
+            session.update({'state': self.state,
+                            'view_offset': self.view_offset,
+                            'stopped': self.stopped,
+                            'last_paused': self.last_paused,
+                            'paused_counter': int(session['paused_counter'] or 0) + self.paused_delta})
+        return session
+
+
+def get_live_state(server, session_key):
+    """
+    Returns the live state of a session, loading it from the sessions table the first time.
+    """
+    key = (server.CONFIG.ID, int(session_key))
+
+    with _live_states_lock:
+        live_state = _live_states.get(key)
+
+    if live_state is None:
+        live_state = refresh_live_state(server, session_key)
+
+    return live_state
+
+
+def refresh_live_state(server, session_key):
+    """
+    Reloads the live state of a session after the sessions table row was written.
+    """
+    key = (server.CONFIG.ID, int(session_key))
+    session = ActivityProcessor(server=server).get_session_by_key(session_key=session_key)
+
+    with _live_states_lock:
+        if session:
+            live_state = _live_states[key] = LiveSessionState(server.CONFIG.ID, session)
+        else:
+            _live_states.pop(key, None)
+            live_state = None
+
+    return live_state
+
+
+def forget_live_state(server_id, session_key=None, row_id=None):
+    with _live_states_lock:
+        for key, live_state in list(_live_states.items()):
+            if live_state.server_id == server_id and \
+                    (live_state.session_key == session_key or live_state.row_id == row_id):
+                del _live_states[key]
+
+
+def flush_live_states(server_id=None, session_key=None, checkpoint=False):
+    """
+    Writes the changed live session states back to the sessions table in a single transaction.
+
+    With checkpoint, only the states not written for SESSION_CHECKPOINT_INTERVAL seconds are flushed.
+    """
+    now = int(time.time())
+    rows = []
+
+    with _live_states_lock:
+        for live_state in _live_states.values():
+            if not live_state.dirty:
+                continue
+            if server_id is not None and live_state.server_id != server_id:
+                continue
+            if session_key is not None and live_state.session_key != int(session_key):
+                continue
+            if checkpoint and now - live_state.checkpoint < plexpy.CONFIG.SESSION_CHECKPOINT_INTERVAL:
+                continue
+
+            rows.append([live_state.state, live_state.view_offset, live_state.stopped, live_state.last_paused,
+                         live_state.paused_delta, live_state.row_id])
+
+            live_state.session['paused_counter'] = int(live_state.session['paused_counter'] or 0) + \
+                                                   live_state.paused_delta
+            live_state.paused_delta = 0
+            live_state.checkpoint = now
+            live_state.dirty = False
+
+    if rows:
+        try:
+            monitor_db = database.MonitorDatabase()
+            monitor_db.executemany('UPDATE sessions SET state = ?, view_offset = ?, stopped = ?, last_paused = ?, '
+                                   'paused_counter = IFNULL(paused_counter, 0) + ? '
+                                   'WHERE id = ?', rows)
+        except Exception as e:
+            logger.warn(u"Tautulli ActivityProcessor :: Unable to write the live session states: %s." % e)
+
+    return len(rows)
+
+
 class ActivityProcessor(object):
 
     def __init__(self, server=None):
@@ -124,18 +260,16 @@ class ActivityProcessor(object):
                     'server_id': session.get('server_id', ''),
                     'rating_key': session.get('rating_key', '')}
 
-            result = self.db.upsert('sessions', values, keys)
+            # If it's our first write then time stamp it.
+            timestamp = {'started': int(time.time())}
+
+            result = self.db.upsert('sessions', values, keys, insert_dict=timestamp)
 
             if result == 'insert':
                 # Check if any notification agents have notifications enabled
                 if notify:
                     plexpy.NOTIFY_QUEUE.put({'stream_data': values.copy(), 'notify_action': 'on_play'})
 
-                # If it's our first write then time stamp it.
-                started = int(time.time())
-                timestamp = {'started': started}
-                self.db.upsert('sessions', timestamp, keys)
-
                 return True
 
     def write_session_history(self, session=None, import_metadata=None, is_import=False, import_ignore_interval=0):
@@ -323,7 +457,17 @@ class ActivityProcessor(object):
                     args = [new_session['id'], new_session['id']]
 
                 self.db.action(query=query, args=args)
-                
+
+                # Add the play to the graph rollups, grouped plays only count once
+                database.add_history_rollup(started=session['started'],
+                                            stopped=stopped,
+                                            paused_counter=session['paused_counter'],
+                                            server_id=session['server_id'],
+                                            user_id=session['user_id'],
+                                            media_type=session['media_type'],
+                                            group_start=(args[0] == args[1]))
+                datafactory.clear_home_stats_cache(server_id=session['server_id'])
+
                 # logger.debug(u"Tautulli ActivityProcessor :: %s: Successfully written history item, last id for session_history is %s"
                 #              % (server_name, last_id))
 
@@ -508,8 +652,10 @@ class ActivityProcessor(object):
     def delete_session(self, session_key=None, row_id=None):
         if str(session_key).isdigit():
             self.db.action('DELETE FROM sessions WHERE session_key = ? AND server_id = ?', [session_key, self.server.CONFIG.ID])
+            forget_live_state(self.server.CONFIG.ID, session_key=int(session_key))
         elif str(row_id).isdigit():
             self.db.action('DELETE FROM sessions WHERE id = ? AND server_id = ?', [row_id, self.server.CONFIG.ID])
+            forget_live_state(self.server.CONFIG.ID, row_id=int(row_id))
 
     def set_session_last_paused(self, session_key=None, timestamp=None):
         if str(session_key).isdigit():
@@ -568,6 +714,53 @@ class ActivityProcessor(object):
 
             return None
 
+    def update_session_counters(self, buffering_ids=None):
+        """
+        Increments the buffer_count of the buffering sessions and checks for buffer warnings in a single transaction.
+
+        buffering_ids:      [row_id] of the sessions to increment the buffer_count
+
+        Output: {row_id: {'buffer_count', 'buffer_last_triggered', 'buffer_triggered'}} for the buffering sessions,
+                where buffer_triggered is 'first' or 'repeat' when a buffer warning should be sent
+                and buffer_last_triggered is the time of the previous warning
+        """
+        buffering_ids = buffering_ids or []
+
+        if not buffering_ids:
+            return {}
+
+        def func(c):
+            c.executemany('UPDATE sessions SET buffer_count = buffer_count + 1 WHERE id = ?',
+                          [[row_id] for row_id in buffering_ids])
+
+            result = c.execute('SELECT id, buffer_count, buffer_last_triggered FROM sessions WHERE id IN (%s)'
+                               % ', '.join(['?'] * len(buffering_ids)), buffering_ids).fetchall()
+
+            now = int(time.time())
+            buffer_values = {}
+            triggered_ids = []
+            for row in result:
+                row['buffer_triggered'] = None
+                if not row['buffer_last_triggered']:
+                    # Our first buffer notification once the threshold is reached
+                    if row['buffer_count'] >= plexpy.CONFIG.BUFFER_THRESHOLD:
+                        row['buffer_triggered'] = 'first'
+                elif now - int(row['buffer_last_triggered']) >= plexpy.CONFIG.BUFFER_WAIT:
+                    # Subsequent buffer notifications after the wait time
+                    row['buffer_triggered'] = 'repeat'
+
+                if row['buffer_triggered']:
+                    triggered_ids.append(row['id'])
+                buffer_values[row.pop('id')] = row
+
+            c.executemany('UPDATE sessions SET buffer_last_triggered = ? WHERE id = ?',
+                          [[now, row_id] for row_id in triggered_ids])
+
+            return buffer_values
+
+        # The transaction returns None if the database stayed locked
+        return self.db.transaction(func, name='update_session_counters') or {}
+
     def set_temp_stopped(self):
         stopped_time = int(time.time())
         self.db.action('UPDATE sessions SET stopped = ? WHERE server_id = ?', [stopped_time, self.server.CONFIG.ID])
@@ -582,3 +775,9 @@ class ActivityProcessor(object):
         self.db.action('UPDATE sessions SET watched = ?'
                        'WHERE session_key = ? AND server_id = ?',
                        [1, session_key, self.server.CONFIG.ID])
+
+        # Keep the live state in step so the next event doesn't see the session as unwatched
+        with _live_states_lock:
+            live_state = _live_states.get((self.server.CONFIG.ID, int(session_key)))
+            if live_state:
+                live_state.session['watched'] = 1
@@ -84,6 +84,7 @@ class Config(object):
     _CONFIG_DEFINITIONS = {
         'ALLOW_GUEST_ACCESS': (int, 'General', 0),
         'DATE_FORMAT': (str, 'General', 'YYYY-MM-DD'),
+        'DB_CONCURRENT_READS': (int, 'Advanced', 1),
         'GROUPING_GLOBAL_HISTORY': (int, 'PlexWatch', 0),
         'GROUPING_USER_HISTORY': (int, 'PlexWatch', 0),
         'GROUPING_CHARTS': (int, 'PlexWatch', 0),
@@ -93,6 +94,9 @@ class Config(object):
         'PMS_LOGS_FOLDER': (str, 'PMS', ''),
         'PMS_LOGS_LINE_CAP': (int, 'PMS', 1000),
         'PMS_TIMEOUT': (int, 'Advanced', 15),
+        'PMS_REQUEST_WORKERS': (int, 'Advanced', 4),
+        'PMS_REQUEST_INTERVAL': (int, 'Advanced', 0),
+        'PMS_JSON_TRANSPORT': (int, 'Advanced', 0),
         'PMS_PLEXPASS': (int, 'PMS', 0),
         'TIME_FORMAT': (str, 'General', 'HH:mm'),
         'ANON_REDIRECT': (str, 'General', 'http://www.nullrefer.com/?'),
@@ -318,6 +322,7 @@ class Config(object):
         'LOG_DIR': (str, 'General', ''),
         'LOGGING_IGNORE_INTERVAL': (int, 'Monitoring', 120),
         'METADATA_CACHE_SECONDS': (int, 'Advanced', 1800),
+        'METADATA_CACHE_SIZE': (int, 'Advanced', 1000),
         'MONITOR_RCLONE': (int, 'Monitoring', 0),
         'MOVIE_LOGGING_ENABLE': (int, 'Monitoring', 1),
         'MOVIE_NOTIFY_ENABLE': (int, 'Monitoring', 0),
@@ -514,6 +519,11 @@ class Config(object):
         'REFRESH_USERS_INTERVAL': (int, 'Monitoring', 12),
         'REFRESH_USERS_ON_STARTUP': (int, 'Monitoring', 1),
         'REMOTE_ACCESS_PING_THRESHOLD': (int, 'Advanced', 3),
+        'REQUEST_CACHE_DISK_SIZE': (int, 'Advanced', 128),
+        'REQUEST_CACHE_MEMORY_SIZE': (int, 'Advanced', 16),
+        'REQUEST_POOL_HOSTS': (int, 'Advanced', 10),
+        'REQUEST_POOL_SIZE': (int, 'Advanced', 10),
+        'SESSION_CHECKPOINT_INTERVAL': (int, 'Advanced', 60),
         'SESSION_DB_WRITE_ATTEMPTS': (int, 'Advanced', 5),
         'SHOW_ADVANCED_SETTINGS': (int, 'General', 0),
         'SLACK_ENABLED': (int, 'Slack', 0),
@@ -631,6 +641,9 @@ class Config(object):
         'WEBSOCKET_MONITOR_PING_PONG': (int, 'Advanced', 0),
         'WEBSOCKET_CONNECTION_ATTEMPTS': (int, 'Advanced', 5),
         'WEBSOCKET_CONNECTION_TIMEOUT': (int, 'Advanced', 5),
+        'WEBSOCKET_COALESCE_WINDOW': (int, 'Advanced', 30),
+        'WEBSOCKET_QUEUE_SIZE': (int, 'Advanced', 500),
+        'WEBSOCKET_WORKERS': (int, 'Advanced', 4),
         'WEEK_START_MONDAY': (int, 'General', 0),
         'XBMC_ENABLED': (int, 'XBMC', 0),
         'XBMC_HOST': (str, 'XBMC', ''),
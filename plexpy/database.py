@@ -15,6 +15,7 @@
 
 import arrow
 import os
+import re
 import sqlite3
 import shutil
 import threading
@@ -22,10 +23,95 @@ import time
 import json
 
 import plexpy
+import plexpy.lock
 from plexpy import logger
 
 FILENAME = "tautulli.db"
-db_lock = threading.Lock()
+
+# Statements that only read from the db and can run without the write lock in WAL mode
+READ_QUERY_RE = re.compile(r'^\s*(SELECT|EXPLAIN)\b', re.IGNORECASE)
+
+# INSERT ... ON CONFLICT DO UPDATE requires SQLite 3.24.0
+NATIVE_UPSERT = sqlite3.sqlite_version_info >= (3, 24, 0)
+# Resets last_insert_rowid() so an upsert can tell if it inserted or updated a row
+UPSERT_SENTINEL_ROWID = -1
+UPSERT_SENTINEL_QUERY = 'INSERT OR REPLACE INTO temp.upsert_sentinel (id) VALUES (%d)' % UPSERT_SENTINEL_ROWID
+
+_unique_columns_cache = {}
+
+# Indexes maintained by dbcheck() for the hot query filters
+MANAGED_INDEXES = [
+    ('idx_session_history_started', 'session_history', ('started',)),
+    ('idx_session_history_stopped', 'session_history', ('stopped',)),
+    ('idx_session_history_server_started', 'session_history', ('server_id', 'started')),
+    ('idx_session_history_user_started', 'session_history', ('user_id', 'started')),
+    ('idx_session_history_reference_id', 'session_history', ('reference_id',)),
+    ('idx_session_history_metadata_section', 'session_history_metadata', ('section_id', 'server_id')),
+    ('idx_sessions_session_rating', 'sessions', ('session_key', 'rating_key')),
+]
+
+# Representative queries checked by audit_queries()
+HOT_QUERIES = [
+    ('history_by_server', 'SELECT COUNT(*) FROM session_history WHERE server_id = ? AND started >= ?', [1, 0]),
+    ('history_by_user', 'SELECT id FROM session_history WHERE user_id = ? ORDER BY started DESC LIMIT 25', [1]),
+    ('history_by_time_range', 'SELECT COUNT(*) FROM session_history WHERE started >= ?', [0]),
+    ('home_stats_time_range', 'SELECT COUNT(*) FROM session_history WHERE stopped >= ?', [0]),
+    ('history_group', 'SELECT id FROM session_history WHERE reference_id = ?', [1]),
+    ('library_history', 'SELECT COUNT(*) FROM session_history_metadata WHERE section_id = ? AND server_id = ?', [1, 1]),
+    ('session_by_key', 'SELECT * FROM sessions WHERE session_key = ? AND rating_key = ?', [1, 1]),
+    ('session_by_server', 'SELECT * FROM sessions WHERE server_id = ? AND session_key = ?', [1, 1]),
+]
+
+# "SCAN session_history" without "USING ... INDEX" is a full table scan
+FULL_SCAN_RE = re.compile(r'^SCAN (?:TABLE )?(\w+)(?!.*\bUSING\b)')
+
+
+class WriteLock(object):
+    """
+    Serializes writes to the db and records how long callers had to wait
+    before they were allowed to write.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset_stats()
+
+    def __enter__(self):
+        start = time.time()
+        self.lock.acquire()
+        wait = time.time() - start
+
+        # Stats are only updated while holding the lock
+        self.acquisitions += 1
+        self.total_wait += wait
+        if wait > self.max_wait:
+            self.max_wait = wait
+        if wait >= 1:
+            logger.debug(u"Tautulli Database :: Waited %.2f seconds for the database write lock.", wait)
+
+    def __exit__(self, type, value, traceback):
+        self.lock.release()
+
+    def reset_stats(self):
+        self.acquisitions = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def stats(self):
+        return {'acquisitions': self.acquisitions,
+                'total_wait': round(self.total_wait, 4),
+                'avg_wait': round(self.total_wait / self.acquisitions, 4) if self.acquisitions else 0,
+                'max_wait': round(self.max_wait, 4)
+                }
+
+
+db_lock = WriteLock()
+
+
+def get_lock_stats():
+    """ Returns how long callers have waited for the database write lock """
+
+    return db_lock.stats()
 
 
 def drop_session_db():
@@ -39,6 +125,7 @@ def clear_history_tables():
     monitor_db.action('DELETE FROM session_history')
     monitor_db.action('DELETE FROM session_history_media_info')
     monitor_db.action('DELETE FROM session_history_metadata')
+    monitor_db.action('DELETE FROM session_history_rollup')
     monitor_db.action('VACUUM')
 
 
@@ -54,6 +141,224 @@ def delete_sessions():
         logger.warn(u"Tautulli Database :: Unable to clear temporary sessions from database: %s." % e)
         return False
 
+
+def _history_rollup_bucket(started, stopped, paused_counter, server_id, user_id, media_type):
+    local_time = time.localtime(int(started))
+    date = time.strftime('%Y-%m-%d', local_time)
+    hour = local_time.tm_hour
+
+    stopped = int(stopped or 0)
+    duration = (stopped - int(started) - int(paused_counter or 0)) if stopped > 0 else 0
+
+    return [date, hour, server_id, user_id, media_type], duration
+
+
+def add_history_rollup(started, stopped, paused_counter, server_id, user_id, media_type, group_start=True):
+    """
+    Adds a single session_history row to the session_history_rollup table.
+
+    group_start is False when the row was grouped into an existing play (reference_id != id).
+    """
+    keys, duration = _history_rollup_bucket(started, stopped, paused_counter, server_id, user_id, media_type)
+    grouped_plays = 1 if group_start else 0
+
+    def func(c):
+        updated = c.execute('UPDATE session_history_rollup '
+                            'SET plays = plays + 1, grouped_plays = grouped_plays + ?, duration = duration + ? '
+                            'WHERE date = ? AND hour = ? AND server_id = ? AND user_id = ? AND media_type = ?',
+                            [grouped_plays, duration] + keys).rowcount
+        if not updated:
+            c.execute('INSERT INTO session_history_rollup '
+                      '(date, hour, server_id, user_id, media_type, plays, grouped_plays, duration) '
+                      'VALUES (?, ?, ?, ?, ?, 1, ?, ?)',
+                      keys + [grouped_plays, duration])
+
+    monitor_db = MonitorDatabase()
+    monitor_db.transaction(func, name='add_history_rollup')
+
+
+def remove_history_rollup(started, stopped, paused_counter, server_id, user_id, media_type, group_start=True,
+                          new_group_start=None):
+    """
+    Removes a single deleted session_history row from the session_history_rollup table.
+
+    new_group_start is the session_history row which now starts the play when the deleted row
+    was the first row of a grouped play.
+    """
+    keys, duration = _history_rollup_bucket(started, stopped, paused_counter, server_id, user_id, media_type)
+    grouped_plays = 1 if group_start else 0
+
+    def func(c):
+        c.execute('UPDATE session_history_rollup '
+                  'SET plays = plays - 1, grouped_plays = grouped_plays - ?, duration = duration - ? '
+                  'WHERE date = ? AND hour = ? AND server_id = ? AND user_id = ? AND media_type = ?',
+                  [grouped_plays, duration] + keys)
+        c.execute('DELETE FROM session_history_rollup '
+                  'WHERE date = ? AND hour = ? AND server_id = ? AND user_id = ? AND media_type = ? AND plays <= 0',
+                  keys)
+
+        if new_group_start:
+            new_keys, _ = _history_rollup_bucket(new_group_start['started'], 0, 0,
+                                                 new_group_start['server_id'], new_group_start['user_id'],
+                                                 new_group_start['media_type'])
+            c.execute('UPDATE session_history_rollup SET grouped_plays = grouped_plays + 1 '
+                      'WHERE date = ? AND hour = ? AND server_id = ? AND user_id = ? AND media_type = ?',
+                      new_keys)
+
+    monitor_db = MonitorDatabase()
+    monitor_db.transaction(func, name='remove_history_rollup')
+
+
+def rebuild_history_rollups(server_id=None, user_id=None, cursor=None):
+    """
+    Rebuilds the session_history_rollup table from session_history,
+    optionally only for the rows of a single server and/or user.
+
+    Pass a raw cursor to rebuild inside an existing transaction (i.e. dbcheck).
+    """
+    where = []
+    args = []
+    if server_id is not None:
+        where.append('server_id = ?')
+        args.append(server_id)
+    if user_id is not None:
+        where.append('user_id = ?')
+        args.append(user_id)
+    where = ('WHERE ' + ' AND '.join(where)) if where else ''
+
+    delete_query = 'DELETE FROM session_history_rollup %s' % where
+    insert_query = 'INSERT INTO session_history_rollup ' \
+                   '(date, hour, server_id, user_id, media_type, plays, grouped_plays, duration) ' \
+                   'SELECT date(started, "unixepoch", "localtime") AS date, ' \
+                   'CAST(strftime("%%H", started, "unixepoch", "localtime") AS INTEGER) AS hour, ' \
+                   'server_id, user_id, media_type, COUNT(*), COUNT(group_start.id), ' \
+                   'SUM(CASE WHEN stopped > 0 THEN (stopped - started) ' \
+                   ' - (CASE WHEN paused_counter IS NULL THEN 0 ELSE paused_counter END) ELSE 0 END) ' \
+                   'FROM session_history ' \
+                   'LEFT OUTER JOIN (SELECT MIN(id) AS id FROM session_history GROUP BY reference_id) AS group_start ' \
+                   'ON group_start.id = session_history.id ' \
+                   '%s ' \
+                   'GROUP BY date, hour, server_id, user_id, media_type' % where
+
+    if cursor is not None:
+        cursor.execute(delete_query, args)
+        cursor.execute(insert_query, args)
+        return True
+
+    logger.info(u"Tautulli Database :: Rebuilding the session history rollups.")
+    monitor_db = MonitorDatabase()
+
+    def func(c):
+        c.execute(delete_query, args)
+        c.execute(insert_query, args)
+
+    try:
+        monitor_db.transaction(func, name='rebuild_history_rollups')
+        return True
+    except Exception as e:
+        logger.warn(u"Tautulli Database :: Unable to rebuild the session history rollups: %s." % e)
+        return False
+
+
+def get_session_metadata(server_id, session_key):
+    """ Returns the cached metadata for a session and the time it was cached """
+    monitor_db = MonitorDatabase()
+
+    try:
+        result = monitor_db.select_single('SELECT metadata, cache_time FROM session_metadata_cache '
+                                          'WHERE server_id = ? AND session_key = ?',
+                                          [server_id, session_key])
+        if result:
+            return json.loads(result['metadata']), result['cache_time']
+    except (sqlite3.Error, ValueError) as e:
+        logger.warn(u"Tautulli Database :: Unable to read the metadata cache for sessionKey %s: %s."
+                    % (session_key, e))
+
+    return {}, 0
+
+
+def set_session_metadata(server_id, session_key, metadata):
+    """ Caches the metadata for a session, replacing any previous copy in a single statement """
+    monitor_db = MonitorDatabase()
+
+    try:
+        monitor_db.upsert(table_name='session_metadata_cache',
+                          key_dict={'server_id': server_id, 'session_key': session_key},
+                          value_dict={'cache_time': int(time.time()), 'metadata': json.dumps(metadata)})
+        return True
+    except (sqlite3.Error, ValueError, TypeError) as e:
+        logger.warn(u"Tautulli Database :: Unable to cache metadata for sessionKey %s: %s." % (session_key, e))
+        return False
+
+
+def delete_session_metadata(server_id, session_key=None):
+    """ Removes the cached metadata for a session, or for every session of a server """
+    monitor_db = MonitorDatabase()
+
+    if session_key is None:
+        monitor_db.action('DELETE FROM session_metadata_cache WHERE server_id = ?', [server_id])
+    else:
+        monitor_db.action('DELETE FROM session_metadata_cache WHERE server_id = ? AND session_key = ?',
+                          [server_id, session_key])
+
+
+def cleanup_session_metadata():
+    """ Removes expired cached metadata for sessions which are no longer active """
+    monitor_db = MonitorDatabase()
+
+    try:
+        result = monitor_db.action('DELETE FROM session_metadata_cache WHERE cache_time < ? '
+                                   'AND NOT EXISTS (SELECT 1 FROM sessions '
+                                   'WHERE sessions.server_id = session_metadata_cache.server_id '
+                                   'AND sessions.session_key = session_metadata_cache.session_key)',
+                                   [int(time.time()) - plexpy.CONFIG.METADATA_CACHE_SECONDS])
+        logger.debug(u"Tautulli Database :: Removed %d expired session metadata cache entries." % result.rowcount)
+    except sqlite3.Error as e:
+        logger.warn(u"Tautulli Database :: Unable to clean up the session metadata cache: %s." % e)
+
+
+def import_session_metadata_files(cursor):
+    """
+    Moves the metadata-sessionKey-<server_id>-<session_key>.json files
+    from the session_metadata cache folder into the session_metadata_cache table.
+    """
+    folder = os.path.join(plexpy.CONFIG.CACHE_DIR, 'session_metadata')
+    if not os.path.isdir(folder):
+        return
+
+    filename_re = re.compile(r'^metadata-sessionKey-(\d+)-(\d+)\.json$')
+    imported = 0
+
+    for filename in os.listdir(folder):
+        match = filename_re.match(filename)
+        if not match:
+            continue
+
+        path = os.path.join(folder, filename)
+        try:
+            with open(path, 'r') as f:
+                metadata = json.load(f)
+            cache_time = metadata.pop('_cache_time', 0)
+            cursor.execute('INSERT OR REPLACE INTO session_metadata_cache '
+                           '(server_id, session_key, cache_time, metadata) VALUES (?, ?, ?, ?)',
+                           [int(match.group(1)), int(match.group(2)), cache_time, json.dumps(metadata)])
+            imported += 1
+        except (IOError, ValueError, AttributeError) as e:
+            logger.warn(u"Tautulli Database :: Unable to import metadata cache file %s: %s." % (filename, e))
+
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    try:
+        os.rmdir(folder)
+    except OSError:
+        pass
+
+    logger.debug(u"Tautulli Database :: Imported %d session metadata cache files." % imported)
+
+
 def db_filename(filename=FILENAME):
     """ Returns the filepath to the db """
 
@@ -76,8 +381,10 @@ def make_backup(cleanup=False, scheduler=False):
 
     db = MonitorDatabase()
     db.connection.execute('begin immediate')
-    shutil.copyfile(db_filename(), backup_file_fp)
-    db.connection.rollback()
+    try:
+        shutil.copyfile(db_filename(), backup_file_fp)
+    finally:
+        db.connection.rollback()
 
     if cleanup:
         now = time.time()
@@ -107,6 +414,54 @@ def get_cache_size():
     return int(plexpy.CONFIG.CACHE_SIZEMB)
 
 
+def create_indexes(cursor):
+    """ Creates the managed indexes, takes a sqlite3 cursor so it can run inside dbcheck """
+
+    for name, table, columns in MANAGED_INDEXES:
+        cursor.execute('CREATE INDEX IF NOT EXISTS %s ON %s (%s)' % (name, table, ', '.join(columns)))
+
+
+def explain_query(query, args=None):
+    """ Returns the EXPLAIN QUERY PLAN details for a query """
+
+    monitor_db = MonitorDatabase()
+    return [row['detail'] for row in monitor_db.select('EXPLAIN QUERY PLAN ' + query, args)]
+
+
+def audit_queries(queries=None, benchmark=False):
+    """ Reports which queries fall back to a full table scan, optionally timing each query """
+
+    monitor_db = MonitorDatabase()
+    results = []
+
+    for name, query, args in (queries or HOT_QUERIES):
+        try:
+            plan = explain_query(query, args)
+        except sqlite3.Error as e:
+            logger.warn(u"Tautulli Database :: Unable to explain query %s: %s." % (name, e))
+            continue
+
+        full_scans = [m.group(1) for m in (FULL_SCAN_RE.match(detail) for detail in plan) if m]
+
+        result = {'name': name,
+                  'query': query,
+                  'plan': plan,
+                  'full_scans': full_scans
+                  }
+
+        if benchmark:
+            start = time.time()
+            monitor_db.select(query, args)
+            result['duration_ms'] = round((time.time() - start) * 1000, 3)
+
+        if full_scans:
+            logger.debug(u"Tautulli Database :: Query %s does a full scan of %s." % (name, ', '.join(full_scans)))
+
+        results.append(result)
+
+    return results
+
+
 def dict_factory(cursor, row):
     d = {}
     for idx, col in enumerate(cursor.description):
@@ -115,34 +470,172 @@ def dict_factory(cursor, row):
     return d
 
 
+class Connection(sqlite3.Connection):
+    """ sqlite3 connection that remembers the journal mode the db is running in """
+
+    journal_mode = None
+
+    @property
+    def concurrent_reads(self):
+        return self.journal_mode == 'wal' and bool(plexpy.CONFIG.DB_CONCURRENT_READS)
+
+
+def connect(filename=FILENAME):
+    """ Opens a new connection to the db with the Tautulli pragmas applied """
+
+    connection = sqlite3.connect(db_filename(filename), timeout=20, check_same_thread=False,
+                                 factory=Connection)
+    # Don't wait for the disk to finish writing
+    connection.execute("PRAGMA synchronous = OFF")
+    # Journal disabled since we never do rollbacks
+    journal_mode = connection.execute("PRAGMA journal_mode = %s" % plexpy.CONFIG.JOURNAL_MODE).fetchone()
+    connection.journal_mode = str(journal_mode[0]).lower() if journal_mode else None
+    # 64mb of cache memory, probably need to make it user configurable
+    connection.execute("PRAGMA cache_size=-%s" % (get_cache_size() * 1024))
+    connection.execute("CREATE TEMP TABLE IF NOT EXISTS upsert_sentinel (id INTEGER PRIMARY KEY)")
+    connection.row_factory = dict_factory
+    return connection
+
+
+class ConnectionPool(object):
+    """
+    Keeps one long-lived connection per thread and per database file.
+
+    Connections are checked out by MonitorDatabase instead of opening a new
+    connection (and re-running the pragmas) for every instance. A connection
+    that has not been checked within HEALTH_CHECK_INTERVAL seconds is pinged
+    before it is handed out and transparently replaced if it is no longer usable.
+    """
+
+    HEALTH_CHECK_INTERVAL = 60
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = {}
+
+    def get_connection(self, filename=FILENAME):
+        connections = getattr(self._local, 'connections', None)
+        if connections is None:
+            connections = self._local.connections = {}
+
+        entry = connections.get(filename)
+        if entry is not None:
+            connection, last_checked = entry
+            if time.time() - last_checked < self.HEALTH_CHECK_INTERVAL:
+                return connection
+            if self._is_healthy(connection):
+                connections[filename] = (connection, time.time())
+                return connection
+            logger.warn(u"Tautulli Database :: Discarding unhealthy database connection.")
+            self._discard(connection)
+
+        connection = connect(filename)
+        connections[filename] = (connection, time.time())
+
+        thread = threading.current_thread()
+        with self._lock:
+            self._prune()
+            self._connections[(thread.ident, filename)] = (thread, connection)
+
+        return connection
+
+    def close_unused(self):
+        """
+        Closes the connections of the calling thread and of threads which have exited.
+
+        Threads which are still running (i.e. the scheduler or websocket workers while
+        shutting down) keep their connections so their queries don't fail halfway.
+        """
+        current_thread = threading.current_thread()
+        with self._lock:
+            for key, (thread, connection) in list(self._connections.items()):
+                if thread is current_thread or not thread.is_alive():
+                    del self._connections[key]
+                    self._close(connection)
+        self._local.connections = {}
+
+    def size(self):
+        with self._lock:
+            return len(self._connections)
+
+    @staticmethod
+    def _is_healthy(connection):
+        try:
+            connection.execute('SELECT 1').fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def _discard(self, connection):
+        with self._lock:
+            for key, (thread, conn) in list(self._connections.items()):
+                if conn is connection:
+                    del self._connections[key]
+        self._close(connection)
+
+    def _prune(self):
+        # Close connections left behind by threads that have exited
+        for key, (thread, connection) in list(self._connections.items()):
+            if not thread.is_alive():
+                del self._connections[key]
+                self._close(connection)
+
+    @staticmethod
+    def _close(connection):
+        try:
+            connection.close()
+        except sqlite3.Error:
+            pass
+
+
+POOL = ConnectionPool()
+
+
+def clear_schema_cache():
+    """ Forgets the cached unique indexes after the db schema has changed """
+
+    _unique_columns_cache.clear()
+
+
+def close_connections():
+    """ Closes the pooled db connections which are no longer in use """
+
+    POOL.close_unused()
+
+
 class MonitorDatabase(object):
 
     def __init__(self, filename=FILENAME):
         self.filename = filename
-        self.connection = sqlite3.connect(db_filename(filename), timeout=20)
-        # Don't wait for the disk to finish writing
-        self.connection.execute("PRAGMA synchronous = OFF")
-        # Journal disabled since we never do rollbacks
-        self.connection.execute("PRAGMA journal_mode = %s" % plexpy.CONFIG.JOURNAL_MODE)
-        # 64mb of cache memory, probably need to make it user configurable
-        self.connection.execute("PRAGMA cache_size=-%s" % (get_cache_size() * 1024))
-        self.connection.row_factory = dict_factory
 
-    def action(self, query, args=None, return_last_id=False):
-        if query is None:
-            return
+    @property
+    def connection(self):
+        # Always use the connection belonging to the calling thread
+        return POOL.get_connection(self.filename)
+
+    def _execute(self, query, func, read=False):
+        """
+        Runs func(connection) inside a single transaction, retrying while the db is locked.
+
+        In WAL mode readers never block the writer (or each other),
+        so only statements which write need to be serialized.
+        """
+        connection = self.connection
 
-        with db_lock:
+        if read and connection.concurrent_reads:
+            lock = plexpy.lock.FakeLock()
+        else:
+            lock = db_lock
+
+        with lock:
             sql_result = None
             attempts = 0
 
             while attempts < 5:
                 try:
-                    with self.connection as c:
-                        if args is None:
-                            sql_result = c.execute(query)
-                        else:
-                            sql_result = c.execute(query, list(args))
+                    with connection as c:
+                        sql_result = func(c)
                     # Our transaction was successful, leave the loop
                     break
 
@@ -161,6 +654,39 @@ class MonitorDatabase(object):
 
             return sql_result
 
+    def action(self, query, args=None, return_last_id=False):
+        if query is None:
+            return
+
+        if args is None:
+            func = lambda c: c.execute(query)
+        else:
+            func = lambda c: c.execute(query, list(args))
+
+        return self._execute(query, func, read=bool(READ_QUERY_RE.match(query)))
+
+    def executemany(self, query, args_list):
+        """ Executes the same write query for every set of args in a single transaction """
+
+        if query is None:
+            return
+
+        args_list = [list(args) for args in args_list]
+        if not args_list:
+            return
+
+        return self._execute(query, lambda c: c.executemany(query, args_list))
+
+    def transaction(self, func, name='transaction'):
+        """
+        Runs func(connection) in a single write transaction, for statements which depend on each other.
+
+        name is only used to identify the transaction in the error log.
+
+        Output: the return value of func
+        """
+        return self._execute(name, func)
+
     def select(self, query, args=None):
 
         sql_results = self.action(query, args).fetchall()
@@ -179,36 +705,157 @@ class MonitorDatabase(object):
 
         return sql_results
 
-    def upsert(self, table_name, value_dict, key_dict):
+    def upsert(self, table_name, value_dict, key_dict, insert_dict=None):
+        """
+        Updates the row matching key_dict with value_dict, or inserts a new row if none matches.
 
-        trans_type = 'update'
-        changes_before = self.connection.total_changes
+        Columns in insert_dict are only written when a new row is inserted.
+        Returns 'update' or 'insert'.
+        """
+        insert_dict = insert_dict or {}
 
-        gen_params = lambda my_dict: [x + " = ?" for x in my_dict.keys()]
+        if self._has_unique_index(table_name, key_dict.keys()):
+            query, columns = self._native_upsert_query(table_name, list(value_dict.keys()),
+                                                       list(key_dict.keys()), list(insert_dict.keys()))
+            args = self._upsert_args(columns, value_dict, key_dict, insert_dict)
 
-        update_query = "UPDATE " + table_name + " SET " + ", ".join(gen_params(value_dict)) + \
-                       " WHERE " + " AND ".join(gen_params(key_dict))
+            def func(c):
+                # last_insert_rowid() is left untouched when the upsert updates a row
+                c.execute(UPSERT_SENTINEL_QUERY)
+                return c.execute(query, args).lastrowid != UPSERT_SENTINEL_ROWID
 
-        self.action(update_query, list(value_dict.values()) + list(key_dict.values()))
+            try:
+                inserted = self._execute(query, func)
+            except sqlite3.IntegrityError:
+                logger.info(u"Tautulli Database :: Query failed: %s", query)
+                logger.debug(u"Tautulli Database :: Keys:   %s", json.dumps(key_dict))
+                logger.debug(u"Tautulli Database :: Values: %s", json.dumps(value_dict))
+                inserted = True
+
+        else:
+            update_query, insert_query, columns = self._upsert_queries(table_name, list(value_dict.keys()),
+                                                                       list(key_dict.keys()), list(insert_dict.keys()))
+            update_args = list(value_dict.values()) + list(key_dict.values())
+            insert_args = self._upsert_args(columns, value_dict, key_dict, insert_dict)
+
+            def func(c):
+                if c.execute(update_query, update_args).rowcount:
+                    return False
+                c.execute(insert_query, insert_args)
+                return True
 
-        if self.connection.total_changes == changes_before:
-            trans_type = 'insert'
-            insert_query = (
-                "INSERT INTO " + table_name + " (" + ", ".join(list(value_dict.keys()) + list(key_dict.keys())) + ")" +
-                " VALUES (" + ", ".join(["?"] * len(list(value_dict.keys()) + list(key_dict.keys()))) + ")"
-            )
             try:
-                self.action(insert_query, list(value_dict.values()) + list(key_dict.values()))
+                inserted = self._execute(update_query, func)
             except sqlite3.IntegrityError:
                 logger.info(u"Tautulli Database :: Queries failed: %s and %s", update_query, insert_query)
                 logger.debug(u"Tautulli Database :: Keys:   %s", json.dumps(key_dict))
                 logger.debug(u"Tautulli Database :: Values: %s", json.dumps(value_dict))
+                inserted = True
 
         # We want to know if it was an update or insert
-        return trans_type
+        return 'insert' if inserted else 'update'
+
+    def upsert_many(self, table_name, rows):
+        """
+        Upserts a batch of (value_dict, key_dict) rows in a single transaction.
+
+        Uses one executemany per distinct set of columns when the keys are backed by
+        a unique index, otherwise falls back to an update/insert per row.
+        """
+        groups = {}
+        for value_dict, key_dict in rows:
+            groups.setdefault((tuple(value_dict.keys()), tuple(key_dict.keys())), []).append((value_dict, key_dict))
+
+        if not groups:
+            return
+
+        def func(c):
+            for (value_keys, key_keys), group in groups.items():
+                if self._has_unique_index(table_name, key_keys):
+                    query, columns = self._native_upsert_query(table_name, list(value_keys), list(key_keys))
+                    c.executemany(query, [self._upsert_args(columns, value_dict, key_dict)
+                                          for value_dict, key_dict in group])
+                else:
+                    update_query, insert_query, columns = self._upsert_queries(table_name, list(value_keys),
+                                                                               list(key_keys))
+                    for value_dict, key_dict in group:
+                        if not c.execute(update_query, list(value_dict.values()) + list(key_dict.values())).rowcount:
+                            c.execute(insert_query, self._upsert_args(columns, value_dict, key_dict))
+
+        self._execute('UPSERT ' + table_name, func)
+
+    def _has_unique_index(self, table_name, columns):
+        """ Checks if the columns exactly match a unique index so they can be used as an upsert target """
+
+        if not NATIVE_UPSERT:
+            return False
+
+        key = (self.filename, table_name)
+        unique_columns = _unique_columns_cache.get(key)
+
+        if unique_columns is None:
+            unique_columns = []
+
+            connection = self.connection
+            table_info = connection.execute('PRAGMA table_info("%s")' % table_name).fetchall()
+            pk = [row['name'] for row in table_info if row['pk']]
+            if pk:
+                unique_columns.append(frozenset(pk))
+
+            for index in connection.execute('PRAGMA index_list("%s")' % table_name).fetchall():
+                if index['unique'] and not index['partial']:
+                    index_info = connection.execute('PRAGMA index_info("%s")' % index['name']).fetchall()
+                    unique_columns.append(frozenset(row['name'] for row in index_info))
+
+            _unique_columns_cache[key] = unique_columns
+
+        return frozenset(columns) in unique_columns
+
+    @staticmethod
+    def _insert_columns(value_keys, key_keys, insert_keys=None):
+        # Callers often repeat the key columns in the values, only insert them once
+        return list(dict.fromkeys(value_keys + key_keys + (insert_keys or [])))
+
+    @staticmethod
+    def _upsert_args(columns, value_dict, key_dict, insert_dict=None):
+        row = dict(insert_dict or {})
+        row.update(value_dict)
+        row.update(key_dict)
+        return [row[x] for x in columns]
+
+    @classmethod
+    def _native_upsert_query(cls, table_name, value_keys, key_keys, insert_keys=None):
+        columns = cls._insert_columns(value_keys, key_keys, insert_keys)
+        update_keys = [x for x in value_keys if x not in key_keys]
+
+        query = "INSERT INTO " + table_name + " (" + ", ".join(columns) + ")" + \
+                " VALUES (" + ", ".join(["?"] * len(columns)) + ")" + \
+                " ON CONFLICT (" + ", ".join(key_keys) + ")"
+
+        if update_keys:
+            query += " DO UPDATE SET " + ", ".join([x + " = excluded." + x for x in update_keys])
+        else:
+            query += " DO NOTHING"
+
+        return query, columns
+
+    @classmethod
+    def _upsert_queries(cls, table_name, value_keys, key_keys, insert_keys=None):
+        gen_params = lambda keys: [x + " = ?" for x in keys]
+        columns = cls._insert_columns(value_keys, key_keys, insert_keys)
+
+        update_query = "UPDATE " + table_name + " SET " + ", ".join(gen_params(value_keys)) + \
+                       " WHERE " + " AND ".join(gen_params(key_keys))
+
+        insert_query = (
+            "INSERT INTO " + table_name + " (" + ", ".join(columns) + ")" +
+            " VALUES (" + ", ".join(["?"] * len(columns)) + ")"
+        )
+
+        return update_query, insert_query, columns
 
     def last_insert_id(self):
         # Get the last insert row id
         result = self.select_single(query='SELECT last_insert_rowid() AS last_id')
         if result:
-            return result.get('last_id', None)
\ No newline at end of file
+            return result.get('last_id', None)
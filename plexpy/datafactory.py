@@ -15,6 +15,8 @@
 
 import json
 from itertools import groupby
+import threading
+import time
 #from operator import itemgetter
 
 import plexpy
@@ -25,6 +27,122 @@ from plexpy import helpers
 from plexpy import logger
 from plexpy import session
 
+# Seconds before a cached home stats card is recalculated
+HOME_STATS_CACHE_SECONDS = 300
+
+_home_stats_cache = {}
+_home_stats_cache_lock = threading.Lock()
+_home_stats_cache_info = {'hits': 0, 'misses': 0, 'invalidations': 0, 'generation': 0}
+
+
+def get_cached_home_stat(key):
+    """ Returns the cached rows for a home stats card, or None if it is missing or expired """
+    with _home_stats_cache_lock:
+        cached = _home_stats_cache.get(key)
+        if cached and time.time() - cached[1] < HOME_STATS_CACHE_SECONDS:
+            _home_stats_cache_info['hits'] += 1
+            return cached[0]
+
+        _home_stats_cache.pop(key, None)
+        _home_stats_cache_info['misses'] += 1
+        return None
+
+
+def set_cached_home_stat(key, stats, generation):
+    """ Caches a home stats card unless the history changed while it was calculated """
+    with _home_stats_cache_lock:
+        if generation == _home_stats_cache_info['generation']:
+            _home_stats_cache[key] = (stats, time.time())
+
+
+def clear_home_stats_cache(server_id=None):
+    """ Invalidates the cached home stats cards for a server, or for all servers """
+    with _home_stats_cache_lock:
+        _home_stats_cache_info['invalidations'] += 1
+        _home_stats_cache_info['generation'] += 1
+
+        if server_id is None:
+            _home_stats_cache.clear()
+            return
+
+        # Cards for all servers (key server_id None) also include this server
+        for key in list(_home_stats_cache.keys()):
+            if key[0] is None or key[0] == str(server_id):
+                del _home_stats_cache[key]
+
+
+def get_home_stats_cache_info():
+    """ Returns the home stats cache size and hit/miss counters """
+    with _home_stats_cache_lock:
+        lookups = _home_stats_cache_info['hits'] + _home_stats_cache_info['misses']
+        return {'size': len(_home_stats_cache),
+                'ttl': HOME_STATS_CACHE_SECONDS,
+                'hits': _home_stats_cache_info['hits'],
+                'misses': _home_stats_cache_info['misses'],
+                'hit_ratio': round(float(_home_stats_cache_info['hits']) / lookups, 4) if lookups else 0,
+                'invalidations': _home_stats_cache_info['invalidations']
+                }
+
+
+# Concurrent stream totals by transcode decision, in the order shown on the home page
+CONCURRENT_STREAM_TITLES = [('total', 'Concurrent Streams'),
+                            ('transcode', 'Concurrent Transcodes'),
+                            ('copy', 'Concurrent Direct Streams'),
+                            ('direct play', 'Concurrent Direct Plays')]
+
+
+def sweep_concurrent_streams(rows):
+    """
+    Sweeps over the started and stopped times of the history rows in time order.
+
+    Yields (timestamp, started, transcode_decision, counts) for every start or stop,
+    where counts holds the concurrent streams in total and per transcode decision
+    after the event. A stream stopping at the same time another starts is not concurrent.
+    """
+    events = []
+    for row in rows:
+        events.append((row['started'], 1, row['transcode_decision']))
+        events.append((row['stopped'], 0, row['transcode_decision']))
+    # Stops (0) sort before starts (1) at the same timestamp
+    events.sort(key=lambda e: (e[0], e[1]))
+
+    counts = {stream_type: 0 for stream_type, title in CONCURRENT_STREAM_TITLES}
+
+    for timestamp, started, transcode_decision in events:
+        delta = 1 if started else -1
+        counts['total'] += delta
+        if transcode_decision in counts:
+            counts[transcode_decision] += delta
+
+        yield timestamp, started, transcode_decision, counts
+
+
+def calc_most_concurrent(rows):
+    """
+    Returns the most concurrent streams in total and per transcode decision in a single pass.
+
+    Output: {stream_type: {'count', 'started', 'stopped'}}, the latest peak wins ties.
+    """
+    peaks = {stream_type: {'count': 0, 'started': None, 'stopped': None}
+             for stream_type, title in CONCURRENT_STREAM_TITLES}
+    last_start = {}
+
+    for timestamp, started, transcode_decision, counts in sweep_concurrent_streams(rows):
+        for stream_type in ('total', transcode_decision):
+            if stream_type not in peaks:
+                continue
+            peak = peaks[stream_type]
+            if started:
+                if counts[stream_type] >= peak['count']:
+                    last_start[stream_type] = timestamp
+            # counts is after this stream stopped, so the peak ends here
+            elif counts[stream_type] + 1 >= peak['count']:
+                peak['count'] = counts[stream_type] + 1
+                peak['started'] = str(last_start.get(stream_type))
+                peak['stopped'] = str(timestamp)
+
+    return peaks
+
 
 class DataFactory(object):
     """
@@ -109,7 +227,14 @@ class DataFactory(object):
             'NULL AS session_key'
             ]
 
-        if plexpy.CONFIG.HISTORY_TABLE_ACTIVITY:
+        # Cursor pagination is keyed on (started, id), using the group's reference id when grouping
+        use_cursor = kwargs.get('cursor') is not None
+        if grouping:
+            keyset_columns = [('started', None), ('reference_id', None)]
+        else:
+            keyset_columns = [('started', 'session_history.started'), ('id', 'session_history.id')]
+
+        if plexpy.CONFIG.HISTORY_TABLE_ACTIVITY and not use_cursor:
             table_name_union = 'sessions'
             # Very hacky way to match the custom where parameters for the unioned table
             custom_where_union = [[c[0].split('.')[-1], c[1]] for c in custom_where]
@@ -164,6 +289,7 @@ class DataFactory(object):
         else:
             table_name_union = None
             custom_where_union = group_by_union = columns_union = []
+            union_join_types = union_join_tables = union_join_evals = []
 
         try:
             query = data_tables.ssp_query(table_name='session_history',
@@ -189,6 +315,7 @@ class DataFactory(object):
                                           union_join_types=union_join_types,
                                           union_join_tables=union_join_tables,
                                           union_join_evals=union_join_evals,
+                                          keyset_columns=keyset_columns,
                                           kwargs=kwargs)
         except Exception as e:
             logger.warn(u"Tautulli DataFactory :: Unable to execute database query for get_history: %s." % e)
@@ -201,7 +328,11 @@ class DataFactory(object):
         history = query['result']
 
         filter_duration = 0
-        total_duration = self.get_total_duration(custom_where=custom_where)
+        if use_cursor:
+            # Totals scan the whole history, which a cursor page is meant to avoid
+            total_duration = None
+        else:
+            total_duration = self.get_total_duration(custom_where=custom_where)
 
         watched_percent = {'movie': plexpy.CONFIG.MOVIE_WATCHED_PERCENT,
                            'episode': plexpy.CONFIG.TV_WATCHED_PERCENT,
@@ -244,9 +375,13 @@ class DataFactory(object):
                 'data': session.friendly_name_to_username(rows),
                 'draw': query['draw'],
                 'filter_duration': helpers.human_duration(filter_duration, sig='dhm'),
-                'total_duration': helpers.human_duration(total_duration, sig='dhm')
+                'total_duration': helpers.human_duration(total_duration, sig='dhm') if total_duration is not None else None
                 }
 
+        if use_cursor:
+            dict['next_cursor'] = query['next_cursor']
+            dict['prev_cursor'] = query['prev_cursor']
+
         return dict
 
     def get_home_stats(self, server_id=None, grouping=None, time_range=30, stats_type='plays', stats_count=10, stats_cards=None):
@@ -263,6 +398,7 @@ class DataFactory(object):
 
         group_by = 'session_history.reference_id' if grouping else 'session_history.id'
         sort_type = 'total_duration' if stats_type == 'duration' else 'total_plays'
+        timestamp = helpers.timestamp_days_ago(time_range)
 
         home_stats = []
 
@@ -275,7 +411,20 @@ class DataFactory(object):
             allowed_servers = ','.join(session.get_session_shared_servers())
             where_server = (' AND session_history.server_id IN (%s) ' % allowed_servers)
 
+        # Cards are cached per user since the rows are masked for their permissions
+        permissions = (session.get_session_user_id(), session.get_session_access_level(), where_server)
+        cache_generation = _home_stats_cache_info['generation']
+
         for stat in stats_cards:
+            cache_key = (str(server_id) if server_id else None, str(time_range), stats_type, str(stats_count),
+                         stat, bool(grouping), permissions)
+            cached_stats = get_cached_home_stat(cache_key)
+            if cached_stats is not None:
+                home_stats.extend(cached_stats)
+                continue
+
+            card_start = len(home_stats)
+
             if stat == 'top_movies':
                 top_movies = []
                 try:
@@ -287,14 +436,13 @@ class DataFactory(object):
                             '       AS d ' \
                             '   FROM session_history ' \
                             '   JOIN session_history_metadata ON session_history_metadata.id = session_history.id ' \
-                            '   WHERE datetime(session_history.stopped, "unixepoch", "localtime") ' \
-                            '       >= datetime("now", "-%s days", "localtime") ' \
+                            '   WHERE session_history.stopped >= %s ' \
                             '       AND session_history.media_type = "movie" ' \
                             '       %s ' \
                             '   GROUP BY %s) AS t ' \
                             'GROUP BY t.full_title ' \
                             'ORDER BY %s DESC, started DESC ' \
-                            'LIMIT %s ' % (time_range, where_server, group_by, sort_type, stats_count)
+                            'LIMIT %s ' % (timestamp, where_server, group_by, sort_type, stats_count)
                     result = monitor_db.select(query)
                 except Exception as e:
                     logger.warn(u"Tautulli DataFactory :: Unable to execute database query for get_home_stats: top_movies: %s." % e)
@@ -339,14 +487,13 @@ class DataFactory(object):
                             '       AS d ' \
                             '   FROM session_history ' \
                             '   JOIN session_history_metadata ON session_history_metadata.id = session_history.id ' \
-                            '   WHERE datetime(session_history.stopped, "unixepoch", "localtime") ' \
-                            '       >= datetime("now", "-%s days", "localtime") ' \
+                            '   WHERE session_history.stopped >= %s ' \
                             '       AND session_history.media_type = "movie" ' \
                             '       %s ' \
                             '   GROUP BY %s) AS t ' \
                             'GROUP BY t.full_title ' \
                             'ORDER BY users_watched DESC, %s DESC, started DESC ' \
-                            'LIMIT %s ' % (time_range, where_server, group_by, sort_type, stats_count)
+                            'LIMIT %s ' % (timestamp, where_server, group_by, sort_type, stats_count)
                     result = monitor_db.select(query)
                 except Exception as e:
                     logger.warn(u"Tautulli DataFactory :: Unable to execute database query for get_home_stats: popular_movies: %s." % e)
@@ -388,14 +535,13 @@ class DataFactory(object):
                             '       AS d ' \
                             '   FROM session_history ' \
                             '   JOIN session_history_metadata ON session_history_metadata.id = session_history.id ' \
-                            '   WHERE datetime(session_history.stopped, "unixepoch", "localtime") ' \
-                            '       >= datetime("now", "-%s days", "localtime") ' \
+                            '   WHERE session_history.stopped >= %s ' \
                             '       AND session_history.media_type = "episode" ' \
                             '       %s ' \
                             '   GROUP BY %s) AS t ' \
                             'GROUP BY t.grandparent_title ' \
                             'ORDER BY %s DESC, started DESC ' \
-                            'LIMIT %s ' % (time_range, where_server, group_by, sort_type, stats_count)
+                            'LIMIT %s ' % (timestamp, where_server, group_by, sort_type, stats_count)
                     result = monitor_db.select(query)
                 except Exception as e:
                     logger.warn(u"Tautulli DataFactory :: Unable to execute database query for get_home_stats: top_tv: %s." % e)
@@ -440,14 +586,13 @@ class DataFactory(object):
                             '       AS d ' \
                             '   FROM session_history ' \
                             '   JOIN session_history_metadata ON session_history_metadata.id = session_history.id ' \
-                            '   WHERE datetime(session_history.stopped, "unixepoch", "localtime") ' \
-                            '       >= datetime("now", "-%s days", "localtime") ' \
+                            '   WHERE session_history.stopped >= %s ' \
                             '       AND session_history.media_type = "episode" ' \
                             '       %s ' \
                             '   GROUP BY %s) AS t ' \
                             'GROUP BY t.grandparent_title ' \
                             'ORDER BY users_watched DESC, %s DESC, started DESC ' \
-                            'LIMIT %s ' % (time_range, where_server, group_by, sort_type, stats_count)
+                            'LIMIT %s ' % (timestamp, where_server, group_by, sort_type, stats_count)
                     result = monitor_db.select(query)
                 except Exception as e:
                     logger.warn(u"Tautulli DataFactory :: Unable to execute database query for get_home_stats: popular_tv: %s." % e)
@@ -490,14 +635,13 @@ class DataFactory(object):
                             '       AS d ' \
                             '   FROM session_history ' \
                             '   JOIN session_history_metadata ON session_history_metadata.id = session_history.id ' \
-                            '   WHERE datetime(session_history.stopped, "unixepoch", "localtime") ' \
-                            '       >= datetime("now", "-%s days", "localtime") ' \
+                            '   WHERE session_history.stopped >= %s ' \
                             '       AND session_history.media_type = "track" ' \
                             '       %s ' \
                             '   GROUP BY %s) AS t ' \
                             'GROUP BY t.original_title, t.grandparent_title ' \
                             'ORDER BY %s DESC, started DESC ' \
-                            'LIMIT %s ' % (time_range, where_server, group_by, sort_type, stats_count)
+                            'LIMIT %s ' % (timestamp, where_server, group_by, sort_type, stats_count)
                     result = monitor_db.select(query)
                 except Exception as e:
                     logger.warn(u"Tautulli DataFactory :: Unable to execute database query for get_home_stats: top_music: %s." % e)
@@ -543,14 +687,13 @@ class DataFactory(object):
                             '       AS d ' \
                             '   FROM session_history ' \
                             '   JOIN session_history_metadata ON session_history_metadata.id = session_history.id ' \
-                            '   WHERE datetime(session_history.stopped, "unixepoch", "localtime") ' \
-                            '       >= datetime("now", "-%s days", "localtime") ' \
+                            '   WHERE session_history.stopped >= %s ' \
                             '       AND session_history.media_type = "track" ' \
                             '       %s ' \
                             '   GROUP BY %s) AS t ' \
                             'GROUP BY t.original_title, t.grandparent_title ' \
                             'ORDER BY users_watched DESC, %s DESC, started DESC ' \
-                            'LIMIT %s ' % (time_range, where_server, group_by, sort_type, stats_count)
+                            'LIMIT %s ' % (timestamp, where_server, group_by, sort_type, stats_count)
                     result = monitor_db.select(query)
                 except Exception as e:
                     logger.warn(u"Tautulli DataFactory :: Unable to execute database query for get_home_stats: popular_music: %s." % e)
@@ -594,13 +737,12 @@ class DataFactory(object):
                             '   FROM session_history ' \
                             '   JOIN session_history_metadata ON session_history_metadata.id = session_history.id ' \
                             '   LEFT OUTER JOIN users ON session_history.user_id = users.user_id ' \
-                            '   WHERE datetime(session_history.stopped, "unixepoch", "localtime") ' \
-                            '       >= datetime("now", "-%s days", "localtime") ' \
+                            '   WHERE session_history.stopped >= %s ' \
                             '     %s ' \
                             '   GROUP BY %s) AS t ' \
                             'GROUP BY t.user_id ' \
                             'ORDER BY %s DESC, started DESC ' \
-                            'LIMIT %s ' % (time_range, where_server, group_by, sort_type, stats_count)
+                            'LIMIT %s ' % (timestamp, where_server, group_by, sort_type, stats_count)
                     result = monitor_db.select(query)
                 except Exception as e:
                     logger.warn(u"Tautulli DataFactory :: Unable to execute database query for get_home_stats: top_users: %s." % e)
@@ -647,13 +789,12 @@ class DataFactory(object):
                             '       AS d ' \
                             '   FROM session_history ' \
                             '   JOIN session_history_metadata ON session_history_metadata.id = session_history.id ' \
-                            '   WHERE datetime(session_history.stopped, "unixepoch", "localtime") ' \
-                            '       >= datetime("now", "-%s days", "localtime") ' \
+                            '   WHERE session_history.stopped >= %s ' \
                             '     %s ' \
                             '   GROUP BY %s) AS t ' \
                             'GROUP BY t.platform ' \
                             'ORDER BY %s DESC, started DESC ' \
-                            'LIMIT %s ' % (time_range, where_server, group_by, sort_type, stats_count)
+                            'LIMIT %s ' % (timestamp, where_server, group_by, sort_type, stats_count)
                     result = monitor_db.select(query)
                 except Exception as e:
                     logger.warn(u"Tautulli DataFactory :: Unable to execute database query for get_home_stats: top_platforms: %s." % e)
@@ -701,8 +842,7 @@ class DataFactory(object):
                             'FROM (SELECT * FROM session_history ' \
                             '   JOIN session_history_metadata ON session_history_metadata.id = session_history.id ' \
                             '   LEFT OUTER JOIN users ON session_history.user_id = users.user_id ' \
-                            '   WHERE datetime(session_history.stopped, "unixepoch", "localtime") ' \
-                            '       >= datetime("now", "-%s days", "localtime") ' \
+                            '   WHERE session_history.stopped >= %s ' \
                             '       AND (session_history.media_type = "movie" ' \
                             '           OR session_history_metadata.media_type = "episode") ' \
                             '       %s ' \
@@ -711,7 +851,7 @@ class DataFactory(object):
                             '   OR t.media_type == "episode" AND percent_complete >= %s ' \
                             'GROUP BY t.id ' \
                             'ORDER BY last_watch DESC ' \
-                            'LIMIT %s' % (time_range, where_server, group_by, movie_watched_percent, tv_watched_percent,  stats_count)
+                            'LIMIT %s' % (timestamp, where_server, group_by, movie_watched_percent, tv_watched_percent,  stats_count)
                     result = monitor_db.select(query)
                 except Exception as e:
                     logger.warn(u"Tautulli DataFactory :: Unable to execute database query for get_home_stats: last_watched: %s." % e)
@@ -748,86 +888,30 @@ class DataFactory(object):
                                    'rows': session.mask_session_info(last_watched)})
 
             elif stat == 'most_concurrent':
-
-                def calc_most_concurrent(title, result):
-                    '''
-                    Function to calculate most concurrent streams
-                    Input: Stat title, SQLite query result
-                    Output: Dict {title, count, started, stopped}
-                    '''
-                    times = []
-                    for item in result:
-                        times.append({'time': str(item['started']) + 'B', 'count': 1})
-                        times.append({'time': str(item['stopped']) + 'A', 'count': -1})
-                    times = sorted(times, key=lambda k: k['time']) 
-
-                    count = 0
-                    last_count = 0
-                    last_start = ''
-                    concurrent = {'title': title,
-                                  'count': 0,
-                                  'started': None,
-                                  'stopped': None
-                                  }
-
-                    for d in times:
-                        if d['count'] == 1:
-                            count += d['count']
-                            if count >= last_count:
-                                last_start = d['time']
-                        else:
-                            if count >= last_count:
-                                last_count = count
-                                concurrent['count'] = count
-                                concurrent['started'] = last_start[:-1]
-                                concurrent['stopped'] = d['time'][:-1]
-                            count += d['count']
-
-                    return concurrent
-
-                most_concurrent = []
-
                 try:
-                    base_query = 'SELECT session_history.started, session_history.stopped ' \
-                                 'FROM session_history ' \
-                                 'JOIN session_history_media_info ON session_history.id = session_history_media_info.id ' \
-                                 'WHERE datetime(stopped, "unixepoch", "localtime") ' \
-                                 '>= datetime("now", "-%s days", "localtime") %s' % (time_range, where_server)
-
-                    title = 'Concurrent Streams'
-                    query = base_query
-                    result = monitor_db.select(query)
-                    if result:
-                        most_concurrent.append(calc_most_concurrent(title, result))
-
-                    title = 'Concurrent Transcodes'
-                    query = base_query \
-                          + 'AND session_history_media_info.transcode_decision = "transcode" '
-                    result = monitor_db.select(query)
-                    if result:
-                        most_concurrent.append(calc_most_concurrent(title, result))
-
-                    title = 'Concurrent Direct Streams'
-                    query = base_query \
-                          + 'AND session_history_media_info.transcode_decision = "copy" '
-                    result = monitor_db.select(query)
-                    if result:
-                        most_concurrent.append(calc_most_concurrent(title, result))
-
-                    title = 'Concurrent Direct Plays'
-                    query = base_query \
-                          + 'AND session_history_media_info.transcode_decision = "direct play" '
+                    query = 'SELECT session_history.started, session_history.stopped, ' \
+                            'session_history_media_info.transcode_decision ' \
+                            'FROM session_history ' \
+                            'JOIN session_history_media_info ON session_history.id = session_history_media_info.id ' \
+                            'WHERE session_history.stopped >= %s %s' % (timestamp, where_server)
                     result = monitor_db.select(query)
-                    if result:
-                        most_concurrent.append(calc_most_concurrent(title, result))
                 except Exception as e:
                     logger.warn(u"Tautulli DataFactory :: Unable to execute database query for get_home_stats: most_concurrent: %s." % e)
                     return None
 
+                most_concurrent = []
+                if result:
+                    peaks = calc_most_concurrent(result)
+                    for stream_type, title in CONCURRENT_STREAM_TITLES:
+                        if peaks[stream_type]['count']:
+                            most_concurrent.append(dict(peaks[stream_type], title=title))
+
                 home_stats.append({'stat_id': stat,
                                    'stat_title': 'Most Concurrent Streams',
                                    'rows': most_concurrent})
 
+            set_cached_home_stat(cache_key, home_stats[card_start:], cache_generation)
+
         return home_stats
 
     def get_library_stats(self, library_cards=[]):
@@ -1536,6 +1620,14 @@ class DataFactory(object):
 
         if row_id.isdigit():
             logger.info(u"Tautulli DataFactory :: Deleting row id %s from the session history database." % row_id)
+            row = monitor_db.select_single('SELECT id, reference_id, started, stopped, paused_counter, '
+                                           'server_id, user_id, media_type '
+                                           'FROM session_history WHERE id = ?', [row_id])
+            group_start = None
+            if row:
+                group_start = monitor_db.select_single('SELECT MIN(id) AS id FROM session_history '
+                                                       'WHERE reference_id IS ?', [row['reference_id']])
+
             session_history_del = \
                 monitor_db.action('DELETE FROM session_history WHERE id = ?', [row_id])
             session_history_media_info_del = \
@@ -1543,6 +1635,26 @@ class DataFactory(object):
             session_history_metadata_del = \
                 monitor_db.action('DELETE FROM session_history_metadata WHERE id = ?', [row_id])
 
+            if row:
+                # Only the hourly buckets of the deleted row and the next row of its play change
+                was_group_start = bool(group_start) and group_start['id'] == row['id']
+                new_group_start = None
+                if was_group_start:
+                    new_group_start = monitor_db.select_single('SELECT started, server_id, user_id, media_type '
+                                                               'FROM session_history WHERE id = '
+                                                               '(SELECT MIN(id) FROM session_history '
+                                                               ' WHERE reference_id IS ?)', [row['reference_id']])
+
+                database.remove_history_rollup(started=row['started'],
+                                               stopped=row['stopped'],
+                                               paused_counter=row['paused_counter'],
+                                               server_id=row['server_id'],
+                                               user_id=row['user_id'],
+                                               media_type=row['media_type'],
+                                               group_start=was_group_start,
+                                               new_group_start=new_group_start)
+                clear_home_stats_cache(server_id=row['server_id'])
+
             return 'Deleted rows %s.' % row_id
         else:
             return 'Unable to delete rows. Input row not valid.'
@@ -1830,11 +1942,12 @@ class DataFactory(object):
 
         return result
 
-    def set_recently_added_item(self, server_id, rating_key=''):
-        server = plexpy.PMS_SERVERS.get_server_by_id(server_id)
+    def set_recently_added_item(self, server_id, rating_key='', metadata=None):
         monitor_db = database.MonitorDatabase()
 
-        metadata = server.PMSCONNECTION.get_metadata_details(rating_key)
+        if not metadata:
+            server = plexpy.PMS_SERVERS.get_server_by_id(server_id)
+            metadata = server.PMSCONNECTION.get_metadata_details(rating_key)
 
         keys = { 'server_id': server_id,
                  'rating_key': metadata['rating_key'],
@@ -13,13 +13,20 @@
 #  You should have received a copy of the GNU General Public License
 #  along with Tautulli.  If not, see <http://www.gnu.org/licenses/>.
 
+import base64
+import json
 import re
+import time
 
 from plexpy import database
 from plexpy import helpers
 from plexpy import logger
 
 
+TOTAL_COUNT_CACHE_SECONDS = 60
+_total_count_cache = {}
+
+
 class DataTables(object):
     """
     Server side processing for Datatables
@@ -43,6 +50,7 @@ class DataTables(object):
                   union_join_types=[],
                   union_join_tables=[],
                   union_join_evals=[],
+                  keyset_columns=[],
                   kwargs=None):
 
         if not table_name:
@@ -83,40 +91,143 @@ class DataTables(object):
             union = ''
             cwu_args = []
 
+        # Keyset (cursor) pagination instead of offsets when a cursor is requested
+        cursor = kwargs.get('cursor') if keyset_columns else None
+        if cursor is not None:
+            position = decode_cursor(cursor)
+            direction = position['dir'] if position else 'next'
+
+            if position:
+                c_where, cw_args = self.build_keyset_where(c_where, cw_args, position,
+                                                           [c[1] for c in keyset_columns if c[1]])
+                where, w_args = self.build_keyset_where(where, w_args, position,
+                                                        [c[0] for c in keyset_columns])
+
+            # Cursors always walk newest to oldest
+            sort_order = ' DESC' if direction == 'next' else ' ASC'
+            order = 'ORDER BY ' + ', '.join([c[0] + sort_order for c in keyset_columns])
+
         args = cw_args + cwu_args + w_args
 
+        # Remove NULL rows (aggregates without any matching rows)
+        where = self.build_not_null_where(where, extracted_columns['column_named'])
+
         # Build the query
-        query = 'SELECT * FROM (SELECT %s FROM %s %s %s %s %s) %s %s' \
-                % (extracted_columns['column_string'], table_name, join, c_where, group, union, where, order)
+        query = 'SELECT * FROM (SELECT %s FROM %s %s %s %s %s) %s' \
+                % (extracted_columns['column_string'], table_name, join, c_where, group, union, where)
 
         # logger.debug(u"Query: %s" % query)
 
-        # Execute the query
-        filtered = self.ssp_db.select(query, args=args)
+        if cursor is not None:
+            return self.ssp_keyset_page(query, order, args, parameters, keyset_columns, position, direction)
+
+        # Count the filtered results without fetching them
+        filtered_count = self.ssp_db.select_single('SELECT COUNT(*) AS filtered_count FROM (%s)' % query,
+                                                   args=args)['filtered_count']
+
+        # Paginate results in the query so only one page is fetched
+        start = max(int(parameters['start']), 0)
+        length = int(parameters['length'])
+        if length < 0:
+            # Datatables sends -1 to show all rows
+            length = -1
 
-        # Remove NULL rows
-        filtered = [row for row in filtered if not all(v is None for v in row.values())]
+        result = self.ssp_db.select('%s %s LIMIT ? OFFSET ?' % (query, order), args=args + [length, start])
 
         # Build grand totals
-        totalcount = self.ssp_db.select('SELECT COUNT(id) as total_count from %s' % table_name)[0]['total_count']
+        totalcount = self.get_total_count(table_name)
 
         # Get draw counter
         draw_counter = int(parameters['draw'])
 
-        # Paginate results
-        result = filtered[parameters['start']:(parameters['start'] + parameters['length'])]
-
         # Sanitize on the way out
         result = [{k: helpers.sanitize(v) if isinstance(v, str) else v for k, v in row.items()}
                   for row in result]
 
         output = {'result': result,
                   'draw': draw_counter,
-                  'filteredCount': len(filtered),
+                  'filteredCount': filtered_count,
                   'totalCount': totalcount}
 
         return output
 
+    def ssp_keyset_page(self, query, order, args, parameters, keyset_columns, position, direction):
+        # Fetch one extra row to know if there is another page
+        length = max(int(parameters['length']), 1)
+        result = self.ssp_db.select('%s %s LIMIT ?' % (query, order), args=args + [length + 1])
+
+        has_more = len(result) > length
+        result = result[:length]
+        if direction == 'prev':
+            result.reverse()
+
+        names = [c[0] for c in keyset_columns]
+        next_cursor = prev_cursor = None
+        if result:
+            if direction == 'next':
+                next_cursor = encode_cursor('next', [result[-1][n] for n in names]) if has_more else None
+                prev_cursor = encode_cursor('prev', [result[0][n] for n in names]) if position else None
+            else:
+                next_cursor = encode_cursor('next', [result[-1][n] for n in names])
+                prev_cursor = encode_cursor('prev', [result[0][n] for n in names]) if has_more else None
+
+        # Sanitize on the way out
+        result = [{k: helpers.sanitize(v) if isinstance(v, str) else v for k, v in row.items()}
+                  for row in result]
+
+        # Counting the filtered rows would defeat the purpose of a cursor
+        output = {'result': result,
+                  'draw': int(parameters['draw']),
+                  'filteredCount': None,
+                  'totalCount': None,
+                  'next_cursor': next_cursor,
+                  'prev_cursor': prev_cursor}
+
+        return output
+
+    def build_keyset_where(self, where='', args=[], position=None, columns=[]):
+        # Build a (col1, col2, ...) < (?, ?, ...) condition, expanded for the sqlite query planner
+        if not columns or len(columns) != len(position['values']):
+            return where, args
+
+        op = '<' if position['dir'] == 'next' else '>'
+        values = position['values']
+        terms = []
+        keyset_args = []
+
+        for i, column in enumerate(columns):
+            term = ' AND '.join(['%s = ?' % c for c in columns[:i]] + ['%s %s ?' % (column, op)])
+            terms.append('(' + term + ')')
+            keyset_args += values[:i] + [values[i]]
+
+        keyset = '(' + ' OR '.join(terms) + ')'
+
+        if where:
+            return 'WHERE (' + where[len('WHERE '):] + ') AND ' + keyset, args + keyset_args
+        return 'WHERE ' + keyset, args + keyset_args
+
+    def get_total_count(self, table_name):
+        # The grand total is only informational, so cache it briefly instead of counting every page
+        cached = _total_count_cache.get(table_name)
+        if cached and time.time() - cached[1] < TOTAL_COUNT_CACHE_SECONDS:
+            return cached[0]
+
+        totalcount = self.ssp_db.select_single('SELECT COUNT(id) AS total_count FROM %s' % table_name)['total_count']
+        _total_count_cache[table_name] = (totalcount, time.time())
+
+        return totalcount
+
+    def build_not_null_where(self, where='', columns=[]):
+        # Exclude rows where every column is NULL
+        if not columns:
+            return where
+
+        not_null = 'NOT (' + ' AND '.join(['%s IS NULL' % c for c in columns]) + ')'
+
+        if where:
+            return 'WHERE (' + where[len('WHERE '):] + ') AND ' + not_null
+        return 'WHERE ' + not_null
+
     def build_grouping(self, group_by=[]):
         # Build grouping
         group = ''
@@ -280,3 +391,29 @@ class DataTables(object):
                        }
 
         return column_data
+
+
+def encode_cursor(direction, values):
+    """ Encodes a keyset position into an opaque cursor token """
+
+    return base64.urlsafe_b64encode(json.dumps({'dir': direction, 'values': values}).encode('utf-8')).decode('utf-8')
+
+
+def decode_cursor(cursor):
+    """ Decodes a cursor token, returns None for the first page or an invalid token """
+
+    if not cursor:
+        return None
+
+    try:
+        position = json.loads(base64.urlsafe_b64decode(str(cursor).encode('utf-8')).decode('utf-8'))
+    except (ValueError, TypeError) as e:
+        logger.warn(u"Tautulli DataTables :: Invalid cursor %s: %s" % (cursor, e))
+        return None
+
+    if not isinstance(position, dict) or position.get('dir') not in ('next', 'prev') \
+            or not isinstance(position.get('values'), list):
+        logger.warn(u"Tautulli DataTables :: Invalid cursor %s." % cursor)
+        return None
+
+    return position
@@ -14,25 +14,61 @@
 #  along with Tautulli.  If not, see <http://www.gnu.org/licenses/>.
 
 import datetime
+import time
 from time import mktime
 
 import plexpy
 from plexpy import common
 from plexpy import database
+from plexpy import datafactory
+from plexpy import helpers
 from plexpy import logger
 from plexpy import session
 
 
+def rollup_time_cond(timestamp):
+    """ Returns the session_history_rollup filter for the hours since the timestamp """
+    local_time = time.localtime(timestamp)
+    date = time.strftime('%Y-%m-%d', local_time)
+
+    return 'session_history.date >= "%s" AND (session_history.date > "%s" OR session_history.hour >= %s) ' \
+        % (date, date, local_time.tm_hour)
+
+
 class Graphs(object):
 
     def __init__(self):
         pass
 
+    def _get_rollup_columns(self, monitor_db, x_axis, value, server_cond2):
+        """ Returns the graph series and the matching session_history_rollup columns for the x axis """
+        if x_axis == 'server':
+            query = 'SELECT id, pms_name FROM servers %s ORDER BY pms_name' % server_cond2
+            servers = monitor_db.select(query)
+            columns = []
+            data = {}
+            for cnt, server in enumerate(servers):
+                columns.append('SUM(CASE WHEN server_id = %s THEN %s ELSE 0 END) AS \'%s\'' % (server['id'], value, cnt))
+                data[str(cnt)] = {'label': server['pms_name'], 'series': []}
+        else:
+            media_types = [('tv_count', 'episode', 'TV'),
+                           ('movie_count', 'movie', 'Movies'),
+                           ('music_count', 'track', 'Music')]
+            columns = []
+            data = {}
+            for col, media_type, label in media_types:
+                columns.append('SUM(CASE WHEN media_type = "%s" THEN %s ELSE 0 END) AS %s' % (media_type, value, col))
+                data[col] = {'label': label, 'series': []}
+
+        return data, ', '.join(columns)
+
     def get_total_plays_per_day(self, time_range='30', x_axis='media', y_axis='plays', server_id=None, user_id=None, grouping=None):
         monitor_db = database.MonitorDatabase()
 
         if not time_range.isdigit():
             time_range = '30'
+
+        timestamp = helpers.timestamp_days_ago(time_range)
         
         if server_id and server_id.isdigit():
             server_cond = 'AND session_history.server_id = %s ' % server_id
@@ -54,92 +90,18 @@ class Graphs(object):
         if grouping is None:
             grouping = plexpy.CONFIG.GROUP_HISTORY_TABLES
 
-        group_by = 'reference_id' if grouping else 'id'
+        value = 'duration' if y_axis == 'duration' else ('grouped_plays' if grouping else 'plays')
 
         try:
-            if x_axis == 'media' and y_axis == 'plays':
-                data = {'tv_count': {'label': 'TV', 'series': []},
-                        'movie_count': {'label': 'Movies', 'series': []},
-                        'music_count': {'label': 'Music', 'series': []},
-                        }
-                query = 'SELECT date(started, "unixepoch", "localtime") AS date_played, ' \
-                        'SUM(CASE WHEN media_type = "episode" THEN 1 ELSE 0 END) AS tv_count, ' \
-                        'SUM(CASE WHEN media_type = "movie" THEN 1 ELSE 0 END) AS movie_count, ' \
-                        'SUM(CASE WHEN media_type = "track" THEN 1 ELSE 0 END) AS music_count ' \
-                        'FROM (SELECT * FROM session_history ' \
-                        'GROUP BY date(started, "unixepoch", "localtime"), %s) ' \
-                        'AS session_history ' \
-                        'WHERE datetime(started, "unixepoch", "localtime") >= datetime("now", "-%s days", "localtime") %s %s' \
-                        'GROUP BY date_played ' \
-                        'ORDER BY date_played ASC' % (group_by, time_range, server_cond, user_cond)
-
-                result = monitor_db.select(query)
-
-            elif x_axis == 'media' and y_axis == 'duration':
-                data = {'tv_count': {'label': 'TV', 'series': []},
-                        'movie_count': {'label': 'Movies', 'series': []},
-                        'music_count': {'label': 'Music', 'series': []},
-                        }
-                query = 'SELECT date(started, "unixepoch", "localtime") AS date_played, ' \
-                        'SUM(CASE WHEN media_type = "episode" AND stopped > 0 THEN (stopped - started) ' \
-                        ' - (CASE WHEN paused_counter IS NULL THEN 0 ELSE paused_counter END) ELSE 0 END) AS TV, ' \
-                        'SUM(CASE WHEN media_type = "movie" AND stopped > 0 THEN (stopped - started) ' \
-                        ' - (CASE WHEN paused_counter IS NULL THEN 0 ELSE paused_counter END) ELSE 0 END) AS Movies, ' \
-                        'SUM(CASE WHEN media_type = "track" AND stopped > 0 THEN (stopped - started) ' \
-                        ' - (CASE WHEN paused_counter IS NULL THEN 0 ELSE paused_counter END) ELSE 0 END) AS Music ' \
-                        'FROM session_history ' \
-                        'WHERE datetime(started, "unixepoch", "localtime") >= datetime("now", "-%s days", "localtime") %s %s' \
-                        'GROUP BY date_played ' \
-                        'ORDER BY date_played ASC' % (time_range, server_cond, user_cond)
-
-                result = monitor_db.select(query)
-
-            elif x_axis == 'server' and y_axis == 'plays':
-                query = 'SELECT id, pms_name FROM servers %s ORDER BY pms_name' % server_cond2
-                servers = monitor_db.select(query)
-                columns = ''
-                data = {}
-                cnt = 0
-                for server in servers:
-                    columns += 'SUM(CASE WHEN server_id = %s THEN 1 ELSE 0 END) AS %s, ' % (
-                        server['id'], "'" + str(cnt) + "'")
-                    data[str(cnt)] = {'label': server['pms_name'], 'series': []}
-                    cnt += 1
-                columns = columns.rstrip(', ')
-
-                query = 'SELECT date(started, "unixepoch", "localtime") AS date_played, ' \
-                        '%s ' \
-                        'FROM (SELECT * FROM session_history ' \
-                        'GROUP BY date(started, "unixepoch", "localtime"), %s) ' \
-                        'AS session_history ' \
-                        'WHERE datetime(started, "unixepoch", "localtime") >= datetime("now", "-%s days", "localtime") %s %s' \
-                        'GROUP BY date_played ' \
-                        'ORDER BY date_played ASC' % (columns, group_by, time_range, server_cond, user_cond)
-
-                result = monitor_db.select(query)
-
-            elif x_axis == 'server' and y_axis == 'duration':
-                query = 'SELECT id, pms_name FROM servers %s ORDER BY pms_name' % server_cond2
-                servers = monitor_db.select(query)
-                columns = ''
-                data = {}
-                cnt = 0
-                for server in servers:
-                    columns += 'SUM(CASE WHEN server_id = %s AND stopped > 0 THEN (stopped - started) ' \
-                               '- (CASE WHEN paused_counter IS NULL THEN 0 ELSE paused_counter END) ELSE 0 END) AS %s, ' \
-                               % (server['id'], "'" + str(cnt) + "'")
-                    data[str(cnt)] = {'label': server['pms_name'], 'series': []}
-                    cnt += 1
-                columns = columns.rstrip(', ')
+            data, columns = self._get_rollup_columns(monitor_db, x_axis, value, server_cond2)
 
-                query = 'SELECT date(started, "unixepoch", "localtime") AS date_played, ' \
-                        ' %s ' \
-                        'FROM session_history ' \
-                        'WHERE datetime(started, "unixepoch", "localtime") >= datetime("now", "-%s days", "localtime") %s %s' \
-                        'GROUP BY date_played ' \
-                        'ORDER BY date_played ASC' % (columns, time_range, server_cond, user_cond)
+            query = 'SELECT session_history.date AS date_played, %s ' \
+                    'FROM session_history_rollup AS session_history ' \
+                    'WHERE %s %s %s' \
+                    'GROUP BY date_played ' \
+                    'ORDER BY date_played ASC' % (columns, rollup_time_cond(timestamp), server_cond, user_cond)
 
-                result = monitor_db.select(query)
+            result = monitor_db.select(query)
 
         except Exception as e:
             logger.warn(u"Tautulli Graphs :: Unable to execute database query for get_total_plays_per_day: %s." % e)
@@ -179,6 +141,8 @@ class Graphs(object):
         if not time_range.isdigit():
             time_range = '30'
 
+        timestamp = helpers.timestamp_days_ago(time_range)
+
         if server_id and server_id.isdigit():
             server_cond = 'AND session_history.server_id = %s ' % server_id
             server_cond2 = 'WHERE id = %s ' % server_id
@@ -199,125 +163,27 @@ class Graphs(object):
         if grouping is None:
             grouping = plexpy.CONFIG.GROUP_HISTORY_TABLES
 
-        group_by = 'reference_id' if grouping else 'id'
+        value = 'duration' if y_axis == 'duration' else ('grouped_plays' if grouping else 'plays')
 
         try:
-            if x_axis == 'media' and y_axis == 'plays':
-                data = {'tv_count': {'label': 'TV', 'series': []},
-                        'movie_count': {'label': 'Movies', 'series': []},
-                        'music_count': {'label': 'Music', 'series': []},
-                        }
-                query = 'SELECT strftime("%%w", datetime(started, "unixepoch", "localtime")) AS daynumber, ' \
-                        '(CASE CAST(strftime("%%w", datetime(started, "unixepoch", "localtime")) AS INTEGER) ' \
-                        'WHEN 0 THEN "Sunday" ' \
-                        'WHEN 1 THEN "Monday" ' \
-                        'WHEN 2 THEN "Tuesday" ' \
-                        'WHEN 3 THEN "Wednesday" ' \
-                        'WHEN 4 THEN "Thursday" ' \
-                        'WHEN 5 THEN "Friday" ' \
-                        'ELSE "Saturday" END) AS dayofweek, ' \
-                        'SUM(CASE WHEN media_type = "episode" THEN 1 ELSE 0 END) AS tv_count, ' \
-                        'SUM(CASE WHEN media_type = "movie" THEN 1 ELSE 0 END) AS movie_count, ' \
-                        'SUM(CASE WHEN media_type = "track" THEN 1 ELSE 0 END) AS music_count ' \
-                        'FROM (SELECT * FROM session_history ' \
-                        'GROUP BY strftime("%%w", datetime(started, "unixepoch", "localtime")), %s) ' \
-                        'AS session_history ' \
-                        'WHERE datetime(started, "unixepoch", "localtime") >= datetime("now", "-%s days", "localtime") %s %s' \
-                        'GROUP BY dayofweek ' \
-                        'ORDER BY daynumber' % (group_by, time_range, server_cond, user_cond)
-
-                result = monitor_db.select(query)
-
-            elif x_axis == 'media' and y_axis == 'duration':
-                data = {'tv_count': {'label': 'TV', 'series': []},
-                        'movie_count': {'label': 'Movies', 'series': []},
-                        'music_count': {'label': 'Music', 'series': []},
-                        }
-                query = 'SELECT strftime("%%w", datetime(started, "unixepoch", "localtime")) AS daynumber, ' \
-                        '(CASE CAST(strftime("%%w", datetime(started, "unixepoch", "localtime")) AS INTEGER) ' \
-                        'WHEN 0 THEN "Sunday" ' \
-                        'WHEN 1 THEN "Monday" ' \
-                        'WHEN 2 THEN "Tuesday" ' \
-                        'WHEN 3 THEN "Wednesday" ' \
-                        'WHEN 4 THEN "Thursday" ' \
-                        'WHEN 5 THEN "Friday" ' \
-                        'ELSE "Saturday" END) AS dayofweek, ' \
-                        'SUM(CASE WHEN media_type = "episode" AND stopped > 0 THEN (stopped - started) ' \
-                        ' - (CASE WHEN paused_counter IS NULL THEN 0 ELSE paused_counter END) ELSE 0 END) AS tv_count, ' \
-                        'SUM(CASE WHEN media_type = "movie" AND stopped > 0 THEN (stopped - started) ' \
-                        ' - (CASE WHEN paused_counter IS NULL THEN 0 ELSE paused_counter END) ELSE 0 END) AS movie_count, ' \
-                        'SUM(CASE WHEN media_type = "track" AND stopped > 0 THEN (stopped - started) ' \
-                        ' - (CASE WHEN paused_counter IS NULL THEN 0 ELSE paused_counter END) ELSE 0 END) AS music_count ' \
-                        'FROM session_history ' \
-                        'WHERE datetime(started, "unixepoch", "localtime") >= datetime("now", "-%s days", "localtime") %s %s' \
-                        'GROUP BY dayofweek ' \
-                        'ORDER BY daynumber' % (time_range, server_cond, user_cond)
-
-                result = monitor_db.select(query)
-
-            elif x_axis == 'server' and y_axis == 'plays':
-                query = 'SELECT id, pms_name FROM servers %s ORDER BY pms_name' % server_cond2
-                servers = monitor_db.select(query)
-                columns = ''
-                data = {}
-                cnt = 0
-                for server in servers:
-                    columns += 'SUM(CASE WHEN server_id = %s THEN 1 ELSE 0 END) AS %s, ' % (
-                        server['id'], "'" + str(cnt) + "'")
-                    data[str(cnt)] = {'label': server['pms_name'], 'series': []}
-                    cnt += 1
-                columns = columns.rstrip(', ')
-
-                query = 'SELECT strftime("%%w", datetime(started, "unixepoch", "localtime")) AS daynumber, ' \
-                        '(CASE CAST(strftime("%%w", datetime(started, "unixepoch", "localtime")) AS INTEGER) ' \
-                        'WHEN 0 THEN "Sunday" ' \
-                        'WHEN 1 THEN "Monday" ' \
-                        'WHEN 2 THEN "Tuesday" ' \
-                        'WHEN 3 THEN "Wednesday" ' \
-                        'WHEN 4 THEN "Thursday" ' \
-                        'WHEN 5 THEN "Friday" ' \
-                        'ELSE "Saturday" END) AS dayofweek, ' \
-                        '%s ' \
-                        'FROM (SELECT * FROM session_history ' \
-                        'GROUP BY strftime("%%w", datetime(started, "unixepoch", "localtime")), %s) ' \
-                        'AS session_history ' \
-                        'WHERE datetime(started, "unixepoch", "localtime") >= datetime("now", "-%s days", "localtime") %s %s' \
-                        'GROUP BY dayofweek ' \
-                        'ORDER BY daynumber' % (columns, group_by, time_range, server_cond, user_cond)
-
-                result = monitor_db.select(query)
-
-            elif x_axis == 'server' and y_axis == 'duration':
-                query = 'SELECT id, pms_name FROM servers %s ORDER BY pms_name' % server_cond2
-                servers = monitor_db.select(query)
-                columns = ''
-                data = {}
-                cnt = 0
-                for server in servers:
-                    columns += 'SUM(CASE WHEN server_id = %s AND stopped > 0 THEN (stopped - started) ' \
-                               '- (CASE WHEN paused_counter IS NULL THEN 0 ELSE paused_counter END) ELSE 0 END) AS %s, ' \
-                               % (server['id'], "'" + str(cnt) + "'")
-                    data[str(cnt)] = {'label': server['pms_name'], 'series': []}
-                    cnt += 1
-                columns = columns.rstrip(', ')
-
-                query = 'SELECT strftime("%%w", datetime(started, "unixepoch", "localtime")) AS daynumber, ' \
-                        '(CASE CAST(strftime("%%w", datetime(started, "unixepoch", "localtime")) AS INTEGER) ' \
-                        'WHEN 0 THEN "Sunday" ' \
-                        'WHEN 1 THEN "Monday" ' \
-                        'WHEN 2 THEN "Tuesday" ' \
-                        'WHEN 3 THEN "Wednesday" ' \
-                        'WHEN 4 THEN "Thursday" ' \
-                        'WHEN 5 THEN "Friday" ' \
-                        'ELSE "Saturday" END) AS dayofweek, ' \
-                        '%s ' \
-                        'FROM session_history ' \
-                        'WHERE datetime(started, "unixepoch", "localtime") >= datetime("now", "-%s days", "localtime") %s %s' \
-                        'GROUP BY dayofweek ' \
-                        'ORDER BY daynumber' % (columns, time_range, server_cond, user_cond)
-
-                result = monitor_db.select(query)
-
+            data, columns = self._get_rollup_columns(monitor_db, x_axis, value, server_cond2)
+
+            query = 'SELECT strftime("%%w", session_history.date) AS daynumber, ' \
+                    '(CASE CAST(strftime("%%w", session_history.date) AS INTEGER) ' \
+                    'WHEN 0 THEN "Sunday" ' \
+                    'WHEN 1 THEN "Monday" ' \
+                    'WHEN 2 THEN "Tuesday" ' \
+                    'WHEN 3 THEN "Wednesday" ' \
+                    'WHEN 4 THEN "Thursday" ' \
+                    'WHEN 5 THEN "Friday" ' \
+                    'ELSE "Saturday" END) AS dayofweek, ' \
+                    '%s ' \
+                    'FROM session_history_rollup AS session_history ' \
+                    'WHERE %s %s %s' \
+                    'GROUP BY dayofweek ' \
+                    'ORDER BY daynumber' % (columns, rollup_time_cond(timestamp), server_cond, user_cond)
+
+            result = monitor_db.select(query)
 
         except Exception as e:
             logger.warn(u"Tautulli Graphs :: Unable to execute database query for get_total_plays_per_dayofweek: %s." % e)
@@ -361,6 +227,8 @@ class Graphs(object):
         if not time_range.isdigit():
             time_range = '30'
 
+        timestamp = helpers.timestamp_days_ago(time_range)
+
         if server_id and server_id.isdigit():
             server_cond = 'AND session_history.server_id = %s ' % server_id
             server_cond2 = 'WHERE id = %s ' % server_id
@@ -381,92 +249,18 @@ class Graphs(object):
         if grouping is None:
             grouping = plexpy.CONFIG.GROUP_HISTORY_TABLES
 
-        group_by = 'reference_id' if grouping else 'id'
+        value = 'duration' if y_axis == 'duration' else ('grouped_plays' if grouping else 'plays')
 
         try:
-            if x_axis == 'media' and y_axis == 'plays':
-                data = {'tv_count': {'label': 'TV', 'series': []},
-                        'movie_count': {'label': 'Movies', 'series': []},
-                        'music_count': {'label': 'Music', 'series': []},
-                        }
-                query = 'SELECT strftime("%%H", datetime(started, "unixepoch", "localtime")) AS hourofday, ' \
-                        'SUM(CASE WHEN media_type = "episode" THEN 1 ELSE 0 END) AS tv_count, ' \
-                        'SUM(CASE WHEN media_type = "movie" THEN 1 ELSE 0 END) AS movie_count, ' \
-                        'SUM(CASE WHEN media_type = "track" THEN 1 ELSE 0 END) AS music_count ' \
-                        'FROM (SELECT * FROM session_history ' \
-                        'GROUP BY strftime("%%H", datetime(started, "unixepoch", "localtime")) , %s) ' \
-                        'AS session_history ' \
-                        'WHERE datetime(started, "unixepoch", "localtime") >= datetime("now", "-%s days", "localtime") %s %s' \
-                        'GROUP BY hourofday ' \
-                        'ORDER BY hourofday' % (group_by, time_range, server_cond, user_cond)
-
-                result = monitor_db.select(query)
-
-            elif x_axis == 'media' and y_axis == 'duration':
-                data = {'tv_count': {'label': 'TV', 'series': []},
-                        'movie_count': {'label': 'Movies', 'series': []},
-                        'music_count': {'label': 'Music', 'series': []},
-                        }
-                query = 'SELECT strftime("%%H", datetime(started, "unixepoch", "localtime")) AS hourofday, ' \
-                        'SUM(CASE WHEN media_type = "episode" AND stopped > 0 THEN (stopped - started) ' \
-                        ' - (CASE WHEN paused_counter IS NULL THEN 0 ELSE paused_counter END) ELSE 0 END) AS tv_count, ' \
-                        'SUM(CASE WHEN media_type = "movie" AND stopped > 0 THEN (stopped - started) ' \
-                        ' - (CASE WHEN paused_counter IS NULL THEN 0 ELSE paused_counter END) ELSE 0 END) AS movie_count, ' \
-                        'SUM(CASE WHEN media_type = "track" AND stopped > 0 THEN (stopped - started) ' \
-                        ' - (CASE WHEN paused_counter IS NULL THEN 0 ELSE paused_counter END) ELSE 0 END) AS music_count ' \
-                        'FROM session_history ' \
-                        'WHERE datetime(started, "unixepoch", "localtime") >= datetime("now", "-%s days", "localtime") %s %s' \
-                        'GROUP BY hourofday ' \
-                        'ORDER BY hourofday' % (time_range, server_cond, user_cond)
-
-                result = monitor_db.select(query)
-
-            elif x_axis == 'server' and y_axis == 'plays':
-                query = 'SELECT id, pms_name FROM servers %s ORDER BY pms_name' % server_cond2
-                servers = monitor_db.select(query)
-                columns = ''
-                data = {}
-                cnt = 0
-                for server in servers:
-                    columns += 'SUM(CASE WHEN server_id = %s THEN 1 ELSE 0 END) AS %s, ' % (
-                        server['id'], "'" + str(cnt) + "'")
-                    data[str(cnt)] = {'label': server['pms_name'], 'series': []}
-                    cnt += 1
-                columns = columns.rstrip(', ')
-
-                query = 'SELECT strftime("%%H", datetime(started, "unixepoch", "localtime")) AS hourofday, ' \
-                        '%s ' \
-                        'FROM (SELECT * FROM session_history ' \
-                        'GROUP BY strftime("%%H", datetime(started, "unixepoch", "localtime")) , %s) ' \
-                        'AS session_history ' \
-                        'WHERE datetime(started, "unixepoch", "localtime") >= datetime("now", "-%s days", "localtime") %s %s' \
-                        'GROUP BY hourofday ' \
-                        'ORDER BY hourofday' % (columns, group_by, time_range, server_cond, user_cond)
-
-                result = monitor_db.select(query)
-
-            elif x_axis == 'server' and y_axis == 'duration':
-                query = 'SELECT id, pms_name FROM servers %s ORDER BY pms_name' % server_cond2
-                servers = monitor_db.select(query)
-                columns = ''
-                data = {}
-                cnt = 0
-                for server in servers:
-                    columns += 'SUM(CASE WHEN server_id = %s AND stopped > 0 THEN (stopped - started) ' \
-                               '- (CASE WHEN paused_counter IS NULL THEN 0 ELSE paused_counter END) ELSE 0 END) AS %s, ' \
-                               % (server['id'], "'" + str(cnt) + "'")
-                    data[str(cnt)] = {'label': server['pms_name'], 'series': []}
-                    cnt += 1
-                columns = columns.rstrip(', ')
+            data, columns = self._get_rollup_columns(monitor_db, x_axis, value, server_cond2)
 
-                query = 'SELECT strftime("%%H", datetime(started, "unixepoch", "localtime")) AS hourofday, ' \
-                        '%s ' \
-                        'FROM session_history ' \
-                        'WHERE datetime(started, "unixepoch", "localtime") >= datetime("now", "-%s days", "localtime") %s %s' \
-                        'GROUP BY hourofday ' \
-                        'ORDER BY hourofday' % (columns, time_range, server_cond, user_cond)
+            query = 'SELECT session_history.hour AS hourofday, %s ' \
+                    'FROM session_history_rollup AS session_history ' \
+                    'WHERE %s %s %s' \
+                    'GROUP BY hourofday ' \
+                    'ORDER BY hourofday' % (columns, rollup_time_cond(timestamp), server_cond, user_cond)
 
-                result = monitor_db.select(query)
+            result = monitor_db.select(query)
 
         except Exception as e:
             logger.warn(u"Tautulli Graphs :: Unable to execute database query for get_total_plays_per_hourofday: %s." % e)
@@ -498,11 +292,13 @@ class Graphs(object):
         return output
 
     def get_total_plays_per_month(self, time_range='12', x_axis='media', y_axis='plays', server_id=None, user_id=None, grouping=None):
-        import time as time
-
         if not time_range.isdigit():
             time_range = '12'
 
+        base = time.localtime()
+        timestamp = int(time.mktime((base.tm_year, base.tm_mon - int(time_range), base.tm_mday,
+                                     base.tm_hour, base.tm_min, base.tm_sec, 0, 0, -1)))
+
         monitor_db = database.MonitorDatabase()
 
         if server_id and server_id.isdigit():
@@ -525,92 +321,19 @@ class Graphs(object):
         if grouping is None:
             grouping = plexpy.CONFIG.GROUP_HISTORY_TABLES
 
-        group_by = 'reference_id' if grouping else 'id'
+        value = 'duration' if y_axis == 'duration' else ('grouped_plays' if grouping else 'plays')
 
         try:
-            if x_axis == 'media' and y_axis == 'plays':
-                data = {'tv_count': {'label': 'TV', 'series': []},
-                        'movie_count': {'label': 'Movies', 'series': []},
-                        'music_count': {'label': 'Music', 'series': []},
-                        }
-                query = 'SELECT strftime("%%Y-%%m", datetime(started, "unixepoch", "localtime")) AS datestring, ' \
-                        'SUM(CASE WHEN media_type = "episode" THEN 1 ELSE 0 END) AS tv_count, ' \
-                        'SUM(CASE WHEN media_type = "movie" THEN 1 ELSE 0 END) AS movie_count, ' \
-                        'SUM(CASE WHEN media_type = "track" THEN 1 ELSE 0 END) AS music_count ' \
-                        'FROM (SELECT * FROM session_history ' \
-                        'GROUP BY strftime("%%Y-%%m", datetime(started, "unixepoch", "localtime")), %s) ' \
-                        'AS session_history ' \
-                        'WHERE datetime(started, "unixepoch", "localtime") >= datetime("now", "-%s months", "localtime") %s %s' \
-                        'GROUP BY strftime("%%Y-%%m", datetime(started, "unixepoch", "localtime")) ' \
-                        'ORDER BY datestring DESC LIMIT %s' % (group_by, time_range, server_cond, user_cond, time_range)
-
-                result = monitor_db.select(query)
-
-            elif x_axis == 'media' and y_axis == 'duration':
-                data = {'tv_count': {'label': 'TV', 'series': []},
-                        'movie_count': {'label': 'Movies', 'series': []},
-                        'music_count': {'label': 'Music', 'series': []},
-                        }
-                query = 'SELECT strftime("%%Y-%%m", datetime(started, "unixepoch", "localtime")) AS datestring, ' \
-                        'SUM(CASE WHEN media_type = "episode" AND stopped > 0 THEN (stopped - started) ' \
-                        ' - (CASE WHEN paused_counter IS NULL THEN 0 ELSE paused_counter END) ELSE 0 END) AS tv_count, ' \
-                        'SUM(CASE WHEN media_type = "movie" AND stopped > 0 THEN (stopped - started) ' \
-                        ' - (CASE WHEN paused_counter IS NULL THEN 0 ELSE paused_counter END) ELSE 0 END) AS movie_count, ' \
-                        'SUM(CASE WHEN media_type = "track" AND stopped > 0 THEN (stopped - started) ' \
-                        ' - (CASE WHEN paused_counter IS NULL THEN 0 ELSE paused_counter END) ELSE 0 END) AS music_count ' \
-                        'FROM session_history ' \
-                        'WHERE datetime(started, "unixepoch", "localtime") >= datetime("now", "-%s months", "localtime") %s %s' \
-                        'GROUP BY strftime("%%Y-%%m", datetime(started, "unixepoch", "localtime")) ' \
-                        'ORDER BY datestring DESC LIMIT %s' % (time_range, server_cond, user_cond, time_range)
-
-                result = monitor_db.select(query)
-
-            elif x_axis == 'server' and y_axis == 'plays':
-                query = 'SELECT id, pms_name FROM servers %s ORDER BY pms_name' % server_cond2
-                servers = monitor_db.select(query)
-                columns = ''
-                data = {}
-                cnt = 0
-                for server in servers:
-                    columns += 'SUM(CASE WHEN server_id = %s THEN 1 ELSE 0 END) AS %s, ' % (
-                        server['id'], "'" + str(cnt) + "'")
-                    data[str(cnt)] = {'label': server['pms_name'], 'series': []}
-                    cnt += 1
-                columns = columns.rstrip(', ')
-
-                query = 'SELECT strftime("%%Y-%%m", datetime(started, "unixepoch", "localtime")) AS datestring, ' \
-                        '%s ' \
-                        'FROM (SELECT * FROM session_history ' \
-                        'GROUP BY strftime("%%Y-%%m", datetime(started, "unixepoch", "localtime")), %s) ' \
-                        'AS session_history ' \
-                        'WHERE datetime(started, "unixepoch", "localtime") >= datetime("now", "-%s months", "localtime") %s %s' \
-                        'GROUP BY strftime("%%Y-%%m", datetime(started, "unixepoch", "localtime")) ' \
-                        'ORDER BY datestring DESC LIMIT %s' % (columns, group_by, time_range, server_cond, user_cond, time_range)
-
-                result = monitor_db.select(query)
-
-            elif x_axis == 'server' and y_axis == 'duration':
-                query = 'SELECT id, pms_name FROM servers %s ORDER BY pms_name' % server_cond2
-                servers = monitor_db.select(query)
-                columns = ''
-                data = {}
-                cnt = 0
-                for server in servers:
-                    columns += 'SUM(CASE WHEN server_id = %s AND stopped > 0 THEN (stopped - started) ' \
-                               '- (CASE WHEN paused_counter IS NULL THEN 0 ELSE paused_counter END) ELSE 0 END) AS %s, ' \
-                               % (server['id'], "'" + str(cnt) + "'")
-                    data[str(cnt)] = {'label': server['pms_name'], 'series': []}
-                    cnt += 1
-                columns = columns.rstrip(', ')
+            data, columns = self._get_rollup_columns(monitor_db, x_axis, value, server_cond2)
 
-                query = 'SELECT strftime("%%Y-%%m", datetime(started, "unixepoch", "localtime")) AS datestring, ' \
-                        '%s ' \
-                        'FROM session_history ' \
-                        'WHERE datetime(started, "unixepoch", "localtime") >= datetime("now", "-%s months", "localtime") %s %s' \
-                        'GROUP BY strftime("%%Y-%%m", datetime(started, "unixepoch", "localtime")) ' \
-                        'ORDER BY datestring DESC LIMIT %s' % (columns, time_range, server_cond, user_cond, time_range)
+            query = 'SELECT strftime("%%Y-%%m", session_history.date) AS datestring, %s ' \
+                    'FROM session_history_rollup AS session_history ' \
+                    'WHERE %s %s %s' \
+                    'GROUP BY datestring ' \
+                    'ORDER BY datestring DESC LIMIT %s' % (columns, rollup_time_cond(timestamp), server_cond, user_cond,
+                                                           time_range)
 
-                result = monitor_db.select(query)
+            result = monitor_db.select(query)
 
         except Exception as e:
             logger.warn(u"Tautulli Graphs :: Unable to execute database query for get_total_plays_per_month: %s." % e)
@@ -657,6 +380,8 @@ class Graphs(object):
         if not time_range.isdigit():
             time_range = '30'
 
+        timestamp = helpers.timestamp_days_ago(time_range)
+
         if server_id and server_id.isdigit():
             server_cond = 'AND session_history.server_id = %s ' % server_id
             server_cond2 = 'WHERE id = %s ' % server_id
@@ -690,11 +415,11 @@ class Graphs(object):
                         'SUM(CASE WHEN media_type = "movie" THEN 1 ELSE 0 END) AS movie_count, ' \
                         'SUM(CASE WHEN media_type = "track" THEN 1 ELSE 0 END) AS music_count, ' \
                         'COUNT(id) AS total_count ' \
-                        'FROM (SELECT * FROM session_history GROUP BY %s) AS session_history ' \
-                        'WHERE (datetime(started, "unixepoch", "localtime") >= datetime("now", "-%s days", "localtime")) %s %s' \
+                        'FROM (SELECT * FROM session_history WHERE started >= %s GROUP BY %s) AS session_history ' \
+                        'WHERE (session_history.started >= %s) %s %s' \
                         'GROUP BY platform ' \
                         'ORDER BY total_count DESC ' \
-                        'LIMIT 10' % (group_by, time_range, server_cond, user_cond)
+                        'LIMIT 10' % (timestamp, group_by, timestamp, server_cond, user_cond)
 
                 result = monitor_db.select(query)
 
@@ -713,10 +438,10 @@ class Graphs(object):
                         'SUM(CASE WHEN stopped > 0 THEN (stopped - started) ' \
                         ' - (CASE WHEN paused_counter IS NULL THEN 0 ELSE paused_counter END) ELSE 0 END) AS total_duration ' \
                         'FROM session_history ' \
-                        'WHERE (datetime(started, "unixepoch", "localtime") >= datetime("now", "-%s days", "localtime")) %s %s' \
+                        'WHERE (session_history.started >= %s) %s %s' \
                         'GROUP BY platform ' \
                         'ORDER BY total_duration DESC ' \
-                        'LIMIT 10' % (time_range, server_cond, user_cond)
+                        'LIMIT 10' % (timestamp, server_cond, user_cond)
 
                 result = monitor_db.select(query)
 
@@ -736,11 +461,11 @@ class Graphs(object):
                 query = 'SELECT platform, ' \
                         'COUNT(id) AS total_count, ' \
                         '%s ' \
-                        'FROM (SELECT * FROM session_history GROUP BY %s) AS session_history ' \
-                        'WHERE (datetime(started, "unixepoch", "localtime") >= datetime("now", "-%s days", "localtime")) %s %s' \
+                        'FROM (SELECT * FROM session_history WHERE started >= %s GROUP BY %s) AS session_history ' \
+                        'WHERE (session_history.started >= %s) %s %s' \
                         'GROUP BY platform ' \
                         'ORDER BY total_count DESC ' \
-                        'LIMIT 10' % (columns, group_by, time_range, server_cond, user_cond)
+                        'LIMIT 10' % (columns, timestamp, group_by, timestamp, server_cond, user_cond)
 
                 result = monitor_db.select(query)
 
@@ -763,10 +488,10 @@ class Graphs(object):
                         ' - (CASE WHEN paused_counter IS NULL THEN 0 ELSE paused_counter END) ELSE 0 END) AS total_duration, ' \
                         '%s ' \
                         'FROM session_history ' \
-                        'WHERE (datetime(started, "unixepoch", "localtime") >= datetime("now", "-%s days", "localtime")) %s %s' \
+                        'WHERE (session_history.started >= %s) %s %s' \
                         'GROUP BY platform ' \
                         'ORDER BY total_duration DESC ' \
-                        'LIMIT 10' % (columns, time_range, server_cond, user_cond)
+                        'LIMIT 10' % (columns, timestamp, server_cond, user_cond)
 
                 result = monitor_db.select(query)
 
@@ -800,6 +525,8 @@ class Graphs(object):
         if not time_range.isdigit():
             time_range = '30'
 
+        timestamp = helpers.timestamp_days_ago(time_range)
+
         if server_id and server_id.isdigit():
             server_cond = 'AND session_history.server_id = %s ' % server_id
             server_cond2 = 'WHERE id = %s ' % server_id
@@ -836,12 +563,12 @@ class Graphs(object):
                         'SUM(CASE WHEN media_type = "movie" THEN 1 ELSE 0 END) AS movie_count, ' \
                         'SUM(CASE WHEN media_type = "track" THEN 1 ELSE 0 END) AS music_count, ' \
                         'COUNT(session_history.id) AS total_count ' \
-                        'FROM (SELECT * FROM session_history GROUP BY %s) AS session_history ' \
+                        'FROM (SELECT * FROM session_history WHERE started >= %s GROUP BY %s) AS session_history ' \
                         'JOIN users ON session_history.user_id = users.user_id ' \
-                        'WHERE (datetime(started, "unixepoch", "localtime") >= datetime("now", "-%s days", "localtime")) %s %s' \
+                        'WHERE (session_history.started >= %s) %s %s' \
                         'GROUP BY session_history.user_id ' \
                         'ORDER BY total_count DESC ' \
-                        'LIMIT 10' % (group_by, time_range, server_cond, user_cond)
+                        'LIMIT 10' % (timestamp, group_by, timestamp, server_cond, user_cond)
 
                 result = monitor_db.select(query)
 
@@ -864,10 +591,10 @@ class Graphs(object):
                         ' - (CASE WHEN paused_counter IS NULL THEN 0 ELSE paused_counter END) ELSE 0 END) AS total_duration ' \
                         'FROM session_history ' \
                         'JOIN users ON session_history.user_id = users.user_id ' \
-                        'WHERE (datetime(started, "unixepoch", "localtime") >= datetime("now", "-%s days", "localtime")) %s %s' \
+                        'WHERE (session_history.started >= %s) %s %s' \
                         'GROUP BY session_history.user_id ' \
                         'ORDER BY total_duration DESC ' \
-                        'LIMIT 10' % (time_range, server_cond, user_cond)
+                        'LIMIT 10' % (timestamp, server_cond, user_cond)
 
                 result = monitor_db.select(query)
 
@@ -890,12 +617,12 @@ class Graphs(object):
                         ' THEN users.username ELSE users.friendly_name END) AS friendly_name,' \
                         'COUNT(session_history.id) AS total_count, ' \
                         '%s ' \
-                        'FROM (SELECT * FROM session_history GROUP BY %s) AS session_history ' \
+                        'FROM (SELECT * FROM session_history WHERE started >= %s GROUP BY %s) AS session_history ' \
                         'JOIN users ON session_history.user_id = users.user_id ' \
-                        'WHERE (datetime(started, "unixepoch", "localtime") >= datetime("now", "-%s days", "localtime")) %s %s' \
+                        'WHERE (session_history.started >= %s) %s %s' \
                         'GROUP BY session_history.user_id ' \
                         'ORDER BY total_count DESC ' \
-                        'LIMIT 10' % (columns, group_by, time_range, server_cond, user_cond)
+                        'LIMIT 10' % (columns, timestamp, group_by, timestamp, server_cond, user_cond)
 
                 result = monitor_db.select(query)
 
@@ -922,10 +649,10 @@ class Graphs(object):
                          '%s ' \
                        'FROM session_history ' \
                         'JOIN users ON session_history.user_id = users.user_id ' \
-                        'WHERE (datetime(started, "unixepoch", "localtime") >= datetime("now", "-%s days", "localtime")) %s %s' \
+                        'WHERE (session_history.started >= %s) %s %s' \
                         'GROUP BY session_history.user_id ' \
                         'ORDER BY total_duration DESC ' \
-                        'LIMIT 10' % (columns, time_range, server_cond, user_cond)
+                        'LIMIT 10' % (columns, timestamp, server_cond, user_cond)
 
                 result = monitor_db.select(query)
 
@@ -964,6 +691,8 @@ class Graphs(object):
         if not time_range.isdigit():
             time_range = '30'
 
+        timestamp = helpers.timestamp_days_ago(time_range)
+
         if server_id and server_id.isdigit():
             server_cond = 'AND session_history.server_id = %s ' % server_id
         elif session.get_session_shared_servers():
@@ -992,17 +721,16 @@ class Graphs(object):
                         'THEN 1 ELSE 0 END) AS ds_count, ' \
                         'SUM(CASE WHEN session_history_media_info.transcode_decision = "transcode" ' \
                         'THEN 1 ELSE 0 END) AS tc_count ' \
-                        'FROM (SELECT * FROM session_history ' \
+                        'FROM (SELECT * FROM session_history WHERE started >= %s ' \
                         'GROUP BY date(session_history.started, "unixepoch", "localtime"), %s) ' \
                         'AS session_history ' \
                         'JOIN session_history_media_info ON session_history.id = session_history_media_info.id ' \
-                        'WHERE (datetime(started, "unixepoch", "localtime") >= ' \
-                        'datetime("now", "-%s days", "localtime")) AND ' \
+                        'WHERE (session_history.started >= %s) AND ' \
                         '(session_history.media_type = "episode" OR ' \
                         'session_history.media_type = "movie" OR ' \
                         'session_history.media_type = "track") %s %s' \
                         'GROUP BY date_played ' \
-                        'ORDER BY started ASC' % (group_by, time_range, server_cond, user_cond)
+                        'ORDER BY started ASC' % (timestamp, group_by, timestamp, server_cond, user_cond)
 
                 result = monitor_db.select(query)
             elif y_axis == 'duration':
@@ -1018,12 +746,11 @@ class Graphs(object):
                         ' - (CASE WHEN paused_counter IS NULL THEN 0 ELSE paused_counter END) ELSE 0 END) AS tc_count ' \
                         'FROM session_history ' \
                         'JOIN session_history_media_info ON session_history.id = session_history_media_info.id ' \
-                        'WHERE datetime(started, "unixepoch", "localtime") >= ' \
-                        'datetime("now", "-%s days", "localtime") AND ' \
+                        'WHERE session_history.started >= %s AND ' \
                         '(session_history.media_type = "episode" OR session_history.media_type = "movie" OR ' \
                         'session_history.media_type = "track") %s %s' \
                         'GROUP BY date_played ' \
-                        'ORDER BY started ASC' % (time_range, server_cond, user_cond)
+                        'ORDER BY started ASC' % (timestamp, server_cond, user_cond)
 
                 result = monitor_db.select(query)
         except Exception as e:
@@ -1072,12 +799,87 @@ class Graphs(object):
                   'series': [series_1_output, series_2_output, series_3_output]}
         return output
 
+    def get_concurrent_streams_per_day(self, time_range='30', server_id=None, user_id=None):
+        monitor_db = database.MonitorDatabase()
+
+        if not time_range.isdigit():
+            time_range = '30'
+
+        timestamp = helpers.timestamp_days_ago(time_range)
+
+        if server_id and server_id.isdigit():
+            server_cond = 'AND session_history.server_id = %s ' % server_id
+        elif session.get_session_shared_servers():
+            allowed_servers = ','.join(session.get_session_shared_servers())
+            server_cond = 'AND session_history.server_id IN (%s) ' % allowed_servers
+        else:
+            server_cond = ''
+
+        user_cond = ''
+        if session.get_session_user_id() and user_id and user_id != str(session.get_session_user_id()):
+            user_cond = 'AND session_history.user_id = %s ' % session.get_session_user_id()
+        elif user_id and user_id.isdigit():
+            user_cond = 'AND session_history.user_id = %s ' % user_id
+
+        try:
+            query = 'SELECT session_history.started, session_history.stopped, ' \
+                    'session_history_media_info.transcode_decision ' \
+                    'FROM session_history ' \
+                    'JOIN session_history_media_info ON session_history.id = session_history_media_info.id ' \
+                    'WHERE session_history.stopped >= %s %s %s' % (timestamp, server_cond, user_cond)
+
+            result = monitor_db.select(query)
+        except Exception as e:
+            logger.warn(u"Tautulli Graphs :: Unable to execute database query for get_concurrent_streams_per_day: %s." % e)
+            return None
+
+        days = int(time_range)
+        base = datetime.date.today()
+        start_date = base - datetime.timedelta(days=days-1)
+
+        stream_types = ['direct play', 'copy', 'transcode', 'total']
+        series = {stream_type: [0 for x in range(0, days)] for stream_type in stream_types}
+
+        categories = []
+        for x in range(0, days):
+            d = start_date + datetime.timedelta(days=x)
+            categories.append(d.strftime('%Y-%m-%d'))
+
+        # Concurrent streams after the previous event, these are still playing at midnight
+        current = dict.fromkeys(stream_types, 0)
+        last_offset = -1
+        for event_time, started, transcode_decision, counts in datafactory.sweep_concurrent_streams(result):
+            offset = (datetime.date.fromtimestamp(event_time) - start_date).days
+
+            for day in range(max(last_offset + 1, 0), min(offset, days - 1) + 1):
+                for stream_type in stream_types:
+                    series[stream_type][day] = max(series[stream_type][day], current[stream_type])
+
+            if started and 0 <= offset < days:
+                for stream_type in ('total', transcode_decision):
+                    if stream_type in series:
+                        series[stream_type][offset] = max(series[stream_type][offset], counts[stream_type])
+
+            last_offset = max(last_offset, offset)
+            current = dict(counts)
+
+        output = {'categories': categories,
+                  'series': [{'name': 'Direct Play', 'data': series['direct play']},
+                             {'name': 'Direct Stream', 'data': series['copy']},
+                             {'name': 'Transcode', 'data': series['transcode']},
+                             {'name': 'Total', 'data': series['total']}]
+                  }
+
+        return output
+
     def get_total_plays_by_source_resolution(self, time_range='30', x_axis='media', y_axis='plays', server_id=None, user_id=None, grouping=None):
         monitor_db = database.MonitorDatabase()
 
         if not time_range.isdigit():
             time_range = '30'
 
+        timestamp = helpers.timestamp_days_ago(time_range)
+
         if server_id and server_id.isdigit():
             server_cond = 'AND session_history.server_id = %s ' % server_id
         elif session.get_session_shared_servers():
@@ -1107,14 +909,13 @@ class Graphs(object):
                         'SUM(CASE WHEN session_history_media_info.transcode_decision = "transcode" ' \
                         'THEN 1 ELSE 0 END) AS tc_count, ' \
                         'COUNT(session_history.id) AS total_count ' \
-                        'FROM (SELECT * FROM session_history GROUP BY %s) AS session_history ' \
+                        'FROM (SELECT * FROM session_history WHERE started >= %s GROUP BY %s) AS session_history ' \
                         'JOIN session_history_media_info ON session_history.id = session_history_media_info.id ' \
-                        'WHERE (datetime(started, "unixepoch", "localtime") >= ' \
-                        'datetime("now", "-%s days", "localtime")) AND ' \
+                        'WHERE (session_history.started >= %s) AND ' \
                         '(session_history.media_type = "episode" OR session_history.media_type = "movie") %s %s' \
                         'GROUP BY resolution ' \
                         'ORDER BY total_count DESC ' \
-                        'LIMIT 10' % (group_by, time_range, server_cond, user_cond)
+                        'LIMIT 10' % (timestamp, group_by, timestamp, server_cond, user_cond)
 
                 result = monitor_db.select(query)
             else:
@@ -1132,12 +933,11 @@ class Graphs(object):
                         ' - (CASE WHEN paused_counter IS NULL THEN 0 ELSE paused_counter END) ELSE 0 END) AS total_duration ' \
                         'FROM session_history ' \
                         'JOIN session_history_media_info ON session_history.id = session_history_media_info.id ' \
-                        'WHERE (datetime(started, "unixepoch", "localtime") >= ' \
-                        'datetime("now", "-%s days", "localtime")) AND ' \
+                        'WHERE (session_history.started >= %s) AND ' \
                         '(session_history.media_type = "episode" OR session_history.media_type = "movie") %s %s' \
                         'GROUP BY resolution ' \
                         'ORDER BY total_duration DESC ' \
-                        'LIMIT 10' % (time_range, server_cond, user_cond)
+                        'LIMIT 10' % (timestamp, server_cond, user_cond)
 
                 result = monitor_db.select(query)
         except Exception as e:
@@ -1176,6 +976,8 @@ class Graphs(object):
         if not time_range.isdigit():
             time_range = '30'
 
+        timestamp = helpers.timestamp_days_ago(time_range)
+
         if server_id and server_id.isdigit():
             server_cond = 'AND session_history.server_id = %s ' % server_id
         elif session.get_session_shared_servers():
@@ -1217,14 +1019,13 @@ class Graphs(object):
                         'SUM(CASE WHEN session_history_media_info.transcode_decision = "transcode" '\
                         'THEN 1 ELSE 0 END) AS tc_count, ' \
                         'COUNT(session_history.id) AS total_count ' \
-                        'FROM (SELECT * FROM session_history GROUP BY %s) AS session_history ' \
+                        'FROM (SELECT * FROM session_history WHERE started >= %s GROUP BY %s) AS session_history ' \
                         'JOIN session_history_media_info ON session_history.id = session_history_media_info.id ' \
-                        'WHERE (datetime(started, "unixepoch", "localtime") >= ' \
-                        'datetime("now", "-%s days", "localtime")) AND ' \
+                        'WHERE (session_history.started >= %s) AND ' \
                         '(session_history.media_type = "episode" OR session_history.media_type = "movie") %s %s' \
                         'GROUP BY resolution ' \
                         'ORDER BY total_count DESC ' \
-                        'LIMIT 10' % (group_by, time_range, server_cond, user_cond)
+                        'LIMIT 10' % (timestamp, group_by, timestamp, server_cond, user_cond)
 
                 result = monitor_db.select(query)
             else:
@@ -1254,12 +1055,11 @@ class Graphs(object):
                         ' - (CASE WHEN paused_counter IS NULL THEN 0 ELSE paused_counter END) ELSE 0 END) AS total_duration ' \
                         'FROM session_history ' \
                         'JOIN session_history_media_info ON session_history.id = session_history_media_info.id ' \
-                        'WHERE (datetime(started, "unixepoch", "localtime") >= ' \
-                        'datetime("now", "-%s days", "localtime")) AND ' \
+                        'WHERE (session_history.started >= %s) AND ' \
                         '(session_history.media_type = "episode" OR session_history.media_type = "movie") %s %s' \
                         'GROUP BY resolution ' \
                         'ORDER BY total_duration DESC ' \
-                        'LIMIT 10' % (time_range, server_cond, user_cond)
+                        'LIMIT 10' % (timestamp, server_cond, user_cond)
 
                 result = monitor_db.select(query)
         except Exception as e:
@@ -1298,6 +1098,8 @@ class Graphs(object):
         if not time_range.isdigit():
             time_range = '30'
 
+        timestamp = helpers.timestamp_days_ago(time_range)
+
         if server_id and server_id.isdigit():
             server_cond = 'AND session_history.server_id = %s ' % server_id
         elif session.get_session_shared_servers():
@@ -1327,15 +1129,14 @@ class Graphs(object):
                         'SUM(CASE WHEN session_history_media_info.transcode_decision = "transcode" ' \
                         'THEN 1 ELSE 0 END) AS tc_count, ' \
                         'COUNT(session_history.id) AS total_count ' \
-                        'FROM (SELECT * FROM session_history GROUP BY %s) AS session_history ' \
+                        'FROM (SELECT * FROM session_history WHERE started >= %s GROUP BY %s) AS session_history ' \
                         'JOIN session_history_media_info ON session_history.id = session_history_media_info.id ' \
-                        'WHERE datetime(started, "unixepoch", "localtime") >= ' \
-                        'datetime("now", "-%s days", "localtime") AND ' \
+                        'WHERE session_history.started >= %s AND ' \
                         '(session_history.media_type = "episode" OR ' \
                         'session_history.media_type = "movie" OR ' \
                         'session_history.media_type = "track") %s %s' \
                         'GROUP BY platform ' \
-                        'ORDER BY total_count DESC LIMIT 10' % (group_by, time_range, server_cond, user_cond)
+                        'ORDER BY total_count DESC LIMIT 10' % (timestamp, group_by, timestamp, server_cond, user_cond)
 
                 result = monitor_db.select(query)
             else:
@@ -1354,13 +1155,12 @@ class Graphs(object):
                         ' - (CASE WHEN paused_counter IS NULL THEN 0 ELSE paused_counter END) ELSE 0 END) AS total_duration ' \
                         'FROM session_history ' \
                         'JOIN session_history_media_info ON session_history.id = session_history_media_info.id ' \
-                        'WHERE datetime(started, "unixepoch", "localtime") >= ' \
-                        'datetime("now", "-%s days", "localtime") AND ' \
+                        'WHERE session_history.started >= %s AND ' \
                         '(session_history.media_type = "episode" OR ' \
                         'session_history.media_type = "movie" OR ' \
                         'session_history.media_type = "track") %s %s' \
                         'GROUP BY platform ' \
-                        'ORDER BY total_duration DESC LIMIT 10' % (time_range, server_cond, user_cond)
+                        'ORDER BY total_duration DESC LIMIT 10' % (timestamp, server_cond, user_cond)
 
                 result = monitor_db.select(query)
         except Exception as e:
@@ -1396,6 +1196,8 @@ class Graphs(object):
         if not time_range.isdigit():
             time_range = '30'
 
+        timestamp = helpers.timestamp_days_ago(time_range)
+
         if server_id and server_id.isdigit():
             server_cond = 'AND session_history.server_id = %s ' % server_id
         elif session.get_session_shared_servers():
@@ -1428,16 +1230,15 @@ class Graphs(object):
                         'SUM(CASE WHEN session_history_media_info.transcode_decision = "transcode" ' \
                         'THEN 1 ELSE 0 END) AS tc_count, ' \
                         'COUNT(session_history.id) AS total_count ' \
-                        'FROM (SELECT * FROM session_history GROUP BY %s) AS session_history ' \
+                        'FROM (SELECT * FROM session_history WHERE started >= %s GROUP BY %s) AS session_history ' \
                         'JOIN users ON session_history.user_id = users.user_id ' \
                         'JOIN session_history_media_info ON session_history.id = session_history_media_info.id ' \
-                        'WHERE datetime(started, "unixepoch", "localtime") >= ' \
-                        'datetime("now", "-%s days", "localtime") AND ' \
+                        'WHERE session_history.started >= %s AND ' \
                         '(session_history.media_type = "episode" OR ' \
                         'session_history.media_type = "movie" OR ' \
                         'session_history.media_type = "track") %s %s' \
                         'GROUP BY username ' \
-                        'ORDER BY total_count DESC LIMIT 10' % (group_by, time_range, server_cond, user_cond)
+                        'ORDER BY total_count DESC LIMIT 10' % (timestamp, group_by, timestamp, server_cond, user_cond)
 
                 result = monitor_db.select(query)
             else:
@@ -1460,13 +1261,12 @@ class Graphs(object):
                         'FROM session_history ' \
                         'JOIN users ON session_history.user_id = users.user_id ' \
                         'JOIN session_history_media_info ON session_history.id = session_history_media_info.id ' \
-                        'WHERE datetime(started, "unixepoch", "localtime") >= ' \
-                        'datetime("now", "-%s days", "localtime") AND ' \
+                        'WHERE session_history.started >= %s AND ' \
                         '(session_history.media_type = "episode" OR ' \
                         'session_history.media_type = "movie" OR ' \
                         'session_history.media_type = "track") %s %s' \
                         'GROUP BY username ' \
-                        'ORDER BY total_duration DESC LIMIT 10' % (time_range, server_cond, user_cond)
+                        'ORDER BY total_duration DESC LIMIT 10' % (timestamp, server_cond, user_cond)
 
                 result = monitor_db.select(query)
         except Exception as e:
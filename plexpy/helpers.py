@@ -24,6 +24,7 @@ import geoip2.database, geoip2.errors
 import gzip
 import hashlib
 import imghdr
+import io
 from itertools import zip_longest
 import ipwhois, ipwhois.exceptions, ipwhois.utils
 from IPy import IP
@@ -41,6 +42,7 @@ import unicodedata
 import urllib.parse
 import urllib.request
 from xml.dom import minidom
+from xml.etree import ElementTree
 import xmltodict
 
 import plexpy
@@ -225,6 +227,17 @@ def now():
     return now.strftime("%Y-%m-%d %H:%M:%S")
 
 
+def timestamp_days_ago(days):
+    """ Returns the epoch timestamp of the local time `days` ago.
+
+        Equivalent to SQLite datetime("now", "-N days", "localtime"), but can be compared
+        directly against the integer started/stopped columns so the index can be used.
+    """
+    days_ago = datetime.datetime.now() - datetime.timedelta(days=cast_to_int(days))
+
+    return int(time.mktime(days_ago.timetuple()))
+
+
 def utc_now_iso():
     utcnow = datetime.datetime.utcnow()
 
@@ -510,15 +523,124 @@ def parse_xml(unparsed=None):
         return []
 
 
+class JSONNode(object):
+    """
+    Read-only stand-in for a minidom node, built from a PMS JSON response.
+
+    Only the parts of the DOM used by the XML parsers are implemented, so the same
+    parser can read either transport. Objects and lists of objects become child nodes,
+    everything else becomes a string attribute the way PMS writes it in XML.
+    """
+    # PMS returns every item as "Metadata" in JSON, but uses a different element for each type in XML
+    METADATA_NODE_NAMES = {'movie': 'Video',
+                           'episode': 'Video',
+                           'clip': 'Video',
+                           'trailer': 'Video',
+                           'track': 'Track'
+                           }
+
+    def __init__(self, node_name, data=None):
+        self.nodeName = node_name
+        self.childNodes = []
+        self._attributes = {}
+
+        for key, value in (data or {}).items():
+            if isinstance(value, dict):
+                value = [value]
+
+            if isinstance(value, list):
+                for child in value:
+                    if isinstance(child, dict):
+                        self.childNodes.append(JSONNode(self._child_node_name(key, child), child))
+            elif isinstance(value, bool):
+                self._attributes[key] = '1' if value else '0'
+            elif value is not None:
+                self._attributes[key] = str(value)
+
+    @classmethod
+    def _child_node_name(cls, key, data):
+        if key != 'Metadata':
+            return key
+        media_type = data.get('type')
+        if media_type == 'photo':
+            # Photo albums are directories of photos without any media of their own
+            return 'Photo' if 'Media' in data else 'Directory'
+        return cls.METADATA_NODE_NAMES.get(media_type, 'Directory')
+
+    def getAttribute(self, attribute):
+        return self._attributes.get(attribute, '')
+
+    def getElementsByTagName(self, name):
+        elements = []
+        for child in self.childNodes:
+            if child.nodeName == name:
+                elements.append(child)
+            elements.extend(child.getElementsByTagName(name))
+        return elements
+
+
+def parse_json_xml(unparsed=None):
+    """
+    Parse a PMS JSON response into JSONNodes which can be read like the parse_xml DOM.
+    """
+    if unparsed:
+        try:
+            return JSONNode('#document', json.loads(unparsed))
+        except Exception as e:
+            logger.warn("Error parsing JSON. %s" % e)
+            return []
+    else:
+        logger.warn("JSON parse request made but no data received.")
+        return []
+
+
+def iterparse_xml(unparsed=None):
+    """
+    Stream the top level elements of an XML document one at a time instead of building the whole DOM.
+
+    Yields the root element first, with only its attributes parsed, then each child of the root
+    with its complete subtree. Each child is discarded once the caller moves on to the next one,
+    so the peak memory does not grow with the number of items in the response.
+
+    Raises ElementTree.ParseError if the document is malformed.
+    """
+    if not unparsed:
+        logger.warn("XML parse request made but no data received.")
+        return
+
+    if isinstance(unparsed, str):
+        unparsed = unparsed.encode('utf-8')
+
+    root = None
+    depth = 0
+
+    for event, elem in ElementTree.iterparse(io.BytesIO(unparsed), events=('start', 'end')):
+        if event == 'start':
+            if root is None:
+                root = elem
+                yield root
+            depth += 1
+        else:
+            depth -= 1
+            if depth == 1:
+                yield elem
+                root.remove(elem)
+
+
 def get_xml_attr(xml_key, attribute, return_bool=False, default_return=''):
     """
     Validate xml keys to make sure they exist and return their attribute value, return blank value is none found
     """
-    if xml_key.getAttribute(attribute):
+    if isinstance(xml_key, ElementTree.Element):
+        value = xml_key.get(attribute)
+    else:
+        value = xml_key.getAttribute(attribute)
+
+    if value:
         if return_bool:
             return True
         else:
-            return xml_key.getAttribute(attribute)
+            return value
     else:
         if return_bool:
             return False
@@ -16,25 +16,286 @@
 #  You should have received a copy of the GNU General Public License
 #  along with PlexPy.  If not, see <http://www.gnu.org/licenses/>.
 
+from collections import OrderedDict
 from functools import partial
+import hashlib
+import json
 from multiprocessing.dummy import Pool as ThreadPool
+import os
+import tempfile
+import threading
 from urllib.parse import urljoin
 
 import certifi
 import urllib3
 
 import plexpy
+import plexpy.lock
 from plexpy import helpers
 from plexpy import logger
 
 
+_pool_managers = {}
+_pool_managers_lock = threading.Lock()
+fake_lock = plexpy.lock.FakeLock()
+
+
+def get_pool_manager(ssl_verify=True):
+    """
+    Returns the shared keep-alive connection pools.
+
+    urllib3 keeps a separate pool for every scheme, host and port,
+    so each server and plex.tv reuse their own connections.
+    """
+    pool_config = (max(plexpy.CONFIG.REQUEST_POOL_HOSTS, 1), max(plexpy.CONFIG.REQUEST_POOL_SIZE, 1))
+
+    with _pool_managers_lock:
+        pool_manager, config = _pool_managers.get(ssl_verify, (None, None))
+
+        if pool_manager is None or config != pool_config:
+            if pool_manager is not None:
+                pool_manager.clear()
+
+            num_pools, maxsize = pool_config
+            if ssl_verify:
+                pool_manager = urllib3.PoolManager(num_pools=num_pools, maxsize=maxsize,
+                                                   cert_reqs='CERT_REQUIRED', ca_certs=certifi.where())
+            else:
+                urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+                pool_manager = urllib3.PoolManager(num_pools=num_pools, maxsize=maxsize)
+            _pool_managers[ssl_verify] = (pool_manager, pool_config)
+
+        return pool_manager
+
+
+def get_pool_stats():
+    """ Returns the number of requests and new connections for each pooled host """
+    stats = []
+
+    with _pool_managers_lock:
+        for ssl_verify, (pool_manager, config) in _pool_managers.items():
+            for key in pool_manager.pools.keys():
+                pool = pool_manager.pools.get(key)
+                if pool is None:
+                    continue
+
+                reused = max(pool.num_requests - pool.num_connections, 0)
+                stats.append({'host': '%s://%s:%s' % (pool.scheme, pool.host, pool.port),
+                              'ssl_verify': ssl_verify,
+                              'maxsize': config[1],
+                              'requests': pool.num_requests,
+                              'connections': pool.num_connections,
+                              'reused': reused,
+                              'reuse_ratio': round(float(reused) / pool.num_requests, 4) if pool.num_requests else 0
+                              })
+
+    return stats
+
+
+def clear_pools():
+    """ Closes all of the pooled connections """
+    with _pool_managers_lock:
+        for pool_manager, config in _pool_managers.values():
+            pool_manager.clear()
+        _pool_managers.clear()
+
+
+class ResponseCache(object):
+    """
+    Cache of GET responses which can be revalidated with ETag or Last-Modified.
+
+    Recently used responses are kept in memory, up to REQUEST_CACHE_MEMORY_SIZE MB, and every
+    response is also written to the http_cache folder, up to REQUEST_CACHE_DISK_SIZE MB.
+    Both tiers evict the least recently used responses first.
+
+    The lock only guards the memory tier and the size bookkeeping, the disk reads,
+    writes and evictions happen outside of it.
+    """
+
+    def __init__(self):
+        self._memory = OrderedDict()
+        self._memory_size = 0
+        self._disk_size = None
+        self._evicting = False
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get_key(url, headers):
+        key = '%s|%s|%s' % (url, headers.get('X-Plex-Token', ''), headers.get('Accept', ''))
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def get_cache_dir():
+        return os.path.join(plexpy.CONFIG.CACHE_DIR, 'http_cache')
+
+    def get(self, key):
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry:
+                self._memory.move_to_end(key)
+                return entry
+
+        entry = self._read_disk(key)
+        if entry:
+            with self._lock:
+                self._set_memory(key, entry)
+        return entry
+
+    def set(self, key, content, headers):
+        etag = headers.get('ETag')
+        last_modified = headers.get('Last-Modified')
+        if not etag and not last_modified:
+            return
+
+        entry = {'etag': etag,
+                 'last_modified': last_modified,
+                 'content_type': headers.get('Content-Type', ''),
+                 'content': content
+                 }
+
+        with self._lock:
+            self._set_memory(key, entry)
+
+        self._write_disk(key, entry)
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._memory_size = 0
+            self._disk_size = None
+
+    def _set_memory(self, key, entry):
+        limit = plexpy.CONFIG.REQUEST_CACHE_MEMORY_SIZE * 1024 * 1024
+
+        old_entry = self._memory.pop(key, None)
+        if old_entry:
+            self._memory_size -= len(old_entry['content'])
+
+        if len(entry['content']) > limit:
+            return
+
+        self._memory[key] = entry
+        self._memory_size += len(entry['content'])
+
+        while self._memory_size > limit:
+            _, old_entry = self._memory.popitem(last=False)
+            self._memory_size -= len(old_entry['content'])
+
+    def _read_disk(self, key):
+        path = os.path.join(self.get_cache_dir(), key)
+
+        try:
+            with open(path, 'rb') as f:
+                entry = json.loads(f.readline().decode('utf-8'))
+                entry['content'] = f.read()
+            # Touch the file so the disk tier evicts by last use
+            os.utime(path, None)
+        except (IOError, OSError, ValueError):
+            return None
+
+        return entry
+
+    def _write_disk(self, key, entry):
+        limit = plexpy.CONFIG.REQUEST_CACHE_DISK_SIZE * 1024 * 1024
+        cache_dir = self.get_cache_dir()
+        path = os.path.join(cache_dir, key)
+
+        header = json.dumps({k: v for k, v in entry.items() if k != 'content'}).encode('utf-8')
+        size = len(header) + 1 + len(entry['content'])
+        if size > limit:
+            return
+
+        try:
+            if not os.path.exists(cache_dir):
+                os.makedirs(cache_dir, exist_ok=True)
+
+            old_size = os.path.getsize(path) if os.path.exists(path) else 0
+
+            # Write to a temporary file first so readers never see a partly written response
+            fd, temp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(header + b'\n' + entry['content'])
+                os.replace(temp_path, path)
+            except (IOError, OSError):
+                os.remove(temp_path)
+                raise
+        except (IOError, OSError) as e:
+            logger.warn(u"Tautulli HTTP Handler :: Unable to write to the HTTP cache: %s." % e)
+            with self._lock:
+                self._disk_size = None
+            return
+
+        with self._lock:
+            if self._disk_size is not None:
+                self._disk_size += size - old_size
+            disk_size = self._disk_size
+
+        if disk_size is None:
+            disk_size = self._get_disk_size(cache_dir)
+            with self._lock:
+                self._disk_size = disk_size
+
+        with self._lock:
+            evict = disk_size > limit and not self._evicting
+            if evict:
+                self._evicting = True
+
+        if evict:
+            try:
+                self._evict_disk(cache_dir, limit)
+            finally:
+                with self._lock:
+                    self._evicting = False
+
+    @staticmethod
+    def _get_disk_size(cache_dir):
+        disk_size = 0
+        for f in os.listdir(cache_dir):
+            try:
+                disk_size += os.path.getsize(os.path.join(cache_dir, f))
+            except OSError:
+                pass
+        return disk_size
+
+    def _evict_disk(self, cache_dir, limit):
+        files = []
+        for f in os.listdir(cache_dir):
+            if f.endswith('.tmp'):
+                continue
+            path = os.path.join(cache_dir, f)
+            try:
+                files.append((os.path.getmtime(path), os.path.getsize(path), path))
+            except OSError:
+                pass
+        files.sort()
+
+        for _, size, path in files:
+            with self._lock:
+                if self._disk_size is None or self._disk_size <= limit:
+                    break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            with self._lock:
+                if self._disk_size is not None:
+                    self._disk_size -= size
+
+
+response_cache = ResponseCache()
+
+
 class HTTPHandler(object):
     """
     Retrieve data from Plex Server
     """
 
-    def __init__(self, urls, headers=None, token=None, timeout=10, ssl_verify=True, silent=False):
+    def __init__(self, urls, headers=None, token=None, timeout=10, ssl_verify=True, silent=False, lock=fake_lock,
+                 cache=False):
         self._silent = silent
+        self.lock = lock
+        self.cache = cache
 
         if isinstance(urls, str):
             self.urls = urls.split() or urls.split(',')
@@ -117,11 +378,7 @@ class HTTPHandler(object):
             if len(urls) == 0:
                 chunk = 0
 
-        if self.ssl_verify:
-            session = urllib3.PoolManager(cert_reqs='CERT_REQUIRED', ca_certs=certifi.where())
-        else:
-            urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-            session = urllib3.PoolManager()
+        session = get_pool_manager(self.ssl_verify)
         part = partial(self._http_requests_urllib3, session=session)
 
         if len(urls) == 1:
@@ -141,8 +398,23 @@ class HTTPHandler(object):
 
     def _http_requests_urllib3(self, url, session):
         """Request the data from the url"""
+        headers = self.headers
+        cache_key = None
+        cached = None
+
+        if self.cache and self.request_type == 'GET':
+            cache_key = response_cache.get_key(url, self.headers)
+            cached = response_cache.get(cache_key)
+            if cached:
+                headers = dict(self.headers)
+                if cached['etag']:
+                    headers['If-None-Match'] = cached['etag']
+                if cached['last_modified']:
+                    headers['If-Modified-Since'] = cached['last_modified']
+
         try:
-            r = session.request(self.request_type, url, headers=self.headers, timeout=self.timeout)
+            with self.lock:
+                r = session.request(self.request_type, url, headers=headers, timeout=self.timeout)
         except IOError as e:
             if not self._silent:
                 logger.warn(u"Failed to access uri endpoint %s with error %s" % (self.uri, e))
@@ -160,7 +432,11 @@ class HTTPHandler(object):
         response_content = r.data
         response_headers = r.headers
 
-        if response_status in (200, 201):
+        if response_status == 304 and cached:
+            return self._http_format_output(cached['content'], {'Content-Type': cached['content_type']})
+        elif response_status in (200, 201):
+            if cache_key:
+                response_cache.set(cache_key, response_content, response_headers)
             return self._http_format_output(response_content, response_headers)
         else:
             if not self._silent:
@@ -177,7 +453,10 @@ class HTTPHandler(object):
             elif self.output_format == 'json':
                 output = helpers.convert_xml_to_json(response_content)
             elif self.output_format == 'xml':
-                output = helpers.parse_xml(response_content)
+                if response_headers.get('Content-Type', '').startswith('application/json'):
+                    output = helpers.parse_json_xml(response_content)
+                else:
+                    output = helpers.parse_xml(response_content)
             else:
                 output = response_content
 
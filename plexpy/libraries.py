@@ -15,11 +15,14 @@
 
 import json
 import os
+import re
 import threading
+import time
 
 import plexpy
 from plexpy import common
 from plexpy import database
+from plexpy import datafactory
 from plexpy import datatables
 from plexpy import helpers
 from plexpy import logger
@@ -29,6 +32,156 @@ from plexpy import session
 
 config_lock = threading.Lock()
 
+_file_sizes_progress = {}
+_file_sizes_progress_lock = threading.Lock()
+
+# Columns of the library_media_info table which are returned to the media info table
+MEDIA_INFO_COLUMNS = ('library_id', 'section_id', 'server_id', 'section_type', 'added_at', 'updated_at', 'media_type',
+                      'rating_key', 'parent_rating_key', 'grandparent_rating_key', 'title', 'sort_title', 'year',
+                      'media_index', 'parent_media_index', 'thumb', 'container', 'bitrate', 'video_codec',
+                      'video_resolution', 'video_framerate', 'audio_codec', 'audio_channels', 'file_size')
+
+
+def set_media_info_rows(server_id, section_id, parent_key, rows, replace=True, deleted_keys=None):
+    """
+    Updates the cached media info for a library (parent_key 0) or for the children of an item.
+
+    With replace, any rows which were not part of this refresh are removed. Otherwise the rows
+    are merged into the cache and only the deleted_keys are removed. Either way it is done in
+    a single transaction.
+    """
+    refreshed_at = time.time()
+    columns = ('parent_key', 'refreshed_at') + MEDIA_INFO_COLUMNS
+
+    insert_query = 'INSERT OR REPLACE INTO library_media_info (%s) VALUES (%s)' \
+                   % (', '.join(columns), ', '.join(['?'] * len(columns)))
+    insert_args = [[parent_key, refreshed_at] + [row[c] for c in MEDIA_INFO_COLUMNS] for row in rows]
+
+    def func(c):
+        c.executemany(insert_query, insert_args)
+        if replace:
+            c.execute('DELETE FROM library_media_info '
+                      'WHERE server_id = ? AND section_id = ? AND parent_key = ? AND refreshed_at != ?',
+                      [server_id, section_id, parent_key, refreshed_at])
+        elif deleted_keys:
+            c.executemany('DELETE FROM library_media_info '
+                          'WHERE server_id = ? AND section_id = ? AND parent_key = ? AND rating_key = ?',
+                          [[server_id, section_id, parent_key, key] for key in deleted_keys])
+
+    monitor_db = database.MonitorDatabase()
+    monitor_db.transaction(func, name='set_media_info_rows')
+
+
+def get_file_sizes_progress(server_id, section_id, rating_key=None):
+    """
+    Returns the progress of getting the file sizes for a library or the children of a rating_key.
+    """
+    progress_key = (int(server_id), int(section_id), int(rating_key) if rating_key else 0)
+
+    with _file_sizes_progress_lock:
+        return dict(_file_sizes_progress.get(progress_key, {}))
+
+
+def add_file_sizes_hold(section_id=None, rating_key=None):
+    """
+    Puts a library or item on hold while its file sizes are fetched.
+
+    Returns False if it is already on hold.
+    """
+    with config_lock:
+        get_file_sizes_hold = plexpy.CONFIG.GET_FILE_SIZES_HOLD
+        section_ids = set(get_file_sizes_hold['section_ids'])
+        rating_keys = set(get_file_sizes_hold['rating_keys'])
+
+        if section_id:
+            if section_id in section_ids:
+                return False
+            section_ids.add(section_id)
+        elif rating_key:
+            if rating_key in rating_keys:
+                return False
+            rating_keys.add(rating_key)
+        else:
+            return False
+
+        plexpy.CONFIG.GET_FILE_SIZES_HOLD = {'section_ids': list(section_ids), 'rating_keys': list(rating_keys)}
+        return True
+
+
+def remove_file_sizes_hold(section_id=None, rating_key=None):
+    with config_lock:
+        get_file_sizes_hold = plexpy.CONFIG.GET_FILE_SIZES_HOLD
+        section_ids = [i for i in get_file_sizes_hold['section_ids'] if not section_id or i != section_id]
+        rating_keys = [i for i in get_file_sizes_hold['rating_keys'] if not rating_key or i != rating_key]
+        plexpy.CONFIG.GET_FILE_SIZES_HOLD = {'section_ids': section_ids, 'rating_keys': rating_keys}
+
+
+def resume_media_info_file_sizes():
+    """
+    Continues getting the file sizes for the libraries which were on hold when Tautulli stopped.
+
+    The file sizes are saved as each item completes, so only the missing sizes are fetched again.
+    A library stays on hold if it fails again so it is retried on the next start.
+    """
+    with config_lock:
+        section_ids = list(plexpy.CONFIG.GET_FILE_SIZES_HOLD['section_ids'])
+        if not plexpy.CONFIG.GET_FILE_SIZES:
+            section_ids = []
+        plexpy.CONFIG.GET_FILE_SIZES_HOLD = {'section_ids': section_ids, 'rating_keys': []}
+
+    if not section_ids:
+        return
+
+    logger.info(u"Tautulli Libraries :: Resuming getting file sizes for %d libraries." % len(section_ids))
+
+    library_data = Libraries()
+    for library_id in section_ids:
+        try:
+            result = library_data.get_media_info_file_sizes(id=library_id)
+        except Exception as e:
+            logger.warn(u"Tautulli Libraries :: Unable to resume getting file sizes for library_id %s: %s."
+                        % (library_id, e))
+            continue
+
+        if result:
+            remove_file_sizes_hold(section_id=library_id)
+        else:
+            logger.warn(u"Tautulli Libraries :: Unable to resume getting file sizes for library_id %s. "
+                        u"It will be retried on the next start." % library_id)
+
+
+def import_media_info_files(cursor):
+    """
+    Moves the media_info_<server_id>-<section_id>[-<rating_key>].json cache files
+    from earlier versions into the library_media_info table.
+    """
+    filename_re = re.compile(r'^media_info_(\d+)-(\d+)(?:-(\d+))?\.json$')
+    columns = ('parent_key', 'refreshed_at') + MEDIA_INFO_COLUMNS
+    insert_query = 'INSERT OR REPLACE INTO library_media_info (%s) VALUES (%s)' \
+                   % (', '.join(columns), ', '.join(['?'] * len(columns)))
+    refreshed_at = time.time()
+
+    for filename in os.listdir(plexpy.CONFIG.CACHE_DIR):
+        match = filename_re.match(filename)
+        if not match:
+            continue
+
+        path = os.path.join(plexpy.CONFIG.CACHE_DIR, filename)
+        parent_key = int(match.group(3) or 0)
+        try:
+            with open(path, 'r') as f:
+                rows = json.load(f)
+            cursor.executemany(insert_query, [[parent_key, refreshed_at] + [row.get(c, '') for c in MEDIA_INFO_COLUMNS]
+                                              for row in rows])
+        except (IOError, ValueError, AttributeError) as e:
+            logger.warn(u"Tautulli Libraries :: Unable to import media info cache file %s: %s." % (filename, e))
+
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
 def refresh_libraries(server_id, section_id=None):
 
     server = plexpy.PMS_SERVERS.get_server_by_id(server_id)
@@ -38,7 +191,12 @@ def refresh_libraries(server_id, section_id=None):
 
     if library_sections:
         monitor_db = database.MonitorDatabase()
-        new_keys = []
+
+        existing_sections = set(row['section_id'] for row in
+                                monitor_db.select('SELECT section_id FROM library_sections WHERE server_id = ?',
+                                                  [server_id]))
+        new_sections = []
+        section_rows = []
 
         for section in library_sections:
             section_keys = {'server_id': server_id,
@@ -54,10 +212,20 @@ def refresh_libraries(server_id, section_id=None):
                               'child_count': section.get('child_count', None),
                               }
 
-            result = monitor_db.upsert('library_sections', key_dict=section_keys, value_dict=section_values)
+            section_rows.append((section_values, section_keys))
+
+            if helpers.cast_to_int(section['section_id']) not in existing_sections:
+                new_sections.append(section['section_id'])
 
-            if result == 'insert':
-                new_keys.append(str(monitor_db.last_insert_id()))
+        monitor_db.upsert_many('library_sections', section_rows)
+
+        new_keys = []
+        if new_sections:
+            section_ids = {row['section_id']: row['id'] for row in
+                           monitor_db.select('SELECT id, section_id FROM library_sections WHERE server_id = ?',
+                                             [server_id])}
+            new_keys = [str(section_ids[helpers.cast_to_int(section_id)]) for section_id in new_sections
+                        if helpers.cast_to_int(section_id) in section_ids]
 
         if new_keys:
             with config_lock:
@@ -426,6 +594,65 @@ class Libraries(object):
         if not section_type:
             section_type = library_details['section_type']
 
+        parent_key = int(rating_key) if rating_key else 0
+        scope_args = [server_id, section_id, parent_key]
+
+        try:
+            query = 'SELECT COUNT(*) AS library_count FROM library_media_info ' \
+                    'WHERE server_id = ? AND section_id = ? AND parent_key = ?'
+            library_count = monitor_db.select_single(query, args=scope_args)['library_count']
+        except Exception as e:
+            logger.warn(u"Tautulli Libraries :: Unable to execute database query for get_datatables_media_info1: %s." % e)
+            return default_return
+
+        # If there is no cached media info, get all library children items.
+        # A library which is already cached only gets the items changed since the last refresh.
+        if refresh or not library_count:
+            library_count = self.refresh_media_info(library_details=library_details,
+                                                    section_type=section_type,
+                                                    rating_key=rating_key,
+                                                    delta=bool(library_count))
+            if not library_count:
+                return default_return
+
+        # Get datatables JSON data
+        if kwargs.get('json_data'):
+            json_data = helpers.process_json_kwargs(json_kwargs=kwargs.get('json_data'))
+            #print json_data
+
+        where = 'WHERE media_info.server_id = ? AND media_info.section_id = ? AND media_info.parent_key = ? '
+        where_args = list(scope_args)
+
+        # Search results
+        search_value = json_data['search']['value'].lower()
+        if search_value:
+            searchable_columns = [d['data'] for d in json_data['columns']
+                                  if d['searchable'] and d['data'] in MEDIA_INFO_COLUMNS]
+            if searchable_columns:
+                search_like = '%' + re.sub(r'([\\%_])', r'\\\1', search_value) + '%'
+                where += 'AND (%s) ' % ' OR '.join("media_info.%s LIKE ? ESCAPE '\\'" % c for c in searchable_columns)
+                where_args += [search_like] * len(searchable_columns)
+            else:
+                where += 'AND 0 '
+
+        # Sort results, sort_title is always the last tie breaker
+        order_by = []
+        for order in json_data['order']:
+            sort_key = json_data['columns'][int(order['column'])]['data']
+            direction = 'DESC' if order['dir'] == 'desc' else 'ASC'
+            if rating_key and sort_key == 'sort_title':
+                order_by.append('CAST(media_info.media_index AS INTEGER) %s' % direction)
+            elif sort_key in ('file_size', 'bitrate', 'added_at'):
+                order_by.append('CAST(media_info.%s AS INTEGER) %s' % (sort_key, direction))
+            elif sort_key in ('last_played', 'play_count'):
+                order_by.append('IFNULL(watched.%s, 0) %s' % (sort_key, direction))
+            elif sort_key == 'video_resolution':
+                order_by.append("CAST(REPLACE(REPLACE(media_info.video_resolution, '4k', '2160p'), 'p', '') AS INTEGER) %s"
+                                % direction)
+            elif sort_key in MEDIA_INFO_COLUMNS:
+                order_by.append('media_info.%s COLLATE NOCASE %s' % (sort_key, direction))
+        order_by.append('media_info.sort_title COLLATE NOCASE')
+
         # Get play counts from the database
 
         if plexpy.CONFIG.GROUP_HISTORY_TABLES:
@@ -441,182 +668,159 @@ class Libraries(object):
             group_by = 'rating_key'
 
         try:
-            query = 'SELECT MAX(session_history.started) AS last_played, COUNT(DISTINCT session_history.%s) AS play_count, ' \
-                    'session_history.rating_key, session_history.parent_rating_key, session_history.grandparent_rating_key, ' \
-                    'session_history.server_id ' \
+            query = 'SELECT COUNT(*) AS filtered_count, SUM(CAST(media_info.file_size AS INTEGER)) AS total_file_size ' \
+                    'FROM library_media_info AS media_info %s' % where
+            counts = monitor_db.select_single(query, args=where_args)
+
+            query = 'SELECT %s, watched.last_played, watched.play_count ' \
+                    'FROM library_media_info AS media_info ' \
+                    'LEFT OUTER JOIN (SELECT MAX(session_history.started) AS last_played, ' \
+                    'COUNT(DISTINCT session_history.%s) AS play_count, session_history.%s AS group_key ' \
                     'FROM session_history ' \
                     'JOIN session_history_metadata ON session_history.id = session_history_metadata.id ' \
                     'WHERE session_history_metadata.section_id = ? ' \
                     '  AND session_history_metadata.server_id = ? ' \
-                    'GROUP BY session_history.%s ' % (count_by, group_by)
-            result = monitor_db.select(query, args=[section_id, server_id])
+                    'GROUP BY session_history.%s) AS watched ' \
+                    'ON watched.group_key = media_info.rating_key ' \
+                    '%s ' \
+                    'ORDER BY %s ' \
+                    'LIMIT ? OFFSET ? ' % (', '.join('media_info.%s' % c for c in MEDIA_INFO_COLUMNS),
+                                           count_by, group_by, group_by, where, ', '.join(order_by))
+            results = monitor_db.select(query, args=[section_id, server_id] + where_args +
+                                        [json_data['length'], json_data['start']])
         except Exception as e:
             logger.warn(u"Tautulli Libraries :: Unable to execute database query for get_datatables_media_info2: %s." % e)
             return default_return
 
-        watched_list = {}
-        for item in result:
-            watched_list[str(item[group_by])] = {'last_played': item['last_played'],
-                                                 'play_count': item['play_count']}
+        for item in results:
+            item['rating_key'] = str(item['rating_key'])
 
-        rows = []
-        # Import media info cache from json file
-        if rating_key:
-            try:
-                inFilePath = os.path.join(plexpy.CONFIG.CACHE_DIR,'media_info_%s-%s-%s.json' % (server_id, section_id, rating_key))
-                with open(inFilePath, 'r') as inFile:
-                    rows = json.load(inFile)
-                    library_count = len(rows)
-            except IOError as e:
-                #logger.debug(u"Tautulli Libraries :: No JSON file for rating_key %s." % rating_key)
-                #logger.debug(u"Tautulli Libraries :: Refreshing data and creating new JSON file for rating_key %s." % rating_key)
-                pass
-        elif section_id:
-            try:
-                inFilePath = os.path.join(plexpy.CONFIG.CACHE_DIR,'media_info_%s-%s.json' % (server_id, section_id))
-                with open(inFilePath, 'r') as inFile:
-                    rows = json.load(inFile)
-                    library_count = len(rows)
-            except IOError as e:
-                #logger.debug(u"Tautulli Libraries :: No JSON file for library section_id %s." % section_id)
-                #logger.debug(u"Tautulli Libraries :: Refreshing data and creating new JSON file for section_id %s." % section_id)
-                pass
-
-        # If no cache was imported, get all library children items
-        cached_items = {d['rating_key']: d['file_size'] for d in rows} if not refresh else {}
-
-        if refresh or not rows:
-            server = plexpy.PMS_SERVERS.get_server_by_id(server_id)
+        filtered_file_size = sum([helpers.cast_to_int(d['file_size']) for d in results])
 
-            if rating_key:
-                library_children = server.PMSCONNECTION.get_library_children_details(rating_key=rating_key,
-                                                                                     get_media_info=True)
-            elif id:
-                library_children = server.PMSCONNECTION.get_library_children_details(section_id=section_id,
-                                                                                     section_type=section_type,
-                                                                                     get_media_info=True)
-            if library_children:
-                library_count = library_children['library_count']
-                children_list = library_children['children_list']
-            else:
-                logger.warn(u"Tautulli Libraries :: Unable to get a list of library items.")
-                return default_return
-            
-            new_rows = []
-            for item in children_list:
-                ## TODO: Check list of media info items, currently only grabs first item
-
-                cached_file_size = cached_items.get(item['rating_key'], None)
-                file_size = cached_file_size if cached_file_size else item.get('file_size', '')
-
-                row = {'library_id': library_details['library_id'],
-                       'section_id': library_details['section_id'],
-                       'server_id': library_details['server_id'],
-                       'section_type': library_details['section_type'],
-                       'added_at': item['added_at'],
-                       'media_type': item['media_type'],
-                       'rating_key': item['rating_key'],
-                       'parent_rating_key': item['parent_rating_key'],
-                       'grandparent_rating_key': item['grandparent_rating_key'],
-                       'title': item['title'],
-                       'sort_title': item['sort_title'] or item['title'],
-                       'year': item['year'],
-                       'media_index': item['media_index'],
-                       'parent_media_index': item['parent_media_index'],
-                       'thumb': item['thumb'],
-                       'container': item.get('container', ''),
-                       'bitrate': item.get('bitrate', ''),
-                       'video_codec': item.get('video_codec', ''),
-                       'video_resolution': item.get('video_resolution', ''),
-                       'video_framerate': item.get('video_framerate', ''),
-                       'audio_codec': item.get('audio_codec', ''),
-                       'audio_channels': item.get('audio_channels', ''),
-                       'file_size': file_size
-                       }
-                new_rows.append(row)
+        dict = {'recordsFiltered': counts['filtered_count'],
+                'recordsTotal': library_count,
+                'data': results,
+                'draw': int(json_data['draw']),
+                'filtered_file_size': filtered_file_size,
+                'total_file_size': counts['total_file_size'] or 0
+                }
+        
+        return dict
 
-            rows = new_rows
-            if not rows:
-                return default_return
+    def refresh_media_info(self, library_details=None, section_type=None, rating_key=None, delta=False):
+        """
+        Refreshes the cached media info for a library, or for the children of a rating_key.
 
-            # Cache the media info to a json file
-            if rating_key:
-                try:
-                    outFilePath = os.path.join(plexpy.CONFIG.CACHE_DIR,'media_info_%s-%s-%s.json' % (server_id, section_id, rating_key))
-                    with open(outFilePath, 'w') as outFile:
-                        json.dump(rows, outFile)
-                except IOError as e:
-                    logger.debug(u"Tautulli Libraries :: Unable to create cache file for rating_key %s." % rating_key)
-            elif id:
-                try:
-                    outFilePath = os.path.join(plexpy.CONFIG.CACHE_DIR,'media_info_%s-%s.json' % (server_id, section_id))
-                    with open(outFilePath, 'w') as outFile:
-                        json.dump(rows, outFile)
-                except IOError as e:
-                    logger.debug(u"Tautulli Libraries :: Unable to create cache file for section_id %s." % section_id)
-
-        # Update the last_played and play_count
-        for item in rows:
-            watched_item = watched_list.get(item['rating_key'], None)
-            if watched_item:
-                item['last_played'] = watched_item['last_played']
-                item['play_count'] = watched_item['play_count']
-            else:
-                item['last_played'] = None
-                item['play_count'] = None
+        With delta, only the items added or updated since the newest cached item are requested
+        with their media info, and deleted items are found by comparing the library rating keys.
+        Returns the number of cached items, or None if the refresh failed.
+        """
+        server_id = library_details['server_id']
+        section_id = library_details['section_id']
+        parent_key = int(rating_key) if rating_key else 0
 
-        results = []
-        
-        # Get datatables JSON data            
-        if kwargs.get('json_data'):
-            json_data = helpers.process_json_kwargs(json_kwargs=kwargs.get('json_data'))
-            #print json_data
+        monitor_db = database.MonitorDatabase()
+        server = plexpy.PMS_SERVERS.get_server_by_id(server_id)
 
-        # Search results
-        search_value = json_data['search']['value'].lower()
-        if search_value:
-            searchable_columns = [d['data'] for d in json_data['columns'] if d['searchable']]
-            for row in rows:
-                for k,v in row.items():
-                    if k in searchable_columns and search_value in v.lower():
-                        results.append(row)
-                        break
+        updated_since = None
+        if delta and not rating_key:
+            try:
+                query = 'SELECT MAX(CAST(updated_at AS INTEGER)) AS updated_since FROM library_media_info ' \
+                        'WHERE server_id = ? AND section_id = ? AND parent_key = 0'
+                updated_since = monitor_db.select_single(query, args=[server_id, section_id])['updated_since']
+            except Exception as e:
+                logger.warn(u"Tautulli Libraries :: Unable to execute database query for refresh_media_info: %s." % e)
+
+        if rating_key:
+            library_children = server.PMSCONNECTION.get_library_children_details(rating_key=rating_key,
+                                                                                 get_media_info=True)
         else:
-            results = rows
+            library_children = server.PMSCONNECTION.get_library_children_details(section_id=section_id,
+                                                                                 section_type=section_type,
+                                                                                 get_media_info=True,
+                                                                                 updated_since=updated_since or '')
+            if not library_children and updated_since:
+                logger.warn(u"Tautulli Libraries :: Unable to get the updated items for section_id %s, "
+                            u"refreshing the whole library." % section_id)
+                updated_since = None
+                library_children = server.PMSCONNECTION.get_library_children_details(section_id=section_id,
+                                                                                     section_type=section_type,
+                                                                                     get_media_info=True)
+        if library_children:
+            children_list = library_children['children_list']
+        else:
+            logger.warn(u"Tautulli Libraries :: Unable to get a list of library items.")
+            return None
 
-        filtered_count = len(results)
+        rows = []
+        for item in children_list:
+            ## TODO: Check list of media info items, currently only grabs first item
+
+            row = {'library_id': library_details['library_id'],
+                   'section_id': library_details['section_id'],
+                   'server_id': library_details['server_id'],
+                   'section_type': library_details['section_type'],
+                   'added_at': item['added_at'],
+                   'updated_at': item.get('updated_at', ''),
+                   'media_type': item['media_type'],
+                   'rating_key': item['rating_key'],
+                   'parent_rating_key': item['parent_rating_key'],
+                   'grandparent_rating_key': item['grandparent_rating_key'],
+                   'title': item['title'],
+                   'sort_title': item['sort_title'] or item['title'],
+                   'year': item['year'],
+                   'media_index': item['media_index'],
+                   'parent_media_index': item['parent_media_index'],
+                   'thumb': item['thumb'],
+                   'container': item.get('container', ''),
+                   'bitrate': item.get('bitrate', ''),
+                   'video_codec': item.get('video_codec', ''),
+                   'video_resolution': item.get('video_resolution', ''),
+                   'video_framerate': item.get('video_framerate', ''),
+                   'audio_codec': item.get('audio_codec', ''),
+                   'audio_channels': item.get('audio_channels', ''),
+                   'file_size': item.get('file_size', '')
+                   }
+            rows.append(row)
 
-        # Sort results
-        results = sorted(results, key=lambda k: k['sort_title'].lower())
-        sort_order = json_data['order']
-        for order in reversed(sort_order):
-            sort_key = json_data['columns'][int(order['column'])]['data']
-            reverse = True if order['dir'] == 'desc' else False
-            if rating_key and sort_key == 'sort_title':
-                results = sorted(results, key=lambda k: helpers.cast_to_int(k['media_index']), reverse=reverse)
-            elif sort_key in ('file_size', 'bitrate', 'added_at', 'last_played', 'play_count'):
-                results = sorted(results, key=lambda k: helpers.cast_to_int(k[sort_key]), reverse=reverse)
-            elif sort_key == 'video_resolution':
-                results = sorted(results, key=lambda k: helpers.cast_to_int(k[sort_key].replace('4k', '2160p').rstrip('p')), reverse=reverse)
-            else:
-                results = sorted(results, key=lambda k: k[sort_key].lower(), reverse=reverse)
+        deleted_keys = None
+        if updated_since:
+            # Only merge the changed items, in case the server ignored the filter and returned the whole library
+            rows = [row for row in rows if helpers.cast_to_int(row['updated_at']) >= updated_since]
 
-        total_file_size = sum([helpers.cast_to_int(d['file_size']) for d in results])
+            # Find the deleted items by comparing the rating keys in the library with the cache
+            library_keys = server.PMSCONNECTION.get_library_rating_keys(section_id=section_id,
+                                                                        section_type=section_type)
+            if library_keys is None:
+                logger.warn(u"Tautulli Libraries :: Unable to get a list of library items.")
+                return None
 
-        # Paginate results
-        results = results[json_data['start']:(json_data['start'] + json_data['length'])]
+            try:
+                query = 'SELECT rating_key FROM library_media_info ' \
+                        'WHERE server_id = ? AND section_id = ? AND parent_key = 0'
+                result = monitor_db.select(query, args=[server_id, section_id])
+            except Exception as e:
+                logger.warn(u"Tautulli Libraries :: Unable to execute database query for refresh_media_info: %s." % e)
+                return None
 
-        filtered_file_size = sum([helpers.cast_to_int(d['file_size']) for d in results])
+            cached_keys = set(str(row['rating_key']) for row in result)
+            deleted_keys = cached_keys - library_keys
 
-        dict = {'recordsFiltered': filtered_count,
-                'recordsTotal': library_count,
-                'data': results,
-                'draw': int(json_data['draw']),
-                'filtered_file_size': filtered_file_size,
-                'total_file_size': total_file_size
-                }
-        
-        return dict
+            logger.debug(u"Tautulli Libraries :: Media info refresh for section_id %s: %d items added or updated, "
+                         u"%d items deleted." % (section_id, len(rows), len(deleted_keys)))
+        elif not rows:
+            return None
+
+        # Cache the media info in the database
+        try:
+            set_media_info_rows(server_id, section_id, parent_key, rows,
+                                replace=not updated_since, deleted_keys=deleted_keys)
+            query = 'SELECT COUNT(*) AS library_count FROM library_media_info ' \
+                    'WHERE server_id = ? AND section_id = ? AND parent_key = ?'
+            return monitor_db.select_single(query, args=[server_id, section_id, parent_key])['library_count']
+        except Exception as e:
+            logger.warn(u"Tautulli Libraries :: Unable to cache the media info for section_id %s: %s." % (section_id, e))
+            return None
 
     def get_media_info_file_sizes(self, id=None, rating_key=None):
         if not session.allow_session_library(id):
@@ -639,37 +843,33 @@ class Libraries(object):
 
         server_id = library_details['server_id']
         section_id = library_details['section_id']
+        parent_key = int(rating_key) if rating_key else 0
 
-        rows = []
-        # Import media info cache from json file
-        if rating_key:
-            #logger.debug(u"Tautulli Libraries :: Getting file sizes for rating_key %s." % rating_key)
-            try:
-                inFilePath = os.path.join(plexpy.CONFIG.CACHE_DIR,'media_info_%s-%s-%s.json' % (server_id, section_id, rating_key))
-                with open(inFilePath, 'r') as inFile:
-                    rows = json.load(inFile)
-            except IOError as e:
-                #logger.debug(u"Tautulli Libraries :: No JSON file for rating_key %s." % rating_key)
-                #logger.debug(u"Tautulli Libraries :: Refreshing data and creating new JSON file for rating_key %s." % rating_key)
-                pass
-        elif section_id:
+        if not rating_key:
             logger.debug(u"Tautulli Libraries :: Getting file sizes for section_id %s." % section_id)
-            try:
-                inFilePath = os.path.join(plexpy.CONFIG.CACHE_DIR,'media_info_%s-%s.json' % (server_id, section_id))
-                with open(inFilePath, 'r') as inFile:
-                    rows = json.load(inFile)
-            except IOError as e:
-                #logger.debug(u"Tautulli Libraries :: No JSON file for library section_id %s." % section_id)
-                #logger.debug(u"Tautulli Libraries :: Refreshing data and creating new JSON file for section_id %s." % section_id)
-                pass
-
-        # Get the total file size for each item
-        server = plexpy.PMS_SERVERS.get_server_by_id(server_id)
 
-        for item in rows:
-            if item['rating_key'] and not item['file_size']:
-                file_size = 0
-            
+        monitor_db = database.MonitorDatabase()
+
+        try:
+            query = "SELECT id, rating_key FROM library_media_info " \
+                    "WHERE server_id = ? AND section_id = ? AND parent_key = ? " \
+                    "AND (file_size IS NULL OR file_size IN ('', '0'))"
+            rows = monitor_db.select(query, args=[server_id, section_id, parent_key])
+        except Exception as e:
+            logger.warn(u"Tautulli Libraries :: Unable to execute database query for get_media_info_file_sizes: %s." % e)
+            return False
+
+        rows = [item for item in rows if item['rating_key']]
+
+        progress_key = (int(server_id), int(section_id), parent_key)
+        progress = {'total': len(rows), 'completed': 0, 'started': int(time.time())}
+        with _file_sizes_progress_lock:
+            _file_sizes_progress[progress_key] = progress
+
+        def get_file_size(item):
+            file_size = 0
+
+            try:
                 metadata = server.PMSCONNECTION.get_metadata_children_details(rating_key=item['rating_key'],
                                                                               get_children=True)
 
@@ -684,23 +884,34 @@ class Libraries(object):
 
                     file_size += helpers.cast_to_int(media_part_info.get('file_size', 0))
 
-                item['file_size'] = file_size
+                # Save each file size as it completes so an interrupted run can continue where it stopped
+                database.MonitorDatabase().action('UPDATE library_media_info SET file_size = ? WHERE id = ?',
+                                                  args=[file_size, item['id']])
+            except Exception as e:
+                logger.warn(u"Tautulli Libraries :: Unable to get the file size for rating_key %s: %s."
+                            % (item['rating_key'], e))
 
-        # Cache the media info to a json file
-        if rating_key:
-            try:
-                outFilePath = os.path.join(plexpy.CONFIG.CACHE_DIR,'media_info_%s-%s-%s.json' % (server_id, section_id, rating_key))
-                with open(outFilePath, 'w') as outFile:
-                    json.dump(rows, outFile)
-            except IOError as e:
-                logger.debug(u"Tautulli Libraries :: Unable to create cache file with file sizes for rating_key %s." % rating_key)
-        elif section_id:
-            try:
-                outFilePath = os.path.join(plexpy.CONFIG.CACHE_DIR,'media_info_%s-%s.json' % (server_id, section_id))
-                with open(outFilePath, 'w') as outFile:
-                    json.dump(rows, outFile)
-            except IOError as e:
-                logger.debug(u"Tautulli Libraries :: Unable to create cache file with file sizes for section_id %s." % section_id)
+            with _file_sizes_progress_lock:
+                progress['completed'] += 1
+                completed = progress['completed']
+
+            if not rating_key and completed % 100 == 0:
+                logger.debug(u"Tautulli Libraries :: Got file sizes for %d of %d items in section_id %s."
+                             % (completed, progress['total'], section_id))
+
+        # Get the total file size for each item on the server's shared request workers.
+        # The children of each item are fetched inline on the same worker, so the walk never uses
+        # more than PMS_REQUEST_WORKERS threads and db connections.
+        server = plexpy.PMS_SERVERS.get_server_by_id(server_id)
+
+        try:
+            # Submit the items in chunks so other bulk requests to the server are not queued behind the whole library
+            chunk_size = max(plexpy.CONFIG.PMS_REQUEST_WORKERS, 1) * 25
+            for i in range(0, len(rows), chunk_size):
+                server.PMSCONNECTION.map_requests(get_file_size, rows[i:i + chunk_size])
+        finally:
+            with _file_sizes_progress_lock:
+                _file_sizes_progress.pop(progress_key, None)
 
         if rating_key:
             #logger.debug(u"Tautulli Libraries :: File sizes updated for rating_key %s." % rating_key)
@@ -841,9 +1052,9 @@ class Libraries(object):
                                 'COUNT(DISTINCT %s) AS total_plays ' \
                                 'FROM session_history ' \
                                 'JOIN session_history_metadata ON session_history_metadata.id = session_history.id ' \
-                                'WHERE datetime(stopped, "unixepoch", "localtime") >= datetime("now", "-%s days", "localtime") ' \
-                                'AND session_history.server_id = ? AND section_id = ?' % (group_by, days)
-                        result = monitor_db.select(query, args=[server_id, section_id])
+                                'WHERE stopped >= ? ' \
+                                'AND session_history.server_id = ? AND section_id = ?' % group_by
+                        result = monitor_db.select(query, args=[helpers.timestamp_days_ago(days), server_id, section_id])
                     else:
                         result = []
                 else:
@@ -1051,6 +1262,8 @@ class Libraries(object):
                     monitor_db.action('DELETE FROM '
                                       'session_history_metadata '
                                       'WHERE session_history_metadata.server_id = ? AND session_history_metadata.section_id = ?', [server_id, section_id])
+                database.rebuild_history_rollups(server_id=server_id)
+                datafactory.clear_home_stats_cache(server_id=server_id)
 
                 return 'Deleted all items for server_id %s section_id %s .' % (server_id, section_id)
             else:
@@ -1118,12 +1331,12 @@ class Libraries(object):
             logger.warn(u"Tautulli Libraries :: Unable to execute database query for undelete: %s." % e)
 
     def delete_media_info_cache(self, server_id=None, section_id=None):
-        import os
+        monitor_db = database.MonitorDatabase()
 
         try:
             if server_id.isdigit() and section_id.isdigit():
-                [os.remove(os.path.join(plexpy.CONFIG.CACHE_DIR, f)) for f in os.listdir(plexpy.CONFIG.CACHE_DIR)
-                 if f.startswith('media_info_%s-%s' % (server_id, section_id)) and f.endswith('.json')]
+                monitor_db.action('DELETE FROM library_media_info WHERE server_id = ? AND section_id = ?',
+                                  [server_id, section_id])
 
                 logger.debug(u"Tautulli Libraries :: Deleted media info table cache for server_id %s section_id %s." % (server_id, section_id))
                 return 'Deleted media info table cache for library with id %s for server %s.' % (section_id, server_id)
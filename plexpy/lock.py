@@ -69,6 +69,46 @@ class TimedLock(object):
         self.queue.put(seconds)
 
 
+class ConcurrentTimedLock(object):
+    """
+    Allow up to max_concurrent threads into the block at the same time, while
+    still spacing out when each of them enters by minimum_delta seconds using
+    a TimedLock. Unlike a plain TimedLock, the requests themselves are not
+    serialized, only their start times are.
+    """
+
+    def __init__(self, max_concurrent=1, minimum_delta=0):
+        """
+        Set up the lock
+        """
+        self.semaphore = threading.BoundedSemaphore(max(max_concurrent, 1))
+        self.timed_lock = TimedLock(minimum_delta)
+
+    def __enter__(self):
+        """
+        Called when with lock: is invoked
+        """
+        self.semaphore.acquire()
+        try:
+            with self.timed_lock:
+                pass
+        except:
+            self.semaphore.release()
+            raise
+
+    def __exit__(self, type, value, traceback):
+        """
+        Called when exiting the with block.
+        """
+        self.semaphore.release()
+
+    def snooze(self, seconds):
+        """
+        Add time to the next request.
+        """
+        self.timed_lock.snooze(seconds)
+
+
 class FakeLock(object):
     """
     If no locking or request throttling is needed, use this
@@ -13,12 +13,16 @@
 #  You should have received a copy of the GNU General Public License
 #  along with Tautulli.  If not, see <http://www.gnu.org/licenses/>.
 
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import copy
 import json
-import os
+import threading
 import time
 import urllib.parse
 
 import plexpy
+import plexpy.lock
 from plexpy import activity_processor
 from plexpy import common
 from plexpy import helpers
@@ -31,6 +35,144 @@ from plexpy import database
 from plexpy import libraries
 
 
+_request_locks = {}
+_request_locks_lock = threading.Lock()
+_request_executors = {}
+_bulk_requests = threading.local()
+
+_metadata_cache = OrderedDict()
+_metadata_cache_lock = threading.Lock()
+_metadata_cache_info = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0, 'generation': 0}
+
+
+def get_request_lock(server_id=None):
+    """
+    Returns the request lock shared by the bulk requests to a server.
+
+    At most PMS_REQUEST_WORKERS bulk requests are sent to a server at the same time,
+    and each request starts at least PMS_REQUEST_INTERVAL milliseconds after the previous one.
+    """
+    lock_config = (max(plexpy.CONFIG.PMS_REQUEST_WORKERS, 1), max(plexpy.CONFIG.PMS_REQUEST_INTERVAL, 0))
+
+    with _request_locks_lock:
+        request_lock, config = _request_locks.get(server_id, (None, None))
+
+        if request_lock is None or config != lock_config:
+            max_concurrent, interval = lock_config
+            request_lock = plexpy.lock.ConcurrentTimedLock(max_concurrent=max_concurrent,
+                                                           minimum_delta=interval / 1000.0)
+            _request_locks[server_id] = (request_lock, lock_config)
+
+        return request_lock
+
+
+def get_request_executor(server_id=None):
+    """
+    Returns the long-lived pool of PMS_REQUEST_WORKERS threads which runs the bulk requests to a server.
+
+    The pool is shared by every map_requests call for the server, so simultaneous
+    walks never start more than PMS_REQUEST_WORKERS threads (or db connections) between them.
+    """
+    workers = max(plexpy.CONFIG.PMS_REQUEST_WORKERS, 1)
+
+    with _request_locks_lock:
+        executor, config = _request_executors.get(server_id, (None, None))
+
+        if executor is None or config != workers:
+            if executor is not None:
+                # Let the old pool finish the requests it already has
+                executor.shutdown(wait=False)
+            executor = ThreadPoolExecutor(max_workers=workers,
+                                          thread_name_prefix='pms-requests-%s' % server_id)
+            _request_executors[server_id] = (executor, workers)
+
+        return executor
+
+
+def clear_request_executors():
+    """ Stops the bulk request thread pools """
+
+    with _request_locks_lock:
+        for executor, config in _request_executors.values():
+            executor.shutdown(wait=False)
+        _request_executors.clear()
+
+
+def get_cached_metadata(server_id, rating_key, media_info=True):
+    """ Returns a copy of the cached metadata for an item, or None if it is missing or expired """
+    key = (server_id, str(rating_key))
+
+    with _metadata_cache_lock:
+        cached = _metadata_cache.get(key)
+        if cached and (media_info <= cached[1]) and \
+                time.time() - cached[2] <= plexpy.CONFIG.METADATA_CACHE_SECONDS:
+            _metadata_cache.move_to_end(key)
+            _metadata_cache_info['hits'] += 1
+            metadata = cached[0]
+        else:
+            _metadata_cache_info['misses'] += 1
+            return None
+
+    # Callers are free to modify the metadata they get back
+    metadata = copy.deepcopy(metadata)
+    if not media_info:
+        metadata.pop('media_info', None)
+    return metadata
+
+
+def set_cached_metadata(server_id, rating_key, metadata, media_info, generation):
+    """ Caches the metadata for an item unless the cache was invalidated while it was retrieved """
+    key = (server_id, str(rating_key))
+    metadata = copy.deepcopy(metadata)
+
+    with _metadata_cache_lock:
+        if generation != _metadata_cache_info['generation']:
+            return
+
+        # Do not replace metadata which includes the media info with metadata which does not
+        cached = _metadata_cache.get(key)
+        if cached and cached[1] and not media_info and time.time() - cached[2] <= plexpy.CONFIG.METADATA_CACHE_SECONDS:
+            return
+
+        _metadata_cache[key] = (metadata, media_info, time.time())
+        _metadata_cache.move_to_end(key)
+
+        while len(_metadata_cache) > max(plexpy.CONFIG.METADATA_CACHE_SIZE, 0):
+            _metadata_cache.popitem(last=False)
+            _metadata_cache_info['evictions'] += 1
+
+
+def clear_metadata_cache(server_id=None, rating_key=None):
+    """ Invalidates the cached metadata for an item, a server, or for all servers """
+    with _metadata_cache_lock:
+        _metadata_cache_info['invalidations'] += 1
+        _metadata_cache_info['generation'] += 1
+
+        if server_id is None:
+            _metadata_cache.clear()
+        elif rating_key is not None:
+            _metadata_cache.pop((server_id, str(rating_key)), None)
+        else:
+            for key in list(_metadata_cache.keys()):
+                if key[0] == server_id:
+                    del _metadata_cache[key]
+
+
+def get_metadata_cache_info():
+    """ Returns the metadata cache size and hit/miss/eviction counters """
+    with _metadata_cache_lock:
+        lookups = _metadata_cache_info['hits'] + _metadata_cache_info['misses']
+        return {'size': len(_metadata_cache),
+                'max_size': plexpy.CONFIG.METADATA_CACHE_SIZE,
+                'ttl': plexpy.CONFIG.METADATA_CACHE_SECONDS,
+                'hits': _metadata_cache_info['hits'],
+                'misses': _metadata_cache_info['misses'],
+                'hit_ratio': round(float(_metadata_cache_info['hits']) / lookups, 4) if lookups else 0,
+                'evictions': _metadata_cache_info['evictions'],
+                'invalidations': _metadata_cache_info['invalidations']
+                }
+
+
 class PmsConnect(object):
     """
     Retrieve data from Plex Server
@@ -66,6 +208,62 @@ class PmsConnect(object):
                                                      token=self.token,
                                                      timeout=self.timeout)
 
+    def get_transport_headers(self, output_format=''):
+        """
+        Ask the server for JSON instead of XML when PMS_JSON_TRANSPORT is enabled.
+
+        Only used by requests whose parsers read both transports through the 'xml' output format.
+        """
+        if output_format == 'xml' and plexpy.CONFIG.PMS_JSON_TRANSPORT:
+            return {'Accept': 'application/json'}
+        return None
+
+    @property
+    def request_lock(self):
+        """
+        The lock for the next request.
+
+        Only the bulk requests made from map_requests wait on the server request lock,
+        so session and activity requests never queue behind a metadata walk.
+        """
+        if getattr(_bulk_requests, 'active', False):
+            return get_request_lock(self.server_id)
+        return http_handler.fake_lock
+
+    def map_requests(self, func, items):
+        """
+        Call func for each item on the server's shared pool of PMS_REQUEST_WORKERS threads.
+
+        Calls made from inside a bulk request (i.e. the children of a show) run inline
+        on the calling worker, so nested walks don't need any more threads.
+
+        Output: list, in the same order as items
+        """
+        items = list(items)
+
+        def bulk_request(item):
+            active = getattr(_bulk_requests, 'active', False)
+            _bulk_requests.active = True
+            try:
+                return func(item)
+            finally:
+                _bulk_requests.active = active
+
+        if getattr(_bulk_requests, 'active', False) or len(items) <= 1 or plexpy.CONFIG.PMS_REQUEST_WORKERS <= 1:
+            return [bulk_request(item) for item in items]
+
+        executor = get_request_executor(self.server_id)
+        futures = []
+        for item in items:
+            try:
+                futures.append(executor.submit(bulk_request, item))
+            except RuntimeError:
+                # The pool was replaced after PMS_REQUEST_WORKERS changed
+                executor = get_request_executor(self.server_id)
+                futures.append(executor.submit(bulk_request, item))
+
+        return [future.result() for future in futures]
+
     def get_sessions(self, output_format=''):
         """
         Return current sessions.
@@ -74,9 +272,11 @@ class PmsConnect(object):
 
         Output: array
         """
-        request_handler = http_handler.HTTPHandler(urls=self.url, token=self.token, timeout=self.timeout)
+        request_handler = http_handler.HTTPHandler(urls=self.url, token=self.token, timeout=self.timeout,
+                                                   lock=self.request_lock)
         uri = '/status/sessions'
         request = request_handler.make_request(uri=uri,
+                                               headers=self.get_transport_headers(output_format),
                                                request_type='GET',
                                                output_format=output_format)
 
@@ -90,7 +290,8 @@ class PmsConnect(object):
 
         Output: array
         """
-        request_handler = http_handler.HTTPHandler(urls=self.url, token=self.token, timeout=self.timeout)
+        request_handler = http_handler.HTTPHandler(urls=self.url, token=self.token, timeout=self.timeout,
+                                                   lock=self.request_lock)
         uri = '/status/sessions/terminate?sessionId=%s&reason=%s' % (session_id, reason)
         request = request_handler.make_request(uri=uri,
                                                request_type='GET',
@@ -107,9 +308,11 @@ class PmsConnect(object):
 
         Output: array
         """
-        request_handler = http_handler.HTTPHandler(urls=self.url, token=self.token, timeout=self.timeout)
+        request_handler = http_handler.HTTPHandler(urls=self.url, token=self.token, timeout=self.timeout,
+                                                   lock=self.request_lock, cache=True)
         uri = '/library/metadata/' + rating_key
         request = request_handler.make_request(uri=uri,
+                                               headers=self.get_transport_headers(output_format),
                                                request_type='GET',
                                                output_format=output_format)
 
@@ -124,7 +327,8 @@ class PmsConnect(object):
 
         Output: array
         """
-        request_handler = http_handler.HTTPHandler(urls=self.url, token=self.token, timeout=self.timeout)
+        request_handler = http_handler.HTTPHandler(urls=self.url, token=self.token, timeout=self.timeout,
+                                                   lock=self.request_lock, cache=True)
         uri = '/library/metadata/' + rating_key + '/children'
         request = request_handler.make_request(uri=uri,
                                                request_type='GET',
@@ -141,7 +345,8 @@ class PmsConnect(object):
 
         Output: array
         """
-        request_handler = http_handler.HTTPHandler(urls=self.url, token=self.token, timeout=self.timeout)
+        request_handler = http_handler.HTTPHandler(urls=self.url, token=self.token, timeout=self.timeout,
+                                                   lock=self.request_lock)
         uri = '/library/metadata/' + rating_key + '/grandchildren'
         request = request_handler.make_request(uri=uri,
                                                request_type='GET',
@@ -158,7 +363,8 @@ class PmsConnect(object):
 
         Output: array
         """
-        request_handler = http_handler.HTTPHandler(urls=self.url, token=self.token, timeout=self.timeout)
+        request_handler = http_handler.HTTPHandler(urls=self.url, token=self.token, timeout=self.timeout,
+                                                   lock=self.request_lock)
         uri = '/library/recentlyAdded?X-Plex-Container-Start=%s&X-Plex-Container-Size=%s' % (start, count)
         request = request_handler.make_request(uri=uri,
                                                request_type='GET',
@@ -175,7 +381,8 @@ class PmsConnect(object):
 
         Output: array
         """
-        request_handler = http_handler.HTTPHandler(urls=self.url, token=self.token, timeout=self.timeout)
+        request_handler = http_handler.HTTPHandler(urls=self.url, token=self.token, timeout=self.timeout,
+                                                   lock=self.request_lock)
         uri = '/library/sections/%s/recentlyAdded?X-Plex-Container-Start=%s&X-Plex-Container-Size=%s' % (section_id, start, count)
         request = request_handler.make_request(uri=uri,
                                                request_type='GET',
@@ -192,7 +399,8 @@ class PmsConnect(object):
 
         Output: array
         """
-        request_handler = http_handler.HTTPHandler(urls=self.url, token=self.token, timeout=self.timeout)
+        request_handler = http_handler.HTTPHandler(urls=self.url, token=self.token, timeout=self.timeout,
+                                                   lock=self.request_lock)
         uri = '/hubs/metadata/' + rating_key + '/related'
         request = request_handler.make_request(uri=uri,
                                                request_type='GET',
@@ -209,7 +417,8 @@ class PmsConnect(object):
 
         Output: array
         """
-        request_handler = http_handler.HTTPHandler(urls=self.url, token=self.token, timeout=self.timeout)
+        request_handler = http_handler.HTTPHandler(urls=self.url, token=self.token, timeout=self.timeout,
+                                                   lock=self.request_lock)
         uri = '/library/metadata/' + rating_key + '/allLeaves'
         request = request_handler.make_request(uri=uri,
                                                request_type='GET',
@@ -225,7 +434,8 @@ class PmsConnect(object):
 
         Output: array
         """
-        request_handler = http_handler.HTTPHandler(urls=self.url, token=self.token, timeout=self.timeout)
+        request_handler = http_handler.HTTPHandler(urls=self.url, token=self.token, timeout=self.timeout,
+                                                   lock=self.request_lock)
         uri = '/servers'
         request = request_handler.make_request(uri=uri,
                                                request_type='GET',
@@ -241,7 +451,8 @@ class PmsConnect(object):
 
         Output: array
         """
-        request_handler = http_handler.HTTPHandler(urls=self.url, token=self.token, timeout=self.timeout)
+        request_handler = http_handler.HTTPHandler(urls=self.url, token=self.token, timeout=self.timeout,
+                                                   lock=self.request_lock)
         uri = '/:/prefs'
         request = request_handler.make_request(uri=uri,
                                                request_type='GET',
@@ -257,7 +468,8 @@ class PmsConnect(object):
 
         Output: array
         """
-        request_handler = http_handler.HTTPHandler(urls=self.url, token=self.token, timeout=self.timeout)
+        request_handler = http_handler.HTTPHandler(urls=self.url, token=self.token, timeout=self.timeout,
+                                                   lock=self.request_lock)
         uri = '/identity'
         request = request_handler.make_request(uri=uri,
                                                request_type='GET',
@@ -273,7 +485,8 @@ class PmsConnect(object):
 
         Output: array
         """
-        request_handler = http_handler.HTTPHandler(urls=self.url, token=self.token, timeout=self.timeout)
+        request_handler = http_handler.HTTPHandler(urls=self.url, token=self.token, timeout=self.timeout,
+                                                   lock=self.request_lock)
         uri = '/library/sections'
         request = request_handler.make_request(uri=uri,
                                                request_type='GET',
@@ -292,7 +505,8 @@ class PmsConnect(object):
         count = '&X-Plex-Container-Size=' + count if count else ''
         label_key = '&label=' + label_key if label_key else ''
 
-        request_handler = http_handler.HTTPHandler(urls=self.url, token=self.token, timeout=self.timeout)
+        request_handler = http_handler.HTTPHandler(urls=self.url, token=self.token, timeout=self.timeout,
+                                                   lock=self.request_lock)
         uri = '/library/sections/' + section_id + '/' + list_type + '?X-Plex-Container-Start=0' + count + sort_type + label_key
         request = request_handler.make_request(uri=uri,
                                                request_type='GET',
@@ -308,7 +522,8 @@ class PmsConnect(object):
 
         Output: array
         """
-        request_handler = http_handler.HTTPHandler(urls=self.url, token=self.token, timeout=self.timeout)
+        request_handler = http_handler.HTTPHandler(urls=self.url, token=self.token, timeout=self.timeout,
+                                                   lock=self.request_lock)
         uri = '/library/sections/' + section_id + '/label'
         request = request_handler.make_request(uri=uri,
                                                request_type='GET',
@@ -325,7 +540,8 @@ class PmsConnect(object):
 
         Output: array
         """
-        request_handler = http_handler.HTTPHandler(urls=self.url, token=self.token, timeout=self.timeout)
+        request_handler = http_handler.HTTPHandler(urls=self.url, token=self.token, timeout=self.timeout,
+                                                   lock=self.request_lock)
         uri = '/sync/items/' + sync_id
         request = request_handler.make_request(uri=uri,
                                                request_type='GET',
@@ -341,7 +557,8 @@ class PmsConnect(object):
 
         Output: array
         """
-        request_handler = http_handler.HTTPHandler(urls=self.url, token=self.token, timeout=self.timeout)
+        request_handler = http_handler.HTTPHandler(urls=self.url, token=self.token, timeout=self.timeout,
+                                                   lock=self.request_lock)
         uri = '/sync/transcodeQueue'
         request = request_handler.make_request(uri=uri,
                                                request_type='GET',
@@ -357,7 +574,8 @@ class PmsConnect(object):
 
         Output: array
         """
-        request_handler = http_handler.HTTPHandler(urls=self.url, token=self.token, timeout=self.timeout)
+        request_handler = http_handler.HTTPHandler(urls=self.url, token=self.token, timeout=self.timeout,
+                                                   lock=self.request_lock)
         uri = '/hubs/search?query=' + urllib.parse.quote(query.encode('utf8')) + '&limit=' + limit + '&includeCollections=1'
         request = request_handler.make_request(uri=uri,
                                                request_type='GET',
@@ -373,7 +591,8 @@ class PmsConnect(object):
 
         Output: array
         """
-        request_handler = http_handler.HTTPHandler(urls=self.url, token=self.token, timeout=self.timeout)
+        request_handler = http_handler.HTTPHandler(urls=self.url, token=self.token, timeout=self.timeout,
+                                                   lock=self.request_lock)
         uri = '/myplex/account'
         request = request_handler.make_request(uri=uri,
                                                request_type='GET',
@@ -389,7 +608,8 @@ class PmsConnect(object):
 
         Output: None
         """
-        request_handler = http_handler.HTTPHandler(urls=self.url, token=self.token, timeout=self.timeout)
+        request_handler = http_handler.HTTPHandler(urls=self.url, token=self.token, timeout=self.timeout,
+                                                   lock=self.request_lock)
         uri = '/myplex/refreshReachability'
         request = request_handler.make_request(uri=uri,
                                                request_type='PUT',
@@ -405,7 +625,8 @@ class PmsConnect(object):
 
         Output: array
         """
-        request_handler = http_handler.HTTPHandler(urls=self.url, token=self.token, timeout=self.timeout)
+        request_handler = http_handler.HTTPHandler(urls=self.url, token=self.token, timeout=self.timeout,
+                                                   lock=self.request_lock)
         uri = '/updater/check?download=0'
         request = request_handler.make_request(uri=uri,
                                                request_type='PUT',
@@ -421,7 +642,8 @@ class PmsConnect(object):
 
         Output: array
         """
-        request_handler = http_handler.HTTPHandler(urls=self.url, token=self.token, timeout=self.timeout)
+        request_handler = http_handler.HTTPHandler(urls=self.url, token=self.token, timeout=self.timeout,
+                                                   lock=self.request_lock)
         uri = '/updater/status'
         request = request_handler.make_request(uri=uri,
                                                request_type='GET',
@@ -441,7 +663,8 @@ class PmsConnect(object):
         Output: array
         """
         personal = '&personal=1' if other_video else ''
-        request_handler = http_handler.HTTPHandler(urls=self.url, token=self.token, timeout=self.timeout)
+        request_handler = http_handler.HTTPHandler(urls=self.url, token=self.token, timeout=self.timeout,
+                                                   lock=self.request_lock)
         uri = '/hubs/home/recentlyAdded?X-Plex-Container-Start=%s&X-Plex-Container-Size=%s&type=%s%s' \
               % (start, count, media_type, personal)
         request = request_handler.make_request(uri=uri,
@@ -593,24 +816,21 @@ class PmsConnect(object):
         metadata = {}
 
         if cache_key:
-            in_file_folder = os.path.join(plexpy.CONFIG.CACHE_DIR, 'session_metadata')
-            in_file_path = os.path.join(in_file_folder, 'metadata-sessionKey-%s-%s.json' % (self.server.CONFIG.ID, cache_key))
-
-            if not os.path.exists(in_file_folder):
-                os.mkdir(in_file_folder)
-
-            try:
-                with open(in_file_path, 'r') as inFile:
-                    metadata = json.load(inFile)
-            except (IOError, ValueError) as e:
-                pass
+            metadata, _cache_time = database.get_session_metadata(self.server_id, cache_key)
 
             if metadata:
-                _cache_time = metadata.pop('_cache_time', 0)
                 # Return cached metadata if less than METADATA_CACHE_SECONDS ago
                 if int(time.time()) - _cache_time <= plexpy.CONFIG.METADATA_CACHE_SECONDS:
                     return metadata
 
+        if rating_key and not sync_id:
+            cached_metadata = get_cached_metadata(self.server_id, rating_key, media_info)
+            if cached_metadata:
+                self._write_session_metadata_cache(cached_metadata, cache_key)
+                return cached_metadata
+
+        cache_generation = _metadata_cache_info['generation']
+
         if rating_key:
             metadata_xml = self.get_metadata(str(rating_key), output_format='xml')
         elif sync_id:
@@ -1360,26 +1580,21 @@ class PmsConnect(object):
             metadata['media_info'] = medias
 
         if metadata:
-            if cache_key:
-                metadata['_cache_time'] = int(time.time())
-
-                out_file_folder = os.path.join(plexpy.CONFIG.CACHE_DIR, 'session_metadata')
-                out_file_path = os.path.join(out_file_folder, 'metadata-sessionKey-%s-%s.json' % (self.server.CONFIG.ID, cache_key))
+            if rating_key and not sync_id:
+                set_cached_metadata(self.server_id, rating_key, metadata, media_info, cache_generation)
 
-                if not os.path.exists(out_file_folder):
-                    os.mkdir(out_file_folder)
-
-                try:
-                    with open(out_file_path, 'w') as outFile:
-                        json.dump(metadata, outFile)
-                except (IOError, ValueError) as e:
-                    logger.error(u"Tautulli Pmsconnect :: %s: Unable to create cache file for metadata (sessionKey %s): %s"
-                                 % (self.server.CONFIG.PMS_NAME, cache_key, e))
+            self._write_session_metadata_cache(metadata, cache_key)
 
             return metadata
         else:
             return metadata
 
+    def _write_session_metadata_cache(self, metadata, cache_key=None):
+        if cache_key:
+            if not database.set_session_metadata(self.server_id, cache_key, metadata):
+                logger.error(u"Tautulli Pmsconnect :: %s: Unable to cache metadata (sessionKey %s)"
+                             % (self.server.CONFIG.PMS_NAME, cache_key))
+
     def get_metadata_children_details(self, rating_key='', get_children=False):
         """
         Return processed and validated metadata list for all children of requested item.
@@ -1404,28 +1619,19 @@ class PmsConnect(object):
                 if a.getAttribute('size') == '0':
                     return metadata_list
 
-            if a.getElementsByTagName('Video'):
-                metadata_main = a.getElementsByTagName('Video')
-                for item in metadata_main:
-                    child_rating_key = helpers.get_xml_attr(item, 'ratingKey')
-                    metadata = self.get_metadata_details(str(child_rating_key))
-                    if metadata:
-                        metadata_list.append(metadata)
-
-            elif a.getElementsByTagName('Track'):
-                metadata_main = a.getElementsByTagName('Track')
-                for item in metadata_main:
-                    child_rating_key = helpers.get_xml_attr(item, 'ratingKey')
-                    metadata = self.get_metadata_details(str(child_rating_key))
+            if a.getElementsByTagName('Video') or a.getElementsByTagName('Track'):
+                metadata_main = a.getElementsByTagName('Video') or a.getElementsByTagName('Track')
+                child_rating_keys = [str(helpers.get_xml_attr(item, 'ratingKey')) for item in metadata_main]
+                for metadata in self.map_requests(self.get_metadata_details, child_rating_keys):
                     if metadata:
                         metadata_list.append(metadata)
 
             elif get_children and a.getElementsByTagName('Directory'):
                 dir_main = a.getElementsByTagName('Directory')
                 metadata_main = [d for d in dir_main if helpers.get_xml_attr(d, 'ratingKey')]
-                for item in metadata_main:
-                    child_rating_key = helpers.get_xml_attr(item, 'ratingKey')
-                    metadata = self.get_metadata_children_details(str(child_rating_key), get_children)
+                child_rating_keys = [str(helpers.get_xml_attr(item, 'ratingKey')) for item in metadata_main]
+                for metadata in self.map_requests(lambda k: self.get_metadata_children_details(k, get_children),
+                                                  child_rating_keys):
                     if metadata:
                         metadata_list.extend(metadata)
 
@@ -2439,17 +2645,10 @@ class PmsConnect(object):
 
         return output
 
-    def get_library_children_details(self, section_id='', section_type='', list_type='all', count='',
-                                     rating_key='', label_key='', get_media_info=False):
+    def _get_library_sort_type(self, section_type=''):
         """
-        Return processed and validated server library items list.
-
-        Parameters required:    section_type { movie, show, episode, artist }
-                                section_id { unique library key }
-
-        Output: array
+        Return the library list filter for a media type.
         """
-
         if section_type == 'movie':
             sort_type = '&type=1'
         elif section_type == 'show':
@@ -2475,59 +2674,78 @@ class PmsConnect(object):
         else:
             sort_type = ''
 
+        return sort_type
+
+    def get_library_children_details(self, section_id='', section_type='', list_type='all', count='',
+                                     rating_key='', label_key='', get_media_info=False, updated_since=''):
+        """
+        Return processed and validated server library items list.
+
+        Parameters required:    section_type { movie, show, episode, artist }
+                                section_id { unique library key }
+        Optional parameters:    updated_since { unix time, only items added or updated since }
+
+        Output: array
+        """
+
+        sort_type = self._get_library_sort_type(section_type)
+
+        # Newly added items are included since updatedAt is set when an item is added
+        if updated_since:
+            # Only the operator is encoded, the filter is the parameter 'updatedAt>>' with the timestamp as its value
+            sort_type += '&updatedAt%3E%3E=' + str(updated_since)
+
         if str(section_id).isdigit():
-            library_data = self.get_library_list(str(section_id), list_type, count, sort_type, label_key, output_format='xml')
+            library_data = self.get_library_list(str(section_id), list_type, count, sort_type, label_key, output_format='raw')
         elif str(rating_key).isdigit():
-            library_data = self.get_metadata_children(str(rating_key), output_format='xml')
+            library_data = self.get_metadata_children(str(rating_key), output_format='raw')
         else:
             logger.warn(u"Tautulli Pmsconnect :: %s: get_library_children called by invalid section_id or rating_key provided."
                         % self.server.CONFIG.PMS_NAME)
             return []
 
+        # Stream the items instead of building the DOM for the entire library
         try:
-            xml_head = library_data.getElementsByTagName('MediaContainer')
+            library_xml = helpers.iterparse_xml(library_data)
+            xml_head = next(library_xml)
+            if xml_head.tag != 'MediaContainer':
+                raise ValueError("unexpected root element '%s'" % xml_head.tag)
         except Exception as e:
             logger.warn(u"Tautulli Pmsconnect :: %s: Unable to parse XML for get_library_children_details: %s."
                         % (self.server.CONFIG.PMS_NAME, e))
             return []
 
-        children_list = []
+        if helpers.get_xml_attr(xml_head, 'size') == '0':
+            logger.debug(u"Tautulli Pmsconnect :: %s: No library data." % self.server.CONFIG.PMS_NAME)
+            children_list = {'library_count': '0',
+                             'children_list': []
+                             }
+            return children_list
 
-        for a in xml_head:
-            if a.getAttribute('size'):
-                if a.getAttribute('size') == '0':
-                    logger.debug(u"Tautulli Pmsconnect :: %s: No library data." % self.server.CONFIG.PMS_NAME)
-                    children_list = {'library_count': '0',
-                                     'children_list': []
-                                     }
-                    return children_list
+        if rating_key:
+            library_count = helpers.get_xml_attr(xml_head, 'size')
+        else:
+            library_count = helpers.get_xml_attr(xml_head, 'totalSize')
 
-            if rating_key:
-                library_count = helpers.get_xml_attr(xml_head[0], 'size')
-            else:
-                library_count = helpers.get_xml_attr(xml_head[0], 'totalSize')
+        library_section_id = helpers.get_xml_attr(xml_head, 'librarySectionID')
 
-            # Get show/season info from xml_head
+        # Keep the items grouped by element type in the same order as before
+        item_lists = {'Directory': [], 'Video': [], 'Track': [], 'Photo': []}
 
-            item_main = []
-            if a.getElementsByTagName('Directory'):
-                dir_main = a.getElementsByTagName('Directory')
-                item_main += [d for d in dir_main if helpers.get_xml_attr(d, 'ratingKey')]
-            if a.getElementsByTagName('Video'):
-                item_main += a.getElementsByTagName('Video')
-            if a.getElementsByTagName('Track'):
-                item_main += a.getElementsByTagName('Track')
-            if a.getElementsByTagName('Photo'):
-                item_main += a.getElementsByTagName('Photo')
+        try:
+            for item in library_xml:
+                if item.tag not in item_lists:
+                    continue
+                if item.tag == 'Directory' and not helpers.get_xml_attr(item, 'ratingKey'):
+                    continue
 
-            for item in item_main:
                 media_type = helpers.get_xml_attr(item, 'type')
-                if item.nodeName == 'Directory' and media_type == 'photo':
+                if item.tag == 'Directory' and media_type == 'photo':
                     media_type = 'photo_album'
 
                 item_info = {'server_id': self.server_id,
                              'server_name': self.server.CONFIG.PMS_NAME,
-                             'section_id': helpers.get_xml_attr(a, 'librarySectionID'),
+                             'section_id': library_section_id,
                              'media_type': media_type,
                              'rating_key': helpers.get_xml_attr(item, 'ratingKey'),
                              'parent_rating_key': helpers.get_xml_attr(item, 'parentRatingKey'),
@@ -2543,12 +2761,13 @@ class PmsConnect(object):
                              'thumb': helpers.get_xml_attr(item, 'thumb'),
                              'parent_thumb': helpers.get_xml_attr(item, 'thumb'),
                              'grandparent_thumb': helpers.get_xml_attr(item, 'grandparentThumb'),
-                             'added_at': helpers.get_xml_attr(item, 'addedAt')
+                             'added_at': helpers.get_xml_attr(item, 'addedAt'),
+                             'updated_at': helpers.get_xml_attr(item, 'updatedAt')
                              }
 
                 if get_media_info:
-                    item_media = item.getElementsByTagName('Media')
-                    for media in item_media:
+                    for media in item.iter('Media'):
+                        part = media.find('Part')
                         media_info = {'container': helpers.get_xml_attr(media, 'container'),
                                       'bitrate': helpers.get_xml_attr(media, 'bitrate'),
                                       'video_codec': helpers.get_xml_attr(media, 'videoCodec'),
@@ -2556,12 +2775,18 @@ class PmsConnect(object):
                                       'video_framerate': helpers.get_xml_attr(media, 'videoFrameRate'),
                                       'audio_codec': helpers.get_xml_attr(media, 'audioCodec'),
                                       'audio_channels': helpers.get_xml_attr(media, 'audioChannels'),
-                                      'file': helpers.get_xml_attr(media.getElementsByTagName('Part')[0], 'file'),
-                                      'file_size': helpers.get_xml_attr(media.getElementsByTagName('Part')[0], 'size'),
+                                      'file': helpers.get_xml_attr(part, 'file'),
+                                      'file_size': helpers.get_xml_attr(part, 'size'),
                                       }
                         item_info.update(media_info)
 
-                children_list.append(item_info)
+                item_lists[item.tag].append(item_info)
+        except Exception as e:
+            logger.warn(u"Tautulli Pmsconnect :: %s: Unable to parse XML for get_library_children_details: %s."
+                        % (self.server.CONFIG.PMS_NAME, e))
+            return []
+
+        children_list = item_lists['Directory'] + item_lists['Video'] + item_lists['Track'] + item_lists['Photo']
 
         output = {'library_count': library_count,
                   'children_list': children_list
@@ -2569,6 +2794,45 @@ class PmsConnect(object):
 
         return output
 
+    def get_library_rating_keys(self, section_id='', section_type=''):
+        """
+        Return the set of rating keys in a library, without the media info, to find deleted items.
+
+        Only the rating keys are requested from the server so the listing stays small for large libraries.
+
+        Parameters required:    section_id { unique library key }
+                                section_type { movie, show, artist, photo }
+
+        Output: set or None
+        """
+        if not str(section_id).isdigit():
+            logger.warn(u"Tautulli Pmsconnect :: %s: get_library_rating_keys called by invalid section_id provided."
+                        % self.server.CONFIG.PMS_NAME)
+            return None
+
+        sort_type = self._get_library_sort_type(section_type)
+        sort_type += '&includeFields=ratingKey' \
+                     '&excludeElements=Media,Genre,Country,Director,Writer,Role,Producer,Collection,Label,Field,Mood'
+        library_data = self.get_library_list(str(section_id), sort_type=sort_type, count='', output_format='raw')
+
+        try:
+            library_xml = helpers.iterparse_xml(library_data)
+            xml_head = next(library_xml)
+            if xml_head.tag != 'MediaContainer':
+                raise ValueError("unexpected root element '%s'" % xml_head.tag)
+
+            rating_keys = set()
+            for item in library_xml:
+                rating_key = helpers.get_xml_attr(item, 'ratingKey')
+                if rating_key and item.tag in ('Directory', 'Video', 'Track', 'Photo'):
+                    rating_keys.add(rating_key)
+        except Exception as e:
+            logger.warn(u"Tautulli Pmsconnect :: %s: Unable to parse XML for get_library_rating_keys: %s."
+                        % (self.server.CONFIG.PMS_NAME, e))
+            return None
+
+        return rating_keys
+
     def get_library_details(self):
         """
         Return processed and validated library statistics.
@@ -2700,7 +2964,8 @@ class PmsConnect(object):
             if blur:
                 params['blur'] = blur
 
-            request_handler = http_handler.HTTPHandler(urls=self.url, token=self.token, timeout=self.timeout)
+            request_handler = http_handler.HTTPHandler(urls=self.url, token=self.token, timeout=self.timeout,
+                                                       lock=self.request_lock)
             uri = '/photo/:/transcode?%s' % urllib.parse.urlencode(params)
             result = request_handler.make_request(uri=uri,
                                                   request_type='GET',
@@ -2846,16 +3111,20 @@ class PmsConnect(object):
             else:
                 parents_metadata = []
 
+            # get rating_keys for all of the parents at once
+            parents_metadata = [item for item in parents_metadata if helpers.get_xml_attr(item, 'ratingKey')]
+            children_xml = self.map_requests(
+                lambda item: self.get_metadata_children(str(helpers.get_xml_attr(item, 'ratingKey')),
+                                                        output_format='xml'),
+                parents_metadata)
+
             parents = {}
-            for item in parents_metadata:
+            for item, metadata in zip(parents_metadata, children_xml):
                 parent_rating_key = helpers.get_xml_attr(item, 'ratingKey')
                 parent_index = helpers.get_xml_attr(item, 'index')
                 parent_title = helpers.get_xml_attr(item, 'title')
 
                 if parent_rating_key:
-                    # get rating_keys
-                    metadata = self.get_metadata_children(str(parent_rating_key), output_format='xml')
-
                     try:
                         xml_head = metadata.getElementsByTagName('MediaContainer')
                     except Exception as e:
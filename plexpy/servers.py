@@ -24,6 +24,7 @@ from plexpy import activity_handler
 from plexpy import activity_processor
 from plexpy import activity_pinger
 from plexpy import database
+from plexpy import datafactory
 from plexpy import logger
 from plexpy.config import bool_int, ServerConfig
 from plexpy.web_socket import ServerWebSocket
@@ -610,6 +611,8 @@ class plexServer(object):
                 monitor_db.action('DELETE FROM '
                                   'session_history '
                                   'WHERE server_id = ?', [self.CONFIG.ID])
+            database.rebuild_history_rollups(server_id=self.CONFIG.ID)
+            datafactory.clear_home_stats_cache(server_id=self.CONFIG.ID)
             recently_added_del = \
                 monitor_db.action('DELETE FROM '
                                   'recently_added '
@@ -19,6 +19,7 @@ import json
 
 import plexpy
 from plexpy import database
+from plexpy import datafactory
 from plexpy import libraries
 from plexpy import logger
 from plexpy import servers
@@ -99,6 +100,8 @@ def import_from_tautulli(import_database=None, import_ignore_interval=0):
             import_tvmaze_lookup(import_db, monitor_db, old_server_id, new_server_id)
             import_recently_added(import_db, monitor_db, old_server_id, new_server_id)
             import_session_history(import_db, monitor_db, old_server_id, new_server_id, import_ignore_interval)
+            database.rebuild_history_rollups(server_id=new_server_id)
+            datafactory.clear_home_stats_cache(server_id=new_server_id)
             if new_server:
                 servers.plexServer(server)
 
@@ -143,11 +146,13 @@ def import_session_history(import_db, monitor_db, old_server_id, new_server_id,
 
         query = 'SELECT id, reference_id FROM session_history WHERE server_id = %s' % new_server_id
         session_history_result = monitor_db.select(query)
+        reference_rows = []
         for session_history in session_history_result:
             key_dict = {'id': session_history.pop('id')}
             if session_history['reference_id'] in session_history_lookup:
                 session_history['reference_id'] = session_history_lookup[session_history['reference_id']]
-                result = monitor_db.upsert('session_history', key_dict=key_dict, value_dict=session_history)
+                reference_rows.append((session_history, key_dict))
+        monitor_db.upsert_many('session_history', reference_rows)
 
         import_session_history_media_info(import_db, monitor_db, old_server_id, new_server_id, session_history_lookup)
         import_session_history_metadata(import_db, monitor_db, old_server_id, new_server_id, session_history_lookup)
@@ -167,6 +172,7 @@ def import_session_history_media_info(import_db, monitor_db, old_server_id, new_
     try:
         query = 'SELECT * FROM session_history_media_info WHERE server_id = %s' % old_server_id
         session_history_media_info_result = import_db.execute(query).fetchall()
+        args_list = []
         for session_history_media_info in session_history_media_info_result:
             if session_history_media_info['id'] in session_history_lookup:
                 session_history_media_info['id'] = session_history_lookup[session_history_media_info['id']]
@@ -175,7 +181,9 @@ def import_session_history_media_info(import_db, monitor_db, old_server_id, new_
                     "INSERT INTO session_history_media_info (" + ", ".join(session_history_media_info.keys()) + ")" +
                     " VALUES (" + ", ".join(["?"] * len(session_history_media_info.keys())) + ")"
                 )
-                monitor_db.action(query, list(session_history_media_info.values()))
+                args_list.append(list(session_history_media_info.values()))
+        if args_list:
+            monitor_db.executemany(query, args_list)
 
         logger.info(u"Tautulli Importer :: session_history_media_info imported.")
 
@@ -192,6 +200,7 @@ def import_session_history_metadata(import_db, monitor_db, old_server_id, new_se
     try:
         query = 'SELECT * FROM session_history_metadata WHERE server_id = %s' % old_server_id
         session_history_metadata_result = import_db.execute(query).fetchall()
+        args_list = []
         for session_history_metadata in session_history_metadata_result:
             if session_history_metadata['id'] in session_history_lookup:
                 session_history_metadata['id'] = session_history_lookup[session_history_metadata['id']]
@@ -201,7 +210,9 @@ def import_session_history_metadata(import_db, monitor_db, old_server_id, new_se
                     "INSERT INTO session_history_metadata (" + ", ".join(session_history_metadata.keys()) + ")" +
                     " VALUES (" + ", ".join(["?"] * len(session_history_metadata.keys())) + ")"
                 )
-                monitor_db.action(query, list(session_history_metadata.values()))
+                args_list.append(list(session_history_metadata.values()))
+        if args_list:
+            monitor_db.executemany(query, args_list)
 
         logger.info(u"Tautulli Importer :: session_history_metadata imported.")
 
@@ -218,13 +229,15 @@ def import_library_sections(import_db, monitor_db, old_server_id, new_server_id)
     try:
         query = 'SELECT * FROM library_sections WHERE server_id = %s' % old_server_id
         library_sections = import_db.execute(query).fetchall()
+        rows = []
         for library_section in library_sections:
             old_library_section_id = library_section.pop('id')
             library_section['server_id'] = new_server_id
             key_dict = {}
             key_dict['server_id'] = library_section.pop('server_id')
             key_dict['section_id'] = library_section.pop('section_id')
-            result = monitor_db.upsert('library_sections', key_dict=key_dict, value_dict=library_section)
+            rows.append((library_section, key_dict))
+        monitor_db.upsert_many('library_sections', rows)
 
         logger.info(u"Tautulli Importer :: library_sections imported.")
 
@@ -241,6 +254,7 @@ def import_recently_added(import_db, monitor_db, old_server_id, new_server_id):
     try:
         query = 'SELECT * FROM recently_added WHERE server_id = %s' % old_server_id
         recently_added_result = import_db.execute(query).fetchall()
+        rows = []
         for recently_added in recently_added_result:
             old_recently_added_id = recently_added.pop('id')
             recently_added['server_id'] = new_server_id
@@ -248,7 +262,8 @@ def import_recently_added(import_db, monitor_db, old_server_id, new_server_id):
             key_dict['server_id'] = recently_added.pop('server_id')
             key_dict['rating_key'] = recently_added.pop('rating_key')
             key_dict['added_at'] = recently_added.pop('added_at')
-            result = monitor_db.upsert('recently_added', key_dict=key_dict, value_dict=recently_added)
+            rows.append((recently_added, key_dict))
+        monitor_db.upsert_many('recently_added', rows)
 
         logger.info(u"Tautulli Importer :: recently_added imported.")
 
@@ -265,13 +280,15 @@ def import_themoviedb_lookup(import_db, monitor_db, old_server_id, new_server_id
     try:
         query = 'SELECT * FROM themoviedb_lookup WHERE server_id = %s' % old_server_id
         themoviedb_lookup_result = import_db.execute(query).fetchall()
+        rows = []
         for themoviedb_lookup in themoviedb_lookup_result:
             old_themoviedb_lookup_id = themoviedb_lookup.pop('id')
             themoviedb_lookup['server_id'] = new_server_id
             key_dict = {}
             key_dict['server_id'] = themoviedb_lookup.pop('server_id')
             key_dict['rating_key'] = themoviedb_lookup.pop('rating_key')
-            result = monitor_db.upsert('themoviedb_lookup', key_dict=key_dict, value_dict=themoviedb_lookup)
+            rows.append((themoviedb_lookup, key_dict))
+        monitor_db.upsert_many('themoviedb_lookup', rows)
 
         logger.info(u"Tautulli Importer :: themoviedb_lookup imported.")
 
@@ -288,13 +305,15 @@ def import_tvmaze_lookup(import_db, monitor_db, old_server_id, new_server_id):
     try:
         query = 'SELECT * FROM tvmaze_lookup WHERE server_id = %s' % old_server_id
         tvmaze_lookup_result = import_db.execute(query).fetchall()
+        rows = []
         for tvmaze_lookup in tvmaze_lookup_result:
             old_tvmaze_lookup_id = tvmaze_lookup.pop('id')
             tvmaze_lookup['server_id'] = new_server_id
             key_dict = {}
             key_dict['server_id'] = tvmaze_lookup.pop('server_id')
             key_dict['rating_key'] = tvmaze_lookup.pop('rating_key')
-            result = monitor_db.upsert('tvmaze_lookup', key_dict=key_dict, value_dict=tvmaze_lookup)
+            rows.append((tvmaze_lookup, key_dict))
+        monitor_db.upsert_many('tvmaze_lookup', rows)
 
         logger.info(u"Tautulli Importer :: tvmaze_lookup imported.")
 
@@ -404,6 +423,7 @@ def import_notify_log(import_db, monitor_db, old_notifier_id, new_notifier_id):
     try:
         query = 'SELECT * FROM notify_log WHERE notifier_id = %s' % old_notifier_id
         notify_log_result = import_db.execute(query).fetchall()
+        args_list = []
         for notify_log in notify_log_result:
             old_notify_log_id = notify_log.pop('id')
             notify_log['notifier_id'] = new_notifier_id
@@ -411,7 +431,9 @@ def import_notify_log(import_db, monitor_db, old_notifier_id, new_notifier_id):
                     "INSERT INTO notify_log (" + ", ".join(notify_log.keys()) + ")" +
                     " VALUES (" + ", ".join(["?"] * len(notify_log.keys())) + ")"
             )
-            monitor_db.action(query, list(notify_log.values()))
+            args_list.append(list(notify_log.values()))
+        if args_list:
+            monitor_db.executemany(query, args_list)
 
         logger.info(u"Tautulli Importer :: Notify_log imported for notifier ID %s." % old_notifier_id)
 
@@ -19,6 +19,7 @@ import time
 import plexpy
 from plexpy import common
 from plexpy import database
+from plexpy import datafactory
 from plexpy import datatables
 from plexpy import helpers
 from plexpy import libraries
@@ -33,45 +34,59 @@ def refresh_users():
     if result:
         monitor_db = database.MonitorDatabase()
 
+        avatar_urls = {row['user_id']: row for row in
+                       monitor_db.select('SELECT user_id, thumb, custom_avatar_url FROM users')}
+
+        user_rows = []
+        user_shared_libraries = {}
+
         for user in result:
 
             keys_dict = {"user_id": user.pop('user_id')}
 
             # Check if we've set a custom avatar if so don't overwrite it.
             if keys_dict['user_id']:
-                avatar_urls = monitor_db.select_single('SELECT thumb, custom_avatar_url '
-                                                'FROM users WHERE user_id = ?',
-                                                [keys_dict['user_id']])
-                if avatar_urls:
-                    if not avatar_urls['custom_avatar_url'] or \
-                            avatar_urls['custom_avatar_url'] == avatar_urls['thumb']:
+                avatar_url = avatar_urls.get(keys_dict['user_id'])
+                if avatar_url:
+                    if not avatar_url['custom_avatar_url'] or \
+                            avatar_url['custom_avatar_url'] == avatar_url['thumb']:
                         user['custom_avatar_url'] = user['thumb']
                 else:
                     user['custom_avatar_url'] = user['thumb']
 
-            shared_libraries = user.pop('shared_libraries') if 'shared_libraries' in user else []
+            user_shared_libraries[keys_dict['user_id']] = user.pop('shared_libraries') if 'shared_libraries' in user else []
+
+            user_rows.append((user, keys_dict))
+
+        monitor_db.upsert_many('users', user_rows)
 
-            monitor_db.upsert('users', user, keys_dict)
+        user_ids = {row['user_id']: row['id'] for row in monitor_db.select('SELECT id, user_id FROM users')}
 
-            shared_library_keys = monitor_db.select_single('SELECT id FROM users WHERE user_id = ?', [keys_dict['user_id']])
-            monitor_db.action('DELETE FROM user_shared_libraries WHERE id = ?', [shared_library_keys['id']])
+        monitor_db.executemany('DELETE FROM user_shared_libraries WHERE id = ?',
+                               [[user_ids[user_id]] for user_id in user_shared_libraries if user_id in user_ids])
 
-            if shared_libraries:
-                for shared_library in shared_libraries:
-                    server_id = shared_library.pop('server_id')
-                    server = plexpy.PMS_SERVERS.get_server_by_id(server_id)
-                    if not server.CONFIG.PMS_IS_DELETED:
-                        shared_library_keys['server_id'] = server_id
-                        if 'shared_libraries' in shared_library:
-                            for k, v in enumerate(shared_library['shared_libraries']):
-                                shared_library['shared_libraries'][k] = str(libraries.get_section_index(server_id, v))
-                            shared_library['shared_libraries'] = ';'.join(shared_library['shared_libraries'])
-                        elif 'server_token' in shared_library:
-                            libs = libraries.Libraries().get_sections(server_id=server_id)
-                            shared_library['shared_libraries'] = ';'.join([str(l['library_id']) for l in libs])
+        shared_library_rows = []
+        for user_id, shared_libraries in user_shared_libraries.items():
+            if user_id not in user_ids:
+                continue
 
-                        if 'shared_libraries' in shared_library:
-                            monitor_db.upsert('user_shared_libraries', shared_library, shared_library_keys)
+            for shared_library in shared_libraries:
+                server_id = shared_library.pop('server_id')
+                server = plexpy.PMS_SERVERS.get_server_by_id(server_id)
+                if not server.CONFIG.PMS_IS_DELETED:
+                    shared_library_keys = {'id': user_ids[user_id], 'server_id': server_id}
+                    if 'shared_libraries' in shared_library:
+                        for k, v in enumerate(shared_library['shared_libraries']):
+                            shared_library['shared_libraries'][k] = str(libraries.get_section_index(server_id, v))
+                        shared_library['shared_libraries'] = ';'.join(shared_library['shared_libraries'])
+                    elif 'server_token' in shared_library:
+                        libs = libraries.Libraries().get_sections(server_id=server_id)
+                        shared_library['shared_libraries'] = ';'.join([str(l['library_id']) for l in libs])
+
+                    if 'shared_libraries' in shared_library:
+                        shared_library_rows.append((shared_library, shared_library_keys))
+
+        monitor_db.upsert_many('user_shared_libraries', shared_library_rows)
 
         logger.info(u"Tautulli Users :: Users list refreshed.")
         return True
@@ -471,9 +486,9 @@ class Users(object):
                                 '   SUM(CASE WHEN paused_counter IS NULL THEN 0 ELSE paused_counter END)) AS total_time, ' \
                                 'COUNT(DISTINCT %s) AS total_plays ' \
                                 'FROM session_history ' \
-                                'WHERE datetime(stopped, "unixepoch", "localtime") >= datetime("now", "-%s days", "localtime") ' \
-                                'AND user_id = ? ' % (group_by, days)
-                        result = monitor_db.select(query, args=[user_id])
+                                'WHERE stopped >= ? ' \
+                                'AND user_id = ? ' % group_by
+                        result = monitor_db.select(query, args=[helpers.timestamp_days_ago(days), user_id])
                     else:
                         result = []
                 else:
@@ -684,6 +699,8 @@ class Users(object):
                     monitor_db.action('DELETE FROM '
                                       'session_history '
                                       'WHERE session_history.user_id = ?', [user_id])
+                database.rebuild_history_rollups(user_id=user_id)
+                datafactory.clear_home_stats_cache()
 
                 return 'Deleted all items for user_id %s.' % user_id
             else:
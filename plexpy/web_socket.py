@@ -16,6 +16,7 @@
 # Mostly borrowed from https://github.com/trakt/Plex-Trakt-Scrobbler
 
 import json
+import queue
 import threading
 import time
 
@@ -34,6 +35,194 @@ class ServerWebSocketThread(threading.Thread):
         self.server = server
 
 
+class SessionEventCoalescer(object):
+    """
+    Collapses the repeated progress notifications of a session within a window.
+
+    A notification which changes the state, item or transcode session is passed through
+    immediately. Otherwise only the latest notification is kept until the window has passed
+    since the last one handled for that session, and is then released by due.
+    """
+    TRANSITION_KEYS = ('state', 'ratingKey', 'key', 'transcodeSession')
+
+    def __init__(self):
+        self.sessions = {}
+        self.received = 0
+        self.handled = 0
+        self.lock = threading.Lock()
+
+    def add(self, timeline, window, now=None):
+        """ Returns the list of timelines to handle now """
+        now = now or time.time()
+        session_key = timeline.get('sessionKey')
+
+        with self.lock:
+            return self._add(timeline, session_key, window, now)
+
+    def _add(self, timeline, session_key, window, now):
+        self.received += 1
+
+        if window <= 0 or session_key is None:
+            self.handled += 1
+            return [timeline]
+
+        last = self.sessions.get(session_key)
+
+        if last is None or timeline.get('state') in ('stopped', 'buffering') or \
+                any(timeline.get(k) != last['timeline'].get(k) for k in self.TRANSITION_KEYS) or \
+                now - last['handled_at'] >= window:
+            if timeline.get('state') == 'stopped':
+                self.sessions.pop(session_key, None)
+            else:
+                self.sessions[session_key] = {'timeline': timeline, 'handled_at': now, 'pending': None}
+            self.handled += 1
+            return [timeline]
+
+        # Keep only the latest progress for the session
+        last['pending'] = timeline
+        return []
+
+    def due(self, window, now=None):
+        """ Returns the latest pending timeline of each session whose window has passed """
+        now = now or time.time()
+        timelines = []
+
+        with self.lock:
+            for last in self.sessions.values():
+                if last['pending'] and now - last['handled_at'] >= window:
+                    timelines.append(last['pending'])
+                    last['timeline'] = last['pending']
+                    last['handled_at'] = now
+                    last['pending'] = None
+
+            self.handled += len(timelines)
+
+        return timelines
+
+    def clear(self):
+        with self.lock:
+            self.sessions = {}
+
+
+class EventWorkerPool(object):
+    """
+    Handles the websocket events of a server on a pool of worker threads.
+
+    Each worker has its own bounded queue and events with the same key always go to the
+    same worker, so the events of a session are handled in the order they were received.
+    When a queue is full, put blocks the websocket thread until there is room again.
+    """
+    def __init__(self, server):
+        self.server = server
+        self.workers = []
+        self.queues = []
+        self.lock = threading.Lock()
+        self.processed = 0
+        self.blocked = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def start(self):
+        if self.workers:
+            return
+
+        num_workers = max(plexpy.CONFIG.WEBSOCKET_WORKERS, 1)
+        queue_size = max(plexpy.CONFIG.WEBSOCKET_QUEUE_SIZE, 1)
+
+        self.queues = [queue.Queue(maxsize=queue_size) for _ in range(num_workers)]
+        for i, q in enumerate(self.queues):
+            worker = threading.Thread(target=self.run, args=(q,),
+                                      name='WebSocketWorker-%s-%s' % (self.server.CONFIG.PMS_NAME, i))
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+    def stop(self, timeout=10):
+        deadline = time.time() + timeout
+
+        for q in self.queues:
+            try:
+                q.put(None, timeout=max(deadline - time.time(), 0.1))
+            except queue.Full:
+                logger.warn(u"Tautulli WebSocket :: %s: Event queue is still full, not waiting for the worker to stop."
+                            % self.server.CONFIG.PMS_NAME)
+
+        for worker in self.workers:
+            worker.join(timeout=max(deadline - time.time(), 0.1))
+
+        self.workers = []
+        self.queues = []
+
+    def put(self, key, func, *args):
+        if not self.queues:
+            func(*args)
+            return
+
+        q = self.queues[hash(str(key)) % len(self.queues)]
+        item = (time.time(), func, args)
+
+        try:
+            q.put_nowait(item)
+        except queue.Full:
+            with self.lock:
+                self.blocked += 1
+                blocked = self.blocked
+            if blocked % 100 == 1:
+                logger.warn(u"Tautulli WebSocket :: %s: Event queue is full, waiting for the workers to catch up."
+                            % self.server.CONFIG.PMS_NAME)
+            q.put(item)
+
+    def run(self, q):
+        while True:
+            item = q.get()
+            if item is None:
+                break
+
+            queued_at, func, args = item
+            try:
+                func(*args)
+            except Exception as e:
+                logger.error(u"Tautulli WebSocket :: %s: Failed to process event: %s." % (self.server.CONFIG.PMS_NAME, e))
+
+            latency = time.time() - queued_at
+            with self.lock:
+                self.processed += 1
+                self.total_latency += latency
+                self.max_latency = max(self.max_latency, latency)
+
+    def get_stats(self):
+        with self.lock:
+            return {'workers': len(self.workers),
+                    'queue_depth': sum(q.qsize() for q in self.queues),
+                    'queue_size': sum(q.maxsize for q in self.queues),
+                    'processed': self.processed,
+                    'blocked': self.blocked,
+                    'avg_latency_ms': round(self.total_latency * 1000 / self.processed, 1) if self.processed else 0,
+                    'max_latency_ms': round(self.max_latency * 1000, 1)
+                    }
+
+
+def get_queue_stats():
+    """
+    Returns the websocket event queue metrics for each server.
+    """
+    stats = []
+    if not plexpy.PMS_SERVERS:
+        return stats
+
+    for server in plexpy.PMS_SERVERS:
+        ws = getattr(server, 'WS', None)
+        if not ws:
+            continue
+
+        server_stats = {'server_id': server.CONFIG.ID,
+                        'server_name': server.CONFIG.PMS_NAME}
+        server_stats.update(ws.workers.get_stats())
+        stats.append(server_stats)
+
+    return stats
+
+
 class ServerWebSocket(object):
 
     WS_CONNECTION = None
@@ -48,18 +237,45 @@ class ServerWebSocket(object):
     def __init__(self, server, ready=None):
         self.server = server
         self.ready = ready
+        self.coalescer = SessionEventCoalescer()
+        self.coalesce_thread = None
+        self.coalesce_stop = threading.Event()
+        self.workers = EventWorkerPool(server)
 
     def start(self):
         self.WS_THREAD = ServerWebSocketThread(self.server, name="WebSocket-" + self.server.CONFIG.PMS_NAME, target=self.connect)
         self.WS_THREAD.daemon = True
         if not self.WS_THREAD.isAlive():
+            self.workers.start()
+            self.start_coalesce_timer()
             self.WS_THREAD.start()
 
+    def start_coalesce_timer(self):
+        if self.coalesce_thread and self.coalesce_thread.is_alive():
+            return
+
+        self.coalesce_stop.clear()
+        self.coalesce_thread = threading.Thread(target=self.release_coalesced,
+                                                name="WebSocketCoalesce-" + self.server.CONFIG.PMS_NAME)
+        self.coalesce_thread.daemon = True
+        self.coalesce_thread.start()
+
+    def release_coalesced(self):
+        # Check every second so the held back progress is handled at most a second after its window,
+        # even when the server sends no more notifications
+        while not self.coalesce_stop.wait(1):
+            for timeline in self.coalescer.due(plexpy.CONFIG.WEBSOCKET_COALESCE_WINDOW):
+                self.workers.put(timeline['sessionKey'], self.process_session, timeline)
+
     def shutdown(self):
         logger.info(u"Tautulli WebSocket :: %s: Shutting Down Websocket..." % self.server.CONFIG.PMS_NAME)
         self.ws_shutdown = True
         self.close()
         self.WS_THREAD.join(timeout=30)
+        self.coalesce_stop.set()
+        if self.coalesce_thread:
+            self.coalesce_thread.join(timeout=5)
+        self.workers.stop()
 
     def close(self):
         logger.info(u"Tautulli WebSocket :: %s: Disconnecting websocket..." % self.server.CONFIG.PMS_NAME)
@@ -186,6 +402,7 @@ class ServerWebSocket(object):
             plexpy.NOTIFY_QUEUE.put({'notify_action': 'on_intdown', 'server_id': self.server.CONFIG.ID})
             self.server.PLEX_SERVER_UP = False
 
+        self.coalescer.clear()
         activity_processor.ActivityProcessor(server=self.server).set_temp_stopped()
         self.server.initialize_scheduler()
 
@@ -256,11 +473,8 @@ class ServerWebSocket(object):
                 logger.debug(u"Tautulli WebSocket :: %s: Session found but unable to get timeline data." % self.server.CONFIG.PMS_NAME)
                 return False
 
-            try:
-                activity = activity_handler.ActivityHandler(self.server, timeline=time_line[0])
-                activity.process()
-            except Exception as e:
-                logger.error(u"Tautulli WebSocket :: %s: Failed to process session data: %s." % (self.server.CONFIG.PMS_NAME, e))
+            for timeline in self.coalescer.add(time_line[0], plexpy.CONFIG.WEBSOCKET_COALESCE_WINDOW):
+                self.workers.put(timeline.get('sessionKey'), self.process_session, timeline)
 
         if type == 'timeline':
             time_line = info.get('TimelineEntry', info.get('_children', {}))
@@ -269,10 +483,21 @@ class ServerWebSocket(object):
                 logger.debug(u"Tautulli WebSocket :: %s: Timeline event found but unable to get timeline data." % self.server.CONFIG.PMS_NAME)
                 return False
 
-            try:
-                activity = activity_handler.TimelineHandler(self.server, timeline=time_line[0])
-                activity.process()
-            except Exception as e:
-                logger.error(u"Tautulli WebSocket :: %s: Failed to process timeline data: %s." % (self.server.CONFIG.PMS_NAME, e))
+            # Library timeline events share the recently added queue, so they are all handled by one worker
+            self.workers.put('timeline', self.process_timeline, time_line[0])
 
         return True
+
+    def process_session(self, timeline):
+        try:
+            activity = activity_handler.ActivityHandler(self.server, timeline=timeline)
+            activity.process()
+        except Exception as e:
+            logger.error(u"Tautulli WebSocket :: %s: Failed to process session data: %s." % (self.server.CONFIG.PMS_NAME, e))
+
+    def process_timeline(self, timeline):
+        try:
+            activity = activity_handler.TimelineHandler(self.server, timeline=timeline)
+            activity.process()
+        except Exception as e:
+            logger.error(u"Tautulli WebSocket :: %s: Failed to process timeline data: %s." % (self.server.CONFIG.PMS_NAME, e))
@@ -38,6 +38,7 @@ from plexpy import database
 from plexpy import datafactory
 from plexpy import graphs
 from plexpy import helpers
+from plexpy import http_handler
 from plexpy import libraries
 from plexpy import log_reader
 from plexpy import logger
@@ -47,11 +48,13 @@ from plexpy import mobile_app
 from plexpy import notification_handler
 from plexpy import notifiers
 from plexpy import plextv
+from plexpy import pmsconnect
 from plexpy import plexivity_import
 from plexpy import plexwatch_import
 from plexpy import tautulli_import
 from plexpy import users
 from plexpy import versioncheck
+from plexpy import web_socket
 from plexpy.api2 import API2
 from plexpy.helpers import checked, addtoapi, get_ip, create_https_certificates, build_datatables_json
 from plexpy.session import get_session_info, get_session_user_id, allow_session_user, allow_session_library
@@ -371,6 +374,35 @@ class WebInterface(object):
         else:
             return {'result': 'error', 'message': 'Flush sessions failed.'}
 
+    @cherrypy.expose
+    @cherrypy.tools.json_out()
+    @requireAuth(member_of("admin"))
+    @addtoapi()
+    def rebuild_graph_rollups(self, server_id=None, user_id=None, **kwargs):
+        """ Rebuild the hourly play totals used by the play count graphs from the history.
+
+            ```
+            Required parameters:
+                None
+
+            Optional parameters:
+                server_id (int):        Only rebuild the totals for a single server
+                user_id (int):          Only rebuild the totals for a single user
+
+            Returns:
+                None
+            ```
+        """
+        server_id = int(server_id) if str(server_id).isdigit() else None
+        user_id = int(user_id) if str(user_id).isdigit() else None
+
+        result = database.rebuild_history_rollups(server_id=server_id, user_id=user_id)
+
+        if result:
+            return {'result': 'success', 'message': 'Graph rollups rebuilt.'}
+        else:
+            return {'result': 'error', 'message': 'Rebuilding graph rollups failed.'}
+
     ##### Libraries #####
 
     @cherrypy.expose
@@ -751,31 +783,32 @@ class WebInterface(object):
     @cherrypy.tools.json_out()
     @requireAuth(member_of("admin"))
     def get_media_info_file_sizes(self, library_id=None, rating_key=None, **kwargs):
-        get_file_sizes_hold = plexpy.CONFIG.GET_FILE_SIZES_HOLD
-        section_ids = set(get_file_sizes_hold['section_ids'])
-        rating_keys = set(get_file_sizes_hold['rating_keys'])
-
-        if (library_id and library_id not in section_ids) or (rating_key and rating_key not in rating_keys):
-            if library_id:
-                section_ids.add(library_id)
-            elif rating_key:
-                rating_keys.add(rating_key)
-            plexpy.CONFIG.GET_FILE_SIZES_HOLD = {'section_ids': list(section_ids), 'rating_keys': list(rating_keys)}
-
-            library_data = libraries.Libraries()
-            result = library_data.get_media_info_file_sizes(id=library_id,
-                                                            rating_key=rating_key)
-
-            if library_id:
-                section_ids.remove(library_id)
-            elif rating_key:
-                rating_keys.remove(rating_key)
-            plexpy.CONFIG.GET_FILE_SIZES_HOLD = {'section_ids': list(section_ids), 'rating_keys': list(rating_keys)}
+        if libraries.add_file_sizes_hold(section_id=library_id, rating_key=rating_key):
+            try:
+                library_data = libraries.Libraries()
+                result = library_data.get_media_info_file_sizes(id=library_id,
+                                                                rating_key=rating_key)
+            finally:
+                libraries.remove_file_sizes_hold(section_id=library_id, rating_key=rating_key)
         else:
             result = False
 
         return {'success': result}
 
+    @cherrypy.expose
+    @cherrypy.tools.json_out()
+    @requireAuth(member_of("admin"))
+    def get_media_info_file_sizes_progress(self, library_id=None, rating_key=None, **kwargs):
+        library_data = libraries.Libraries()
+        library_details = library_data.get_details(id=library_id)
+
+        if not library_details['section_id'] or (rating_key and not str(rating_key).isdigit()):
+            return {}
+
+        return libraries.get_file_sizes_progress(server_id=library_details['server_id'],
+                                                 section_id=library_details['section_id'],
+                                                 rating_key=rating_key)
+
     @cherrypy.expose
     @cherrypy.tools.json_out()
     @requireAuth(member_of("admin"))
@@ -1641,6 +1674,11 @@ class WebInterface(object):
                 start (int):                    Row to start from, 0
                 length (int):                   Number of items to return, 25
                 search (str):                   A string to search for, "Thrones"
+                cursor (str):                   Page through the history newest to oldest by (started, id)
+                                                instead of start. Pass an empty cursor for the first page, then
+                                                the returned next_cursor or prev_cursor. Ignores order_column,
+                                                order_dir and start, and does not include the current activity.
+                                                recordsTotal, recordsFiltered and total_duration are null.
 
             Returns:
                 json:
@@ -1649,6 +1687,8 @@ class WebInterface(object):
                      "recordsFiltered": 250,
                      "total_duration": "42 days 5 hrs 18 mins",
                      "filter_duration": "10 hrs 12 mins",
+                     "next_cursor": "eyJkaXIiOiAibmV4dCIsICJ2YWx1ZXMiOiBbMTQ2MjY4ODEwNywgMTEyNF19",
+                     "prev_cursor": null,
                      "data":
                         [{"date": 1462687607,
                           "duration": 263,
@@ -2190,6 +2230,42 @@ class WebInterface(object):
         else:
             logger.warn(u"Unable to retrieve data for get_plays_by_stream_type.")
 
+    @cherrypy.expose
+    @cherrypy.tools.json_out()
+    @requireAuth()
+    @addtoapi()
+    def get_concurrent_streams_by_date(self, time_range='30', server_id=None, user_id=None, **kwargs):
+        """ Get graph data for the most concurrent streams by date.
+
+            ```
+            Required parameters:
+                None
+
+            Optional parameters:
+                time_range (str):       The number of days of data to return
+                user_id (str):          The user id to filter the data
+
+            Returns:
+                json:
+                    {"categories":
+                        ["YYYY-MM-DD", "YYYY-MM-DD", ...]
+                     "series":
+                        [{"name": "Direct Play", "data": [...]}
+                         {"name": "Direct Stream", "data": [...]},
+                         {"name": "Transcode", "data": [...]},
+                         {"name": "Total", "data": [...]}
+                         ]
+                     }
+            ```
+        """
+        graph = graphs.Graphs()
+        result = graph.get_concurrent_streams_per_day(time_range=time_range, server_id=server_id, user_id=user_id)
+
+        if result:
+            return result
+        else:
+            logger.warn(u"Unable to retrieve data for get_concurrent_streams_by_date.")
+
     @cherrypy.expose
     @cherrypy.tools.json_out()
     @requireAuth()
@@ -4360,13 +4436,79 @@ class WebInterface(object):
         try:
             db = database.MonitorDatabase()
             db.connection.execute('begin immediate')
-            shutil.copyfile(plexpy.DB_FILE, os.path.join(plexpy.CONFIG.CACHE_DIR, database_file))
-            db.connection.rollback()
+            try:
+                shutil.copyfile(plexpy.DB_FILE, os.path.join(plexpy.CONFIG.CACHE_DIR, database_file))
+            finally:
+                db.connection.rollback()
         except:
             pass
 
         return serve_download(os.path.join(plexpy.CONFIG.CACHE_DIR, database_file), name=database_file)
 
+    @cherrypy.expose
+    @cherrypy.tools.json_out()
+    @requireAuth(member_of("admin"))
+    @addtoapi()
+    def get_query_plans(self, benchmark=0, **kwargs):
+        """ Get the query plans of the frequently used Tautulli database queries
+            and report which ones fall back to full table scans.
+
+            ```
+            Required parameters:
+                None
+
+            Optional parameters:
+                benchmark (int):        1 to also time each query
+
+            Returns:
+                json:
+                    [{"name": "history_by_user",
+                      "query": "SELECT id FROM session_history WHERE user_id = ? ORDER BY started DESC LIMIT 25",
+                      "plan": ["SEARCH session_history USING INDEX idx_session_history_user_started (user_id=?)"],
+                      "full_scans": [],
+                      "duration_ms": 0.153
+                      },
+                     {...}
+                     ]
+            ```
+        """
+        return database.audit_queries(benchmark=bool(helpers.cast_to_int(benchmark)))
+
+    @cherrypy.expose
+    @cherrypy.tools.json_out()
+    @requireAuth(member_of("admin"))
+    @addtoapi()
+    def get_database_stats(self, **kwargs):
+        """ Get the Tautulli database connection and write lock statistics.
+
+            ```
+            Required parameters:
+                None
+
+            Optional parameters:
+                None
+
+            Returns:
+                json:
+                    {"journal_mode": "wal",
+                     "concurrent_reads": true,
+                     "connections": 4,
+                     "write_lock": {"acquisitions": 1520,
+                                    "total_wait": 3.2571,
+                                    "avg_wait": 0.0021,
+                                    "max_wait": 0.8124
+                                    }
+                     }
+            ```
+        """
+        connection = database.MonitorDatabase().connection
+
+        return {'journal_mode': connection.journal_mode,
+                'concurrent_reads': connection.concurrent_reads,
+                'connections': database.POOL.size(),
+                'write_lock': database.get_lock_stats()
+                }
+
     @cherrypy.expose
     @requireAuth(member_of("admin"))
     @addtoapi()
@@ -4446,6 +4588,9 @@ class WebInterface(object):
             logger.exception('Failed to create %s: %s.' % (cache_dir, e))
             return {'result': result, 'message': msg}
 
+        if folder in ('', 'http_cache'):
+            http_handler.response_cache.clear()
+
         logger.info(msg)
         return {'result': result, 'message': msg}
 
@@ -4839,6 +4984,35 @@ class WebInterface(object):
         else:
             logger.warn(u"Unable to retrieve data for get_metadata_details.")
 
+    @cherrypy.expose
+    @cherrypy.tools.json_out()
+    @requireAuth(member_of("admin"))
+    @addtoapi()
+    def get_metadata_cache_info(self, **kwargs):
+        """ Get the metadata cache size and hit/miss/eviction counters.
+
+            ```
+            Required parameters:
+                None
+
+            Optional parameters:
+                None
+
+            Returns:
+                json:
+                    {"size": 412,
+                     "max_size": 1000,
+                     "ttl": 1800,
+                     "hits": 2318,
+                     "misses": 530,
+                     "hit_ratio": 0.8139,
+                     "evictions": 0,
+                     "invalidations": 87
+                     }
+            ```
+        """
+        return pmsconnect.get_metadata_cache_info()
+
     @cherrypy.expose
     @cherrypy.tools.json_out()
     @requireAuth(member_of("admin"))
@@ -5431,6 +5605,97 @@ class WebInterface(object):
         else:
             logger.warn(u"Unable to retrieve data for get_home_stats.")
 
+    @cherrypy.expose
+    @cherrypy.tools.json_out()
+    @requireAuth(member_of("admin"))
+    @addtoapi()
+    def get_home_stats_cache_info(self, **kwargs):
+        """ Get the home stats cache size and hit/miss counters.
+
+            ```
+            Required parameters:
+                None
+
+            Optional parameters:
+                None
+
+            Returns:
+                json:
+                    {"size": 24,
+                     "ttl": 300,
+                     "hits": 812,
+                     "misses": 96,
+                     "hit_ratio": 0.8943,
+                     "invalidations": 41
+                     }
+            ```
+        """
+        return datafactory.get_home_stats_cache_info()
+
+    @cherrypy.expose
+    @cherrypy.tools.json_out()
+    @requireAuth(member_of("admin"))
+    @addtoapi()
+    def get_http_pool_stats(self, **kwargs):
+        """ Get the request and connection counts for each pooled HTTP host.
+
+            ```
+            Required parameters:
+                None
+
+            Optional parameters:
+                None
+
+            Returns:
+                json:
+                    [{"host": "https://10.0.0.97:32400",
+                      "ssl_verify": true,
+                      "maxsize": 10,
+                      "requests": 1520,
+                      "connections": 4,
+                      "reused": 1516,
+                      "reuse_ratio": 0.9974
+                      },
+                     {...},
+                     {...}
+                     ]
+            ```
+        """
+        return http_handler.get_pool_stats()
+
+    @cherrypy.expose
+    @cherrypy.tools.json_out()
+    @requireAuth(member_of("admin"))
+    @addtoapi()
+    def get_websocket_queue_stats(self, **kwargs):
+        """ Get the websocket event queue depth and processing latency for each server.
+
+            ```
+            Required parameters:
+                None
+
+            Optional parameters:
+                None
+
+            Returns:
+                json:
+                    [{"server_id": 1,
+                      "server_name": "My Plex Server",
+                      "workers": 4,
+                      "queue_depth": 0,
+                      "queue_size": 2000,
+                      "processed": 8342,
+                      "blocked": 0,
+                      "avg_latency_ms": 12.4,
+                      "max_latency_ms": 2310.7
+                      },
+                     {...},
+                     {...}
+                     ]
+            ```
+        """
+        return web_socket.get_queue_stats()
+
     @cherrypy.expose
     @requireAuth(member_of("admin"))
     @addtoapi("arnold")